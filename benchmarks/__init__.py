@@ -0,0 +1,43 @@
+"""Benchmarks of the SDK, see ``benchmarks/README.md``"""
+
+import json
+import platform
+import sys
+from pathlib import Path
+from typing import Any, Mapping
+
+
+def write_results(path: Path, results: Any, **settings):
+    """Write the results to a JSON file, along with what they were measured with"""
+    report = {"python": platform.python_version(), "machine": platform.machine(), **settings, "results": results}
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def read_results(path: Path) -> Any:
+    return json.loads(path.read_text())["results"]
+
+
+def compare(current: Mapping[str, float], baseline: Mapping[str, float], threshold: float) -> list[str]:
+    """
+    Print how each timing changed since the baseline, returning the ones that got slower by more than the threshold.
+    Timings are in seconds, lower is better.
+    """
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, seconds in current.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40} {'-':>12} {seconds * 1e6:>10.2f}us")
+            continue
+
+        change = seconds / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {before * 1e6:>10.2f}us {seconds * 1e6:>10.2f}us {change:>+8.1%}{flag}")
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}", file=sys.stderr)
+
+    return regressions
@@ -0,0 +1,178 @@
+"""
+Microbenchmarks of state decoding, encoding and comparison, over synthetic schemas.
+
+Usage::
+
+    python -m benchmarks.codec --output results.json
+    python -m benchmarks.codec --baseline results.json --filter 'decode/*'
+
+With ``--baseline``, each benchmark is compared against the same benchmark in an earlier ``--output``, and the run
+fails if any of them got slower by more than ``--threshold``.
+"""
+
+import argparse
+import fnmatch
+import statistics
+import sys
+import timeit
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from benchmarks import compare, read_results, write_results
+from tf.blocks import SetNestedBlock
+from tf.codec import StateCodec
+from tf.provider import _encode_state
+from tf.schema import Attribute, Block, NestedBlock, Schema
+from tf.types import Bool, List, NormalizedJson, Number, Set, String, TfType
+from tf.utils import Diagnostics, read_dynamic_value, to_dynamic_value
+
+
+@dataclass(frozen=True)
+class Case:
+    """A schema, and a decoded state of it"""
+
+    name: str
+    schema: Schema
+    state: dict
+
+
+def _primitive(i: int) -> tuple[TfType, Any]:
+    return [(String(), f"value-{i}"), (Number(), i), (Bool(), i % 2 == 0)][i % 3]
+
+
+def _collection(i: int, size: int) -> tuple[TfType, Any]:
+    return [
+        (List(String()), [f"item-{j}" for j in range(size)]),
+        (Set(Number()), list(range(size))),
+        (NormalizedJson(), {f"key-{j}": {"nested": [j, str(j)]} for j in range(size)}),
+    ][i % 3]
+
+
+def _block(width: int, depth: int, elements: int) -> tuple[list[Attribute], list[NestedBlock], dict]:
+    """Attributes, nested blocks and a state with ``elements`` elements in each block, ``depth`` blocks deep"""
+    typed = [_primitive(i) for i in range(width)]
+    attributes = [Attribute(f"attr_{i}", t) for i, (t, _) in enumerate(typed)]
+    state = {f"attr_{i}": v for i, (_, v) in enumerate(typed)}
+
+    if not depth:
+        return attributes, [], state
+
+    child_attributes, child_blocks, child_state = _block(width, depth - 1, elements)
+    block = SetNestedBlock("child", Block(attributes=child_attributes, block_types=child_blocks))
+    # Elements of a set must differ
+    state["child"] = [{**child_state, "attr_0": f"element-{j}"} for j in range(elements)]
+    return attributes, [block], state
+
+
+def _cases() -> list[Case]:
+    cases = []
+
+    for width in [10, 100]:
+        attributes, _, state = _block(width, 0, 0)
+        cases.append(Case(f"primitives-{width}", Schema(attributes=attributes), state))
+
+    for size in [10, 1000]:
+        typed = [_collection(i, size) for i in range(3)]
+        attributes = [Attribute(f"attr_{i}", t) for i, (t, _) in enumerate(typed)]
+        state = {f"attr_{i}": v for i, (_, v) in enumerate(typed)}
+        cases.append(Case(f"collections-{size}", Schema(attributes=attributes), state))
+
+    for elements in [10, 1000, 10000]:
+        attributes, blocks, state = _block(5, 1, elements)
+        cases.append(Case(f"blocks-{elements}", Schema(attributes=attributes, block_types=blocks), state))
+
+    attributes, blocks, state = _block(5, 3, 10)
+    cases.append(Case("nested-3x10", Schema(attributes=attributes, block_types=blocks), state))
+
+    return cases
+
+
+def _reordered(value: Any) -> Any:
+    """A semantically equal copy, with collections in reverse order"""
+    if isinstance(value, list):
+        return [_reordered(v) for v in reversed(value)]
+    if isinstance(value, dict):
+        return {k: _reordered(value[k]) for k in reversed(value)}
+    return value
+
+
+def _benchmarks(case: Case) -> dict[str, Callable[[], Any]]:
+    """What to time for the case, by operation"""
+    codec = StateCodec.from_schema(case.schema)
+    complex_fields = [
+        (a.name, a.type) for a in case.schema.attributes if type(a.type) not in (String, Number, Bool)
+    ] + [(b.type_name, b) for b in case.schema.block_types]
+
+    encoded = codec.encode(case.state, None)
+    value = to_dynamic_value(encoded)
+    old, decoded = codec.decode_dynamic(Diagnostics(), value)
+    old_keys = codec.fingerprint(decoded)
+    other = _reordered(decoded)
+
+    def unchanged():
+        # What ReadResource does with a state that comes back as it was: decode, snapshot, encode
+        old, decoded = codec.decode_dynamic(Diagnostics(), value)
+        _encode_state(codec, decoded, old, codec.fingerprint(decoded))
+
+    def semantically_equal():
+        for name, t in complex_fields:
+            t.semantically_equal(decoded[name], other[name])  # pyre-ignore[16]
+
+    return {
+        "read_dynamic_value": lambda: read_dynamic_value(value),
+        "to_dynamic_value": lambda: to_dynamic_value(encoded),
+        "decode": lambda: codec.decode_dynamic(Diagnostics(), value),
+        "encode": lambda: _encode_state(codec, decoded, None),
+        # Plan and read: the state comes back unchanged, so every field reuses its old encoding
+        "encode_unchanged": lambda: _encode_state(codec, decoded, old, old_keys),
+        "roundtrip_unchanged": unchanged,
+        "semantically_equal": semantically_equal,
+    }
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> dict:
+    timer = timeit.Timer(fn)
+    # Enough loops to take 0.2s
+    loops, _ = timer.autorange()
+    times = [t / loops for t in timer.repeat(repeat, loops)]
+    return {"best": min(times), "median": statistics.median(times), "loops": loops, "repeat": repeat}
+
+
+def run(patterns: list[str], repeat: int) -> dict[str, dict]:
+    """Seconds per call of the benchmarks matching any of the patterns, by ``operation/case``"""
+    results = {}
+    for case in _cases():
+        for op, fn in _benchmarks(case).items():
+            name = f"{op}/{case.name}"
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                results[name] = _measure(fn, repeat)
+                print(f"{name:<40} {results[name]['best'] * 1e6:>12.2f}us", file=sys.stderr)
+
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.codec", description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--filter", action="append", help="Only run benchmarks matching this glob, e.g. 'decode/*'")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs per benchmark, the best one is reported")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter or ["*"], args.repeat)
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.baseline:
+        baseline = {name: result["best"] for name, result in read_results(args.baseline).items()}
+        if compare({name: result["best"] for name, result in results.items()}, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
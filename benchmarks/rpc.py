@@ -0,0 +1,356 @@
+"""
+End-to-end RPC throughput of a provider, over its unix socket.
+
+Usage::
+
+    python -m benchmarks.rpc --mix plan --concurrency 8 --duration 10
+    python -m benchmarks.rpc --mix apply --aio --output results.json
+
+The provider is served in dev mode (``run_provider(..., ["--dev"])``) in a child process, and threads of this process
+replay the RPCs TF makes for each resource of a plan or apply against it, as fast as it answers.
+Latency is measured per RPC by the client, and CPU time by the provider process.
+Server settings are read from the environment as usual, e.g. ``TF_PLUGIN_MAX_WORKERS``.
+"""
+
+import argparse
+import itertools
+import json
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional, Type
+
+from benchmarks import compare, read_results, write_results
+from tf import runner
+from tf import types as t
+from tf.blocks import SetNestedBlock
+from tf.iface import (
+    Config,
+    CreateContext,
+    DataSource,
+    DeleteContext,
+    Provider,
+    ReadContext,
+    ReadDataContext,
+    Resource,
+    State,
+    UpdateContext,
+)
+from tf.schema import Attribute, Block, Schema
+from tf.utils import Diagnostics
+
+# ----------------- The provider ----------------- #
+
+
+class Item(Resource):
+    """A resource with a bit of everything in its schema, kept nowhere"""
+
+    def __init__(self, provider: "BenchProvider"):
+        pass
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "item"
+
+    @classmethod
+    def get_schema(cls) -> Schema:
+        return Schema(
+            attributes=[
+                Attribute("id", t.String(), computed=True),
+                Attribute("name", t.String(), required=True, requires_replace=True),
+                Attribute("size", t.Number(), optional=True),
+                Attribute("enabled", t.Bool(), optional=True),
+                Attribute("tags", t.Set(t.String()), optional=True),
+                Attribute("settings", t.NormalizedJson(), optional=True),
+            ],
+            block_types=[
+                SetNestedBlock(
+                    "rule",
+                    Block(
+                        attributes=[
+                            Attribute("port", t.Number(), required=True),
+                            Attribute("protocol", t.String(), required=True),
+                        ]
+                    ),
+                ),
+            ],
+        )
+
+    def create(self, ctx: CreateContext, planned: State) -> Optional[State]:
+        return {**planned, "id": f"id-{planned['name']}"}
+
+    def read(self, ctx: ReadContext, current: State) -> Optional[State]:
+        return current
+
+    def update(self, ctx: UpdateContext, current: State, planned: State) -> Optional[State]:
+        return planned
+
+    def delete(self, ctx: DeleteContext, current: State):
+        return None
+
+
+class Lookup(DataSource):
+    def __init__(self, provider: "BenchProvider"):
+        pass
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "lookup"
+
+    @classmethod
+    def get_schema(cls) -> Schema:
+        return Schema(
+            attributes=[
+                Attribute("name", t.String(), required=True),
+                Attribute("id", t.String(), computed=True),
+            ]
+        )
+
+    def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:
+        return {"name": config["name"], "id": f"id-{config['name']}"}
+
+
+class BenchProvider(Provider):
+    def __init__(self):
+        # CPU time of the process when the measured run started, see main
+        self.configured_cpu: Optional[float] = None
+
+    def get_model_prefix(self) -> str:
+        return "bench_"
+
+    def full_name(self) -> str:
+        return "tf.example.com/bench/bench"
+
+    def get_provider_schema(self, diags: Diagnostics) -> Schema:
+        return Schema(attributes=[])
+
+    def validate_config(self, diags: Diagnostics, config: Config):
+        pass
+
+    def configure_provider(self, diags: Diagnostics, config: Config):
+        self.configured_cpu = time.process_time()
+
+    def get_data_sources(self) -> list[Type[DataSource]]:
+        return [Lookup]
+
+    def get_resources(self) -> list[Type[Resource]]:
+        return [Item]
+
+
+def serve(aio: bool):
+    """Serve the provider until StopProvider, then report the CPU time it used since it was configured"""
+    provider = BenchProvider()
+    runner.run_provider(provider, ["bench", "--dev"], aio=aio)
+    print(json.dumps({"cpu_seconds": time.process_time() - (provider.configured_cpu or 0.0)}))
+
+
+# ----------------- The client ----------------- #
+
+
+class _Requests:
+    """The requests TF makes about the ``i``-th resource, encoded once up front"""
+
+    def __init__(self, i: int):
+        from tf.gen import tfplugin_pb2 as pb
+        from tf.utils import to_dynamic_value as dv
+
+        config = {
+            "id": None,
+            "name": f"item-{i}",
+            "size": i,
+            "enabled": i % 2 == 0,
+            "tags": [f"tag-{j}" for j in range(5)],
+            "settings": json.dumps({"replicas": i % 3, "zone": f"zone-{i % 4}"}, sort_keys=True),
+            "rule": [{"port": 8000 + j, "protocol": "tcp"} for j in range(3)],
+        }
+        state = {**config, "id": f"id-item-{i}"}
+
+        self.ValidateResourceConfig = pb.ValidateResourceConfig.Request(type_name="bench_item", config=dv(config))
+        self.ReadDataSource = pb.ReadDataSource.Request(
+            type_name="bench_lookup", config=dv({"name": f"item-{i}", "id": None})
+        )
+        self.ReadResource = pb.ReadResource.Request(type_name="bench_item", current_state=dv(state))
+        self.PlanUpdate = pb.PlanResourceChange.Request(
+            type_name="bench_item", prior_state=dv(state), proposed_new_state=dv(state), config=dv(config)
+        )
+        self.PlanCreate = pb.PlanResourceChange.Request(
+            type_name="bench_item", prior_state=dv(None), proposed_new_state=dv(config), config=dv(config)
+        )
+        self.ApplyCreate = pb.ApplyResourceChange.Request(
+            type_name="bench_item",
+            prior_state=dv(None),
+            planned_state=dv({**config, "id": t.Unknown}),
+            config=dv(config),
+        )
+
+
+# The RPCs TF makes for each resource: (RPC method, request)
+_MIXES = {
+    # A plan of resources that exist, and haven't changed: refresh, then plan
+    "plan": [
+        ("ValidateResourceConfig", "ValidateResourceConfig"),
+        ("ReadDataSource", "ReadDataSource"),
+        ("ReadResource", "ReadResource"),
+        ("PlanResourceChange", "PlanUpdate"),
+    ],
+    # An apply creating the resources
+    "apply": [
+        ("ValidateResourceConfig", "ValidateResourceConfig"),
+        ("PlanResourceChange", "PlanCreate"),
+        ("ApplyResourceChange", "ApplyCreate"),
+    ],
+    # A refresh
+    "refresh": [("ReadResource", "ReadResource")],
+}
+
+
+def _start_provider(aio: bool) -> tuple[subprocess.Popen, str]:
+    """Start serving the provider in a child process, returning it and the address of its socket"""
+    argv = [sys.executable, "-u", "-m", "benchmarks.rpc", "--serve"] + (["--aio"] if aio else [])
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, text=True)
+
+    for line in process.stdout:  # pyre-ignore[16]
+        _, sep, reattach = line.partition("TF_REATTACH_PROVIDERS=")
+        if sep:
+            [provider] = json.loads(reattach.strip().strip("'")).values()
+            return process, f"unix://{provider['Addr']['String']}"
+
+    raise RuntimeError(f"The provider exited with {process.wait()} before listening")
+
+
+def _replay(stub: Any, mix: list[tuple[str, str]], requests: list[_Requests], seconds: float, concurrency: int):
+    """Replay the mix with each thread, until the time is up. Returns the latencies of each method's calls."""
+    latencies: dict[str, list[float]] = {method: [] for method, _ in mix}
+    resources = itertools.count()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        while time.perf_counter() < deadline:
+            resource = requests[next(resources) % len(requests)]
+            for method, request in mix:
+                start = time.perf_counter()
+                response = getattr(stub, method)(getattr(resource, request))
+                latencies[method].append(time.perf_counter() - start)
+
+                errors = [d.summary for d in response.diagnostics if d.severity == d.ERROR]
+                if errors:
+                    raise RuntimeError(f"{method} failed: {errors}")
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = [pool.submit(worker) for _ in range(concurrency)]
+        for future in futures:
+            future.result()  # A failed worker fails the run rather than reporting the calls of the others
+
+    return latencies
+
+
+def _quantile(values: list[float], q: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(mix: str, concurrency: int, duration: float, warmup: float, resources: int, aio: bool) -> dict:
+    import grpc
+
+    from tf.gen import tfplugin_pb2 as pb
+    from tf.gen import tfplugin_pb2_grpc as rpc
+    from tf.utils import to_dynamic_value
+
+    process, address = _start_provider(aio)
+    try:
+        requests = [_Requests(i) for i in range(resources)]
+        channel = grpc.insecure_channel(address)
+        stub = rpc.ProviderStub(channel)
+
+        stub.GetProviderSchema(pb.GetProviderSchema.Request())
+        _replay(stub, _MIXES[mix], requests, warmup, concurrency)
+
+        # The provider measures its CPU time from here
+        stub.ConfigureProvider(pb.ConfigureProvider.Request(config=to_dynamic_value({})))
+        start = time.perf_counter()
+        latencies = _replay(stub, _MIXES[mix], requests, duration, concurrency)
+        elapsed = time.perf_counter() - start
+
+        stub.StopProvider(pb.StopProvider.Request())
+        channel.close()
+        out, _ = process.communicate(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+    cpu_seconds = json.loads(out.strip().splitlines()[-1])["cpu_seconds"]
+    calls = [latency for method_latencies in latencies.values() for latency in method_latencies]
+
+    return {
+        "rpcs": len(calls),
+        "rps": len(calls) / elapsed,
+        "p50": _quantile(calls, 0.5),
+        "p99": _quantile(calls, 0.99),
+        "cpu_per_rpc": cpu_seconds / len(calls),
+        "methods": {
+            method: {
+                "rpcs": len(values),
+                "mean": statistics.fmean(values),
+                "p50": _quantile(values, 0.5),
+                "p99": _quantile(values, 0.99),
+            }
+            for method, values in latencies.items()
+        },
+    }
+
+
+def _print_results(results: dict):
+    print(f"{'method':<28} {'rpcs':>8} {'p50':>10} {'p99':>10}")
+    for method, stats in results["methods"].items():
+        print(f"{method:<28} {stats['rpcs']:>8} {stats['p50'] * 1e3:>8.2f}ms {stats['p99'] * 1e3:>8.2f}ms")
+    print(
+        f"{'total':<28} {results['rpcs']:>8} {results['p50'] * 1e3:>8.2f}ms {results['p99'] * 1e3:>8.2f}ms"
+        f"  {results['rps']:.0f} rps, {results['cpu_per_rpc'] * 1e6:.0f}us CPU per RPC"
+    )
+
+
+def _timings(results: dict) -> dict[str, float]:
+    """What to compare against a baseline, as seconds where lower is better"""
+    return {
+        "seconds_per_rpc": 1 / results["rps"],
+        "cpu_per_rpc": results["cpu_per_rpc"],
+        "p50": results["p50"],
+        "p99": results["p99"],
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.rpc", description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--mix", choices=sorted(_MIXES), default="plan", help="RPCs to make for each resource")
+    parser.add_argument("--concurrency", type=int, default=10, help="Client threads, like TF's -parallelism")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to run for before measuring")
+    parser.add_argument("--resources", type=int, default=100, help="Distinct resources to cycle through")
+    parser.add_argument("--aio", action="store_true", help="Serve with run_provider(..., aio=True)")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare against the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown that counts as a regression")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.aio)
+        return 0
+
+    results = run(args.mix, args.concurrency, args.duration, args.warmup, args.resources, args.aio)
+    _print_results(results)
+
+    if args.output:
+        settings = {"mix": args.mix, "concurrency": args.concurrency, "aio": args.aio}
+        write_results(args.output, results, **settings)
+
+    if args.baseline and compare(_timings(results), _timings(read_results(args.baseline)), args.threshold):
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
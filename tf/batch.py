@@ -0,0 +1,217 @@
+import asyncio
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+_I = TypeVar("_I")
+
+
+class _Batch(Generic[_I]):
+    def __init__(self, run: Callable[[list[_I]], Any]):
+        self.run = run
+        self.items: list[_I] = []
+        self.futures: list[Future] = []
+        self.started = False
+
+
+class Batcher(Generic[_I]):
+    """
+    Coalesces concurrent calls into batches.
+
+    The first call to :meth:`join` opens a batch, which stays open for ``window`` seconds or until ``max_size`` items
+    have joined. The batch is then run with the first call's ``run`` function, which takes the list of items and
+    returns a list with one result per item (or a coroutine that does).
+
+    Called from an event loop thread, :meth:`join` never blocks and the batch is run on the loop.
+    Otherwise the first caller's thread waits out the window and runs the batch itself.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._cond = threading.Condition()
+        self._pending: Optional[_Batch[_I]] = None
+        self._tasks: set[asyncio.Task] = set()  # The loop only keeps weak references
+
+    def join(self, run: Callable[[list[_I]], Any], item: _I) -> Future:
+        """Add the item to the open batch, returning a future for its result"""
+        future: Future = Future()
+
+        with self._cond:
+            batch = self._pending
+            leader = batch is None
+            if batch is None:
+                batch = self._pending = _Batch(run)
+
+            batch.items.append(item)
+            batch.futures.append(future)
+
+            full = len(batch.items) >= self.max_size
+            if full:
+                self._pending = None
+                self._cond.notify_all()
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is not None:
+            if full:
+                self._spawn(loop, batch)
+            elif leader:
+                loop.call_later(self.window, self._spawn, loop, batch)
+            return future
+
+        if leader:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not batch, timeout=self.window)
+            self._run(batch)
+
+        return future
+
+    # Never blocks on an event loop, see _run_steps_async
+    join.nonblocking = True  # pyre-ignore[16]
+
+    def _spawn(self, loop: asyncio.AbstractEventLoop, batch: _Batch[_I]):
+        task = loop.create_task(self._run_async(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _start(self, batch: _Batch[_I]) -> bool:
+        """Close the batch, returning whether it's ours to run"""
+        with self._cond:
+            if self._pending is batch:
+                self._pending = None
+
+            started, batch.started = batch.started, True
+            return not started
+
+    def _run(self, batch: _Batch[_I]):
+        # Off the loop, only the leader runs a batch
+        self._start(batch)
+
+        try:
+            results = batch.run(batch.items)
+            if inspect.iscoroutine(results):
+                results = asyncio.run(results)
+        except Exception as exc:
+            self._fail(batch, exc)
+        else:
+            self._resolve(batch, results)
+
+    async def _run_async(self, batch: _Batch[_I]):
+        if not self._start(batch):
+            return
+
+        try:
+            # A sync run function may block, an async one only creates its coroutine in the thread
+            results = await asyncio.to_thread(batch.run, batch.items)
+            if inspect.iscoroutine(results):
+                results = await results
+        except Exception as exc:
+            self._fail(batch, exc)
+        else:
+            self._resolve(batch, results)
+
+    @staticmethod
+    def _resolve(batch: _Batch[_I], results: Any):
+        results = list(results) if results is not None else []
+        if len(results) != len(batch.items):
+            Batcher._fail(batch, ValueError(f"Batch of {len(batch.items)} returned {len(results)} results"))
+            return
+
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: _Batch[_I], exc: BaseException):
+        for future in batch.futures:
+            future.set_exception(exc)
+
+
+class LruCache:
+    """
+    A thread-safe mapping that keeps the ``max_size`` most recently used items.
+    :attr:`hits` and :attr:`misses` count the lookups that did and didn't find their key.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class SingleFlight:
+    """
+    Lets concurrent calls with the same key share one execution, and optionally keeps results around for a while.
+
+    The first caller to :meth:`claim` a key does the work and hands the outcome to :meth:`resolve` or :meth:`fail`.
+    Everyone else gets a future for that outcome.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[Hashable, Future] = {}
+        self._cache: dict[Hashable, tuple[float, Any]] = {}
+
+    def claim(self, key: Hashable) -> tuple[Future, bool]:
+        """Returns a future for the key's result, and whether the caller must produce it"""
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                expires, result = cached
+                if time.monotonic() < expires:
+                    future: Future = Future()
+                    future.set_result(result)
+                    return future, False
+
+                del self._cache[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+
+            future = self._in_flight[key] = Future()
+            return future, True
+
+    def resolve(self, key: Hashable, result: Any, ttl: Optional[float] = None):
+        """Hand the result to everyone waiting, and to later claims for ``ttl`` seconds"""
+        with self._lock:
+            future = self._in_flight.pop(key)
+            if ttl:
+                self._cache[key] = (time.monotonic() + ttl, result)
+
+        future.set_result(result)
+
+    def fail(self, key: Hashable, exc: BaseException):
+        """Raise the exception for everyone waiting. Nothing is cached, the next claim tries again."""
+        with self._lock:
+            future = self._in_flight.pop(key)
+
+        future.set_exception(exc)
@@ -1,6 +1,9 @@
-from typing import Any
+from collections import Counter
+from functools import cached_property
+from typing import Any, Hashable
 
 from tf.schema import Block, NestedBlock, NestMode
+from tf.types import Unknown, _pair_up
 from tf.utils import Diagnostics
 
 # class SingleNestedBlock(NestedBlock):
@@ -9,14 +12,10 @@ from tf.utils import Diagnostics
 #         super().__init__(type_name, NestMode.Single, block, **more)
 #
 #     def encode(self, value: Any) -> Any:
-#         from tf.provider import _encode_state_d
-#
-#         return _encode_state_d(self._amap(), self._bmap(), value, None)
+#         return self.codec.encode(value, None)
 #
 #     def decode(self, value: Any) -> Any:
-#         from tf.provider import _decode_state
-#
-#         return _decode_state(self._amap(), self._bmap(), value)[1]
+#         return self.codec.decode(Diagnostics(), value)[1]
 
 
 class SetNestedBlock(NestedBlock):
@@ -26,26 +25,36 @@ class SetNestedBlock(NestedBlock):
         super().__init__(type_name, NestMode.Set, block)
 
     def encode(self, value: Any) -> Any:
-        from tf.provider import _encode_state_d
-
-        return [_encode_state_d(self._amap(), self._bmap(), v, None) for v in value]
+        codec = self.codec
+        return [codec.encode(v, None) for v in value]
 
     def decode(self, value: Any) -> Any:
-        from tf.provider import _decode_state
+        codec = self.codec
 
         # TODO: This kind of sucks. Really we should probably take a diagnostics object,
         # but consistency would require us to change all other .decode methods to do that.
         # Maybe that's not such a bad idea?
         diags = Diagnostics()
-        return [_decode_state(diags, self._amap(), self._bmap(), v)[1] for v in value]
+        return [codec.decode(diags, v)[1] for v in value]
+
+    def canonical(self, value: Any) -> Hashable:
+        if value is None or value is Unknown:
+            return value
+
+        # A set of elements is a multiset of their keys
+        return frozenset(Counter(map(self.codec.canonical, value)).items())
+
+    @cached_property
+    def _keys_trusted(self) -> bool:
+        return self.codec._keys_trusted
 
     def semantically_equal(self, a_decoded, b_decoded) -> bool:
-        # Since this is a set, we turn the block into a tuple
-        # and then compare tuples
-        # Kinda gross?
-        # TODO(Hunter): Support nested nested blocks instead of just attrs
-        # You know, doesn't this kind of have a bug in it?
-        # Two elements should be equal if they have the same SEMANTIC equality
+        if a_decoded is b_decoded:
+            return True
+
+        for v in (a_decoded, b_decoded):
+            if v is None or v is Unknown:
+                return False
 
         if len(a_decoded) != len(b_decoded):
             return False
@@ -53,19 +62,10 @@ class SetNestedBlock(NestedBlock):
         if len(a_decoded) == 0:
             return True
 
-        def to_tuple(d):
-            return tuple([d.get(attr.name, None) for attr in self.block.attributes])
-
-        a_tuples = [to_tuple(d) for d in a_decoded]
-        b_tuples = [to_tuple(d) for d in b_decoded]
-
-        # Each tuple of a is in b and vice versa
-        for a in a_tuples:
-            if a not in b_tuples:
-                return False
-
-        for b in b_tuples:
-            if b not in a_tuples:
-                return False
+        # Elements are equal if they are SEMANTICALLY equal, so compare their canonical keys as multisets
+        if self._keys_trusted:
+            key = self.codec.canonical
+            return Counter(map(key, a_decoded)) == Counter(map(key, b_decoded))
 
-        return True
+        # Some field's keys can't stand in for its equality, so compare elements field by field
+        return _pair_up(a_decoded, b_decoded, self.codec.semantically_equal)
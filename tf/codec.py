@@ -0,0 +1,421 @@
+import operator
+from collections.abc import MutableMapping
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterator, Mapping, Optional, Sequence, Tuple, cast
+
+from tf.schema import Attribute, NestedBlock, Schema
+from tf.types import Bool, Number, String, Unknown, _canonical_of, _trusts_canonical
+from tf.utils import Diagnostics, _index_msgpack_map, _pack_map, _pb, _unpack, read_dynamic_value, to_dynamic_value
+
+if TYPE_CHECKING:  # pragma: no cover
+    from tf.gen import tfplugin_pb2 as pb
+
+# Types whose python representation is the wire representation.
+# Exact classes only: subclasses (eg NormalizedJson) may transform values.
+_PRIMITIVE_TYPES = (Number, String, Bool)
+
+# Sentinel for "the old state has no value for this field"
+_MISSING: Any = object()
+
+# Eagerly decoded msgpack states keep their buffer (to splice unchanged fields back in) only if their fields average
+# at least this many bytes. Finding the fields' bytes costs more than packing small values again.
+_SPLICE_MIN_FIELD_BYTES = 256
+
+
+class EncodeError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class _Field:
+    name: str
+    # None means the field is passed through untouched when decoding
+    decode: Optional[Callable[[Any], Any]]
+    # (new python value, old encoded value or _MISSING, old canonical key or _MISSING) -> encoded value
+    encode: Callable[[Any, Any, Any], Any]
+    is_block: bool
+    # The nested block that produces canonical keys for this field, if they can stand in for semantically_equal.
+    # None for attributes, which are cheaper to decode again and compare than to key on both sides.
+    keyed_by: Any = None
+
+
+def _compile_attribute(attr: Attribute) -> _Field:
+    t = attr.type
+
+    if type(t) in _PRIMITIVE_TYPES:
+
+        def encode_primitive(v: Any, old_v: Any, old_key: Any) -> Any:
+            # Primitives encode to themselves, so compare against the old encoded value directly
+            return old_v if old_v == v else v
+
+        return _Field(attr.name, None, encode_primitive, False)
+
+    def encode_complex(v: Any, old_v: Any, old_key: Any) -> Any:
+        # If the previous value was Unknown and the new one is not, we just accept the new one
+        if old_v is _MISSING or old_v is Unknown:
+            return t.encode(v)
+
+        # For complex types, use semantic equality
+        if t.semantically_equal(t.decode(old_v), v):
+            return old_v
+
+        return t.encode(v)
+
+    return _Field(attr.name, lambda v: t.decode(v), encode_complex, False)
+
+
+def _compile_block(block: NestedBlock) -> _Field:
+    def encode_block(v: Any, old_v: Any, old_key: Any) -> Any:
+        # The old elements were already decoded once this RPC, compare against their key instead of decoding again
+        if old_v is not _MISSING and old_key is not _MISSING:
+            return old_v if block.canonical(v) == old_key else block.encode(v)
+
+        if old_v is not _MISSING and block.semantically_equal(block.decode(old_v), v):
+            return old_v
+
+        return block.encode(v)
+
+    keyed_by = block if _trusts_canonical(block) else None
+    return _Field(block.type_name, lambda v: block.decode(v), encode_block, True, keyed_by)
+
+
+class StateCodec:
+    """
+    A precompiled decoder/encoder for the state of one schema (or nested block).
+
+    The field table is built once from the attributes and block types,
+    so decoding and encoding a state is a single pass over its keys with no per-field type dispatch.
+
+    :param attributes: Attributes of the schema
+    :param block_types: Nested block types of the schema
+    """
+
+    def __init__(self, attributes: Sequence[Attribute], block_types: Sequence[NestedBlock]):
+        self.attributes: Mapping[str, Attribute] = MappingProxyType({a.name: a for a in attributes})
+        self.blocks: Mapping[str, NestedBlock] = MappingProxyType({b.type_name: b for b in block_types})
+
+        fields = {a.name: _compile_attribute(a) for a in attributes}
+        fields.update({b.type_name: _compile_block(b) for b in block_types})
+        self._fields: Mapping[str, _Field] = MappingProxyType(fields)
+
+        # Attribute types and nested blocks both know how to produce canonical keys for their values
+        key_fields = [(a.name, a.type) for a in attributes] + [(b.type_name, b) for b in block_types]
+        self._key_fields: Tuple[Tuple[str, Callable[[Any], Hashable]], ...] = tuple(
+            (name, _canonical_of(f)) for name, f in key_fields
+        )
+        self._eq_fields: Tuple[Tuple[str, Callable[[Any, Any], bool]], ...] = tuple(
+            (name, getattr(f, "semantically_equal", operator.eq)) for name, f in key_fields
+        )
+        # Whether equal keys mean semantically equal states, or states must be compared field by field
+        self._keys_trusted = all(_trusts_canonical(f) for _, f in key_fields)
+        # Fields worth fingerprinting: nested blocks, whose elements would otherwise go through a codec again
+        self._fingerprint_fields: Tuple[Tuple[str, Any], ...] = tuple(
+            (f.name, f.keyed_by) for f in fields.values() if f.keyed_by is not None
+        )
+
+    @classmethod
+    def from_schema(cls, schema: Schema) -> "StateCodec":
+        return cls(schema.attributes, schema.block_types)
+
+    def canonical(self, state: dict) -> Hashable:
+        """A hashable key for a decoded state: semantically equal states have equal keys"""
+        return tuple([key(state.get(name)) for name, key in self._key_fields])
+
+    def semantically_equal(self, a: dict, b: dict) -> bool:
+        """Compare two decoded states field by field, with each field's own semantic equality"""
+        for name, equal in self._eq_fields:
+            a_v, b_v = a.get(name), b.get(name)
+            if a_v is b_v:
+                continue
+
+            if a_v is Unknown or b_v is Unknown or not equal(a_v, b_v):
+                return False
+
+        return True
+
+    def fingerprint(self, decoded: Optional[Mapping[str, Any]]) -> dict[str, Hashable]:
+        """
+        Snapshot the canonical keys of a decoded state's nested blocks.
+
+        Take the fingerprint before handing the decoded state to user code (which may mutate it),
+        then pass it to :meth:`encode` alongside the encoded state to skip decoding the old values again.
+        """
+        if isinstance(decoded, LazyState):
+            # Lazy states fingerprint each field as it's decoded, before it's handed out
+            return decoded._canonical_keys
+
+        if not decoded:
+            return {}
+
+        return {
+            name: keyed_by.canonical(decoded[name])
+            for name, keyed_by in self._fingerprint_fields
+            if name in decoded and decoded[name] is not Unknown
+        }
+
+    def decode(
+        self, diags: Diagnostics, st: Optional[Mapping[str, Any]]
+    ) -> Tuple[Optional[Mapping[str, Any]], Optional[dict]]:
+        """
+        Decode an encoded state (or nested block element) into its python representation.
+
+        Returns the encoded state and the decoded state.
+        Fields that fail to decode are reported in `diags` and decoded as Unknown.
+        """
+        if st is None:
+            return None, None
+
+        fields = self._fields
+        attr_state = {}
+        block_state = {}
+
+        for k, v in st.items():
+            field = fields.get(k)
+            if field is None:
+                continue
+
+            out = block_state if field.is_block else attr_state
+            out[k] = v if v is Unknown or field.decode is None else _decode_field(diags, field, v)
+
+        return st, {**attr_state, **block_state} if block_state else attr_state
+
+    def decode_dynamic(
+        self, diags: Diagnostics, state: "pb.DynamicValue"
+    ) -> Tuple[Optional[Mapping[str, Any]], Optional[dict]]:
+        """
+        Like :meth:`decode`, but for a state read off the wire.
+
+        The value is unpacked in one go. If its fields are large, the encoded state also
+        remembers the msgpack buffer so :meth:`encode_dynamic` can splice unchanged fields back in.
+        """
+        st = read_dynamic_value(state)
+
+        if state.msgpack and st and len(state.msgpack) >= _SPLICE_MIN_FIELD_BYTES * len(st):
+            st = _WireDict(state.msgpack, st)
+
+        return self.decode(diags, st)
+
+    def decode_lazy(
+        self, diags: Diagnostics, state: "pb.DynamicValue"
+    ) -> Tuple[Optional[Mapping[str, Any]], Optional[MutableMapping[str, Any]]]:
+        """
+        Like :meth:`decode`, but fields are only decoded when they are first accessed.
+
+        Returns a read-only view of the encoded state and a :class:`LazyState`, both backed by the msgpack buffer.
+        Decoding errors are reported in `diags` when the field is accessed.
+        Falls back to :meth:`decode_dynamic` if the value is not a msgpack map.
+        """
+        wire = self._read_wire(state)
+
+        if not isinstance(wire, _WireState):
+            return self.decode(diags, wire)
+
+        return wire, LazyState(self, diags, wire)
+
+    def _read_wire(self, state: "pb.DynamicValue") -> Any:
+        spans = _index_msgpack_map(state.msgpack) if state.msgpack else None
+
+        if spans is None:
+            return read_dynamic_value(state)
+
+        return _WireState(state.msgpack, {k: span for k, span in spans.items() if k in self._fields})
+
+    def encode(
+        self,
+        state: Optional[Mapping[str, Any]],
+        old: Optional[Mapping[str, Any]],
+        old_keys: Optional[Mapping[str, Hashable]] = None,
+    ) -> Optional[dict[str, Any]]:
+        """
+        If any encoded values of state matches the old state, we will use the old state's encoded value.
+
+        `old_keys` is the :meth:`fingerprint` of the decoded old state, if the caller has it.
+        """
+        # This preserves byte-for-byte equality for JSON
+
+        if state is None:
+            return None
+
+        if isinstance(state, LazyState):
+            # Fields that were never accessed can't have changed, re-emit them as they came in
+            touched = self.encode({k: state[k] for k in state if state.is_touched(k)}, old, old_keys) or {}
+            return {k: touched[k] if state.is_touched(k) else state.wire[k] for k in state}
+
+        fields = self._fields
+        old = old or {}
+        old_keys = old_keys or {}
+        encoded = {}
+
+        for k, v in state.items():
+            try:
+                encoded[k] = (
+                    Unknown if v is Unknown else fields[k].encode(v, old.get(k, _MISSING), old_keys.get(k, _MISSING))
+                )
+            except Exception as exc:
+                raise EncodeError(f"Failed to encode field '{k}': {type(exc).__name__}: {exc}") from exc
+
+        return encoded
+
+    def encode_dynamic(
+        self,
+        state: Optional[Mapping[str, Any]],
+        old: Optional[Mapping[str, Any]],
+        old_keys: Optional[Mapping[str, Hashable]] = None,
+    ) -> "pb.DynamicValue":
+        """
+        Like :meth:`encode`, but packed into a DynamicValue.
+
+        Values reused from an `old` state that remembers its msgpack buffer (see :meth:`decode_dynamic` and
+        :meth:`decode_lazy`), and fields of a :class:`LazyState` that were never accessed, are spliced into the
+        output as their original bytes instead of being packed again.
+        """
+        if state is None:
+            return to_dynamic_value(None)
+
+        spliced: dict[str, memoryview] = {}
+
+        if isinstance(state, LazyState):
+            spliced = {k: state.wire.raw(k) for k in state if not state.is_touched(k)}
+            touched = self.encode({k: state[k] for k in state if k not in spliced}, old, old_keys) or {}
+            encoded = {k: touched.get(k) for k in state}
+        else:
+            encoded = cast(dict, self.encode(state, old, old_keys))
+
+        if isinstance(old, (_WireState, _WireDict)):
+            for k, v in encoded.items():
+                if k not in spliced and old.is_reused(k, v):
+                    spliced[k] = old.raw(k)
+
+        return _pb().DynamicValue(msgpack=_pack_map(encoded, spliced))
+
+
+def _decode_field(diags: Diagnostics, field: _Field, v: Any) -> Any:
+    try:
+        return field.decode(v)  # pyre-ignore[29]: only called for fields with a decoder
+    except Exception as exc:
+        diags.add_error(
+            f"Failed to decode field '{field.name}'",
+            detail=f"Error decoding field '{field.name}': {exc}",
+            path=[field.name],
+        )
+        return Unknown
+
+
+class _WireDict(dict):
+    """An eagerly unpacked msgpack map, which finds the bytes of its values once any of them are spliced"""
+
+    def __init__(self, buf: bytes, values: dict[str, Any]):
+        super().__init__(values)
+        self._buf = buf
+        self._spans: Optional[dict[str, Tuple[int, int]]] = None
+
+    def is_reused(self, key: str, value: Any) -> bool:
+        """Is `value` the very object that was unpacked for `key`?"""
+        return self.get(key, _MISSING) is value
+
+    def raw(self, key: str) -> memoryview:
+        """The msgpack bytes of a single value"""
+        if self._spans is None:
+            # The buffer is known to be a map, it was unpacked into this one
+            self._spans = cast(dict, _index_msgpack_map(self._buf))
+
+        start, end = self._spans[key]
+        return memoryview(self._buf)[start:end]
+
+
+class _WireState(Mapping[str, Any]):
+    """The encoded (msgpack wire format) values of a state, unpacked from the buffer one field at a time"""
+
+    def __init__(self, buf: bytes, spans: dict[str, Tuple[int, int]]):
+        self._buf = memoryview(buf)
+        self._spans = spans
+        self._values: dict[str, Any] = {}
+
+    def is_reused(self, key: str, value: Any) -> bool:
+        """Is `value` the very object that was unpacked for `key`?"""
+        return self._values.get(key, _MISSING) is value
+
+    def raw(self, key: str) -> memoryview:
+        """The msgpack bytes of a single value"""
+        start, end = self._spans[key]
+        return self._buf[start:end]
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._values:
+            self._values[key] = _unpack(self.raw(key))
+
+        return self._values[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._spans
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._spans)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+
+class LazyState(MutableMapping[str, Any]):
+    """
+    A state that decodes each field the first time it is accessed.
+
+    Behaves like the usual `dict` state. Fields that are never accessed (or assigned) are
+    re-emitted in their original encoding when the state is returned to the framework.
+    Iterating over values (`items()`, `values()`, `dict(state)`, ...) decodes every field.
+    """
+
+    def __init__(self, codec: StateCodec, diags: Diagnostics, wire: _WireState):
+        self.wire = wire
+        self._codec = codec
+        self._diags = diags
+        # Keys in order, including assigned ones
+        self._present: dict[str, None] = dict.fromkeys(wire)
+        # Decoded or assigned values
+        self._values: dict[str, Any] = {}
+        # Canonical keys of decoded values, taken before they are handed out and possibly mutated
+        self._canonical_keys: dict[str, Hashable] = {}
+
+    def is_touched(self, key: str) -> bool:
+        """Has the field been decoded, assigned, or deleted?"""
+        return key in self._values or key not in self._present
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+
+        if key not in self._present:
+            raise KeyError(key)
+
+        field = self._codec._fields[key]
+        v = self.wire[key]
+
+        if v is not Unknown and field.decode is not None:
+            v = _decode_field(self._diags, field, v)
+
+            if field.keyed_by is not None and v is not Unknown:
+                self._canonical_keys[key] = field.keyed_by.canonical(v)
+
+        self._values[key] = v
+        return v
+
+    def __setitem__(self, key: str, value: Any):
+        self._present[key] = None
+        self._values[key] = value
+
+    def __delitem__(self, key: str):
+        del self._present[key]
+        self._values.pop(key, None)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._present
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._present)
+
+    def __len__(self) -> int:
+        return len(self._present)
+
+    def __repr__(self) -> str:
+        return f"LazyState({list(self._present)})"
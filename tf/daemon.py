@@ -0,0 +1,278 @@
+"""
+A warm provider daemon.
+
+Every TF run starts the provider from scratch, and importing grpc, protobuf, cryptography and the provider's own code
+is most of that time. The daemon (``terraform-provider-$name --daemon``) does that work once and then, for every run,
+forks a child that serves TF exactly as a freshly started provider would.
+
+TF starts a small launcher (see :func:`launch`) instead, which hands its stdio over to the daemon and waits for the
+child to finish. If no daemon is running, or it was started from another version of the provider, the launcher serves
+the provider itself.
+
+This module is imported by the launcher, so it must stay cheap to import.
+"""
+
+import hashlib
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+from pathlib import Path
+from typing import Callable, NoReturn, Optional
+
+# Size of the length prefix of a launch request
+_HEADER = struct.Struct("!I")
+
+
+def daemon_socket_path(name: str) -> Path:
+    """
+    Unix socket the daemon for the given provider (by full name) listens on.
+    ``TF_PLUGIN_DAEMON_SOCKET`` overrides it.
+    """
+    if path := os.environ.get("TF_PLUGIN_DAEMON_SOCKET"):
+        return Path(path)
+
+    # Hashed, since unix socket paths are limited to ~100 bytes
+    digest = hashlib.sha256(name.encode()).hexdigest()[:16]
+    return Path.home() / ".cache" / "tf-python-provider" / "daemons" / f"{digest}.sock"
+
+
+def launch(
+    name: str, fallback: Callable[[], None], argv: Optional[list[str]] = None, version: Optional[str] = None
+) -> NoReturn:
+    """
+    Serve this TF run from the daemon for the given provider (by full name), or call ``fallback`` if it isn't running.
+    Exits with the served provider's exit code.
+
+    Only a daemon started with the same ``version`` serves the run, so one left running after the provider was
+    upgraded isn't used. By default, the version is when the provider's executable (``argv[0]``) was last modified,
+    which changes whenever it is installed again.
+
+    Use this as the provider's entrypoint, importing the provider itself only in ``fallback``:
+
+    .. code-block:: python
+
+        def main():
+            from tf.daemon import launch
+
+            launch("terraform.example.com/examplecorp/example", fallback=serve)
+
+        def serve():
+            from example.provider import ExampleProvider
+            from tf.runner import run_provider
+
+            run_provider(ExampleProvider(), sys.argv)
+
+    :param name: The provider's :meth:`~tf.iface.Provider.full_name`
+    :param fallback: Serves the provider in this process, e.g. by calling :func:`~tf.runner.run_provider`
+    :param argv: Arguments to serve the provider with, ``sys.argv`` by default
+    :param version: Anything that changes along with the provider's code, e.g. its version
+    """
+    argv = argv or sys.argv
+    version = _default_version(argv[0]) if version is None else version
+
+    if "--daemon" in argv:
+        # The daemon serves launchers of this version only
+        os.environ["TF_PLUGIN_DAEMON_VERSION"] = version
+        conn = None
+    else:
+        conn = _connect(daemon_socket_path(name))
+
+    if conn is None:
+        fallback()
+        sys.exit(0)
+
+    with conn:
+        request = json.dumps({"argv": argv, "env": dict(os.environ), "cwd": os.getcwd(), "version": version}).encode()
+        # The child takes over our stdio, so the handshake goes straight to TF
+        socket.send_fds(conn, [_HEADER.pack(len(request)) + request], [0, 1, 2])
+
+        for line in conn.makefile("rb"):
+            reply = json.loads(line)
+            if "exit" in reply:
+                sys.exit(reply["exit"])
+
+            if "stale" in reply:
+                break
+
+            # TF interrupts (and terminates) the process it started, which is us
+            forward = lambda signum, frame, pid=reply["pid"]: _kill(pid, signum)  # noqa: E731
+            signal.signal(signal.SIGINT, forward)
+            signal.signal(signal.SIGTERM, forward)
+        else:
+            # The child died without telling us why
+            sys.exit(1)
+
+    print(f"The provider daemon runs version {reply['stale']!r} rather than {version!r}, restart it", file=sys.stderr)
+    fallback()
+    sys.exit(0)
+
+
+def _default_version(executable: str) -> str:
+    try:
+        return str(os.stat(executable).st_mtime_ns)
+    except OSError:
+        # e.g. python -c
+        return ""
+
+
+def _connect(path: Path) -> Optional[socket.socket]:
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(path))
+    except OSError:
+        # Not running (or left behind a stale socket)
+        conn.close()
+        return None
+
+    return conn
+
+
+def _kill(pid: int, signum: int):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def serve_daemon(provider, argv: list[str], limits, aio: bool = False, socket_path: Optional[Path] = None):
+    """
+    Warm up and fork a child to serve each launcher that connects, until interrupted.
+    This is what :func:`~tf.runner.run_provider` does when given ``--daemon``.
+
+    Only launchers of the version in ``TF_PLUGIN_DAEMON_VERSION`` (set by :func:`launch`) are served.
+    """
+    version = os.environ.get("TF_PLUGIN_DAEMON_VERSION", "")
+
+    from tf.provider import AsyncProviderServicer, ProviderServicer
+    from tf.runner import _load_or_create_cert
+
+    # Everything a child would otherwise do on startup, short of touching gRPC's core.
+    # gRPC doesn't survive a fork once it has started its threads, so each child creates its own server.
+    servicer = AsyncProviderServicer(provider) if aio else ProviderServicer(provider)
+    servicer.get_provider_schema_bytes()
+    _load_or_create_cert()
+
+    path = socket_path or daemon_socket_path(provider.full_name())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.unlink(missing_ok=True)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)  # Only we may connect
+    try:
+        listener.bind(str(path))
+    finally:
+        os.umask(old_umask)
+
+    listener.listen()
+    # Children are never waited on, let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    print(f"Daemon for {provider.full_name()} listening on {path}", file=sys.stderr, flush=True)
+
+    try:
+        while True:
+            conn, _ = listener.accept()
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+            if os.fork() == 0:  # pragma: no cover (runs in the child, which coverage doesn't follow)
+                listener.close()
+                _serve_child(conn, servicer, limits, aio, version)
+
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        path.unlink(missing_ok=True)
+
+
+def _serve_child(conn: socket.socket, servicer, limits, aio: bool, version: str) -> NoReturn:
+    """Take over the launcher's run and serve it, never returning"""
+    import threading
+    import time
+    import traceback
+
+    from tf.runner import _run_servicer
+
+    code = 1
+    try:
+        request, fds = _receive_request(conn)
+
+        if request.get("version") != version:
+            # The launcher serves the run itself, keep away from its stdio
+            for fd in fds:
+                os.close(fd)
+
+            print(f"Not serving a launcher of version {request.get('version')!r}", file=sys.stderr)
+            conn.sendall(json.dumps({"stale": version}).encode() + b"\n")
+        else:
+            _take_over_stdio(fds)
+
+            os.setsid()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            os.environ.clear()
+            os.environ.update(request["env"])
+            os.chdir(request["cwd"])
+
+            conn.sendall(json.dumps({"pid": os.getpid()}).encode() + b"\n")
+
+            # If TF kills the launcher, nobody is left to stop us
+            threading.Thread(target=_exit_on_eof, args=(conn,), daemon=True).start()
+
+            start_time = time.time()
+            debug_timing = os.environ.get("TF_PLUGIN_TIMING") == "1"
+            _run_servicer(servicer, request["argv"], limits, aio, start_time, debug_timing)
+
+        code = 0
+    except KeyboardInterrupt:
+        # TF stops the run with SIGINT (forwarded by the launcher), which may come at any point, even mid-handshake
+        code = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        # Too late to be interrupted
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            conn.sendall(json.dumps({"exit": code}).encode() + b"\n")
+        except OSError:
+            pass
+
+        os._exit(code)
+
+
+def _receive_request(conn: socket.socket) -> tuple[dict, list[int]]:
+    """Receive the launcher's request, and its stdio"""
+    data, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+    if len(data) < _HEADER.size or len(fds) != 3:
+        raise ConnectionError("Malformed launch request")
+
+    (size,) = _HEADER.unpack_from(data)
+    data = data[_HEADER.size :]
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Launcher went away")
+        data += chunk
+
+    return json.loads(data), fds
+
+
+def _take_over_stdio(fds: list[int]):
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+
+def _exit_on_eof(conn: socket.socket):
+    while conn.recv(1024):
+        pass
+
+    os._exit(1)
@@ -1,11 +1,15 @@
 from abc import abstractmethod
 from dataclasses import dataclass
-from typing import Any, Optional, Protocol
+from itertools import chain, repeat
+from typing import TYPE_CHECKING, Any, Callable, ClassVar, Optional, Protocol, Sequence, Type
 
-from tf.gen import tfplugin_pb2 as pb
-from tf.schema import TextFormat, _desc_format_map
+from tf.schema import TextFormat, _desc_format_pb
 from tf.types import TfType
-from tf.utils import Diagnostics
+from tf.utils import Diagnostics, read_dynamic_value, to_dynamic_value
+
+if TYPE_CHECKING:  # pragma: no cover
+    from tf.gen import tfplugin_pb2 as pb
+    from tf.tracing import Span
 
 
 @dataclass
@@ -28,12 +32,14 @@ class Parameter:
     allow_null_value: bool = False
     allow_unknown_values: bool = False
 
-    def to_pb(self) -> pb.Function.Parameter:
+    def to_pb(self) -> "pb.Function.Parameter":
+        from tf.gen import tfplugin_pb2 as pb
+
         return pb.Function.Parameter(
             name=self.name,
             type=self.type.tf_type(),
             description=self.description,
-            description_kind=_desc_format_map.get(self.description_kind) if self.description_kind else None,
+            description_kind=_desc_format_pb(self.description_kind) if self.description_kind else None,
             allow_null_value=self.allow_null_value,
             allow_unknown_values=self.allow_unknown_values,
         )
@@ -49,7 +55,9 @@ class Return:
 
     type: TfType
 
-    def to_pb(self) -> pb.Function.Return:
+    def to_pb(self) -> "pb.Function.Return":
+        from tf.gen import tfplugin_pb2 as pb
+
         return pb.Function.Return(type=self.type.tf_type())
 
 
@@ -75,13 +83,15 @@ class FunctionSignature:
     description_kind: Optional[TextFormat] = None
     deprecation_message: Optional[str] = None
 
-    def to_pb(self) -> pb.Function:
+    def to_pb(self) -> "pb.Function":
+        from tf.gen import tfplugin_pb2 as pb
+
         func = pb.Function(
             parameters=[p.to_pb() for p in self.parameters],
             variadic_parameter=self.variadic_parameter.to_pb() if self.variadic_parameter else None,
             summary=self.summary,
             description=self.description,
-            description_kind=_desc_format_map.get(self.description_kind) if self.description_kind else None,
+            description_kind=_desc_format_pb(self.description_kind) if self.description_kind else None,
             deprecation_message=self.deprecation_message,
         )
         # Use getattr to access 'return' field because it's a reserved keyword in Python
@@ -96,10 +106,44 @@ class CallContext:
     diagnostics: Diagnostics
     function_name: str
 
+    @property
+    def span(self) -> "Span":
+        """The current tracing span, add spans of your own to it with :meth:`~tf.tracing.Span.child`"""
+        from tf.tracing import current_span
+
+        return current_span()
+
+
+@dataclass
+class CallBatchContext(CallContext):
+    """Context provided to batched function calls"""
+
+    contexts: list[CallContext]
+    """
+    A context for each call in the batch, in the same order, for diagnostics about that call.
+    Diagnostics added to this context are reported for every call in the batch.
+    """
+
 
 class Function(Protocol):
     """Protocol for provider functions"""
 
+    pure: ClassVar[bool] = False
+    """
+    Set to True if the result only depends on the arguments, and the function has no side effects.
+    TF calls functions again in every phase (validate, plan and apply) and for every expression that uses them,
+    so results of pure functions are remembered by their arguments and calls with the same arguments are skipped.
+    """
+
+    memo_size: ClassVar[int] = 1024
+    """Most results remembered for a :attr:`pure` function, the least recently used are forgotten first"""
+
+    call_batch_window: ClassVar[float] = 0.005
+    """Seconds to wait for concurrent calls to join a batch, when :func:`call_batch` is implemented"""
+
+    call_batch_size: ClassVar[int] = 1000
+    """Most calls passed to a single :func:`call_batch` call"""
+
     @classmethod
     @abstractmethod
     def get_name(cls) -> str:
@@ -119,3 +163,60 @@ class Function(Protocol):
         :param arguments: List of decoded argument values
         :return: The function result
         """
+
+    def call_batch(self, ctx: CallBatchContext, arguments: list[list[Any]]) -> list[Any]:
+        """
+        Execute the function for many calls at once, returning a result for each list of arguments in order.
+
+        Optional: when implemented, concurrent calls (e.g. from a ``for`` expression over many elements)
+        are coalesced for up to :attr:`call_batch_window` seconds and passed to this method together,
+        instead of calling :func:`call` once per call. Use it to vectorize the work or make a single bulk request.
+
+        :param ctx: The batch's context, with a context per call
+        :param arguments: The decoded argument values of each call
+        """
+        return [self.call(call_ctx, args) for call_ctx, args in zip(ctx.contexts, arguments)]
+
+
+def is_pure(klass: Type[Function]) -> bool:
+    """Has the function declared itself pure, so its results can be remembered"""
+    return getattr(klass, "pure", False) is True
+
+
+def calls_batch(klass: Type[Function]) -> bool:
+    """Has the function implemented the call_batch method"""
+    return getattr(klass, "call_batch", Function.call_batch) is not Function.call_batch
+
+
+class CallPlan:
+    """
+    A precompiled plan for calling one function.
+
+    The signature is built once and its argument decoders and result encoder are picked out of it,
+    so each call is decoded and encoded without rebuilding the signature or branching on each parameter.
+
+    :param klass: The function
+    """
+
+    def __init__(self, klass: Type[Function]):
+        self.klass = klass
+        self.signature = klass.get_signature()
+        self.pure = is_pure(klass)
+        self.batched = calls_batch(klass)
+
+        # Positional parameters are all required, only a variadic parameter accepts more arguments
+        self.arity = len(self.signature.parameters)
+        self.variadic = self.signature.variadic_parameter is not None
+
+        self._decoders: tuple[Callable[[Any], Any], ...] = tuple(p.type.decode for p in self.signature.parameters)
+        variadic = self.signature.variadic_parameter
+        self._variadic_decoder: Optional[Callable[[Any], Any]] = variadic.type.decode if variadic else None
+        self._encode_result: Callable[[Any], Any] = self.signature.return_type.type.encode
+
+    def decode_arguments(self, arguments: Sequence["pb.DynamicValue"]) -> list[Any]:
+        """Decode the arguments of a call, which must have been checked against :attr:`arity` and :attr:`variadic`"""
+        decoders = chain(self._decoders, repeat(self._variadic_decoder))
+        return [decode(read_dynamic_value(arg)) for decode, arg in zip(decoders, arguments)]
+
+    def encode_result(self, result: Any) -> "pb.DynamicValue":
+        return to_dynamic_value(self._encode_result(result))
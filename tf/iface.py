@@ -1,12 +1,14 @@
 from abc import abstractmethod
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Optional, Protocol, Sequence, Type, TypeAlias
+from enum import Enum
+from typing import TYPE_CHECKING, ClassVar, Optional, Protocol, Sequence, Type, TypeAlias
 
 from tf.schema import Attribute, NestedBlock, Schema
 from tf.utils import Diagnostics
 
 if TYPE_CHECKING:  # pragma: no cover
     from tf.function import Function
+    from tf.tracing import Span
 
 
 State: TypeAlias = dict
@@ -43,6 +45,13 @@ class _Context:
     diagnostics: Diagnostics
     type_name: str
 
+    @property
+    def span(self) -> "Span":
+        """The current tracing span, add spans of your own to it with :meth:`~tf.tracing.Span.child`"""
+        from tf.tracing import current_span
+
+        return current_span()
+
 
 class ReadDataContext(_Context): ...
 
@@ -86,6 +95,18 @@ def _validate_config(
 
 
 class DataSource(AbstractResource, Protocol):
+    share_reads: ClassVar[bool] = True
+    """
+    Concurrent reads with identical configuration (e.g. the same lookup in many modules) share a single call to
+    :func:`read`. Set to False if reads with the same configuration are expected to return different results.
+    """
+
+    read_cache_ttl: ClassVar[Optional[float]] = None
+    """
+    Seconds to keep answering reads with identical configuration with the result of a shared read,
+    rather than calling :func:`read` again. Reads that report errors are never kept.
+    """
+
     def validate(self, diags: Diagnostics, type_name: str, config: Config):
         """Validate the data source configuration"""
         schema = self.get_schema()
@@ -120,7 +141,31 @@ class PlanContext(_Context):
     changed_fields: set[str]
 
 
+@dataclass
+class ReadManyContext(_Context):
+    contexts: list[ReadContext]
+    """
+    A context for each state being read, in the same order, for diagnostics about that resource.
+    Diagnostics added to this context are reported for every resource in the batch.
+    """
+
+
 class Resource(AbstractResource, Protocol):
+    lazy_state: ClassVar[bool] = False
+    """
+    Set to True to receive a lazily-decoded state in :func:`read`.
+
+    Each field is decoded the first time it is accessed, and fields that are never accessed
+    are returned to TF in their original encoding. This is useful for wide resources where `read`
+    only looks at a few fields. The state is a :class:`~tf.codec.LazyState` mapping rather than a `dict`.
+    """
+
+    read_batch_window: ClassVar[float] = 0.005
+    """Seconds to wait for concurrent reads to join a batch, when :func:`read_many` is implemented"""
+
+    read_batch_size: ClassVar[int] = 100
+    """Most states passed to a single :func:`read_many` call"""
+
     def validate(self, diags: Diagnostics, type_name: str, config: Config):
         """
         Validate the resource configuration
@@ -151,6 +196,19 @@ class Resource(AbstractResource, Protocol):
     def read(self, ctx: ReadContext, current: State) -> Optional[State]:
         """Read the current state of the resource"""
 
+    def read_many(self, ctx: ReadManyContext, states: list[State]) -> list[Optional[State]]:
+        """
+        Read the current state of several resources of this type, returning their states in the same order.
+
+        Optional: when implemented, concurrent reads of this type (e.g. the refresh during `opentofu plan`)
+        are coalesced for up to :attr:`read_batch_window` seconds and passed to this method together,
+        instead of calling :func:`read` once per resource. Use it to read them with a bulk or list API.
+
+        :param ctx: ReadManyContext
+        :param states: The current state of each resource
+        """
+        return [self.read(read_ctx, state) for read_ctx, state in zip(ctx.contexts, states)]
+
     @abstractmethod
     def update(self, ctx: UpdateContext, current: State, planned: State) -> Optional[State]:
         """Update the resource to the planned state, returning the actual state after the update"""
@@ -182,11 +240,81 @@ class Resource(AbstractResource, Protocol):
         return old
 
 
+class AsyncDataSource(DataSource, Protocol):
+    """
+    A :class:`DataSource` whose `read` is a coroutine.
+
+    Served by ``run_provider(..., aio=True)``, many reads can wait on I/O at once on a single event loop.
+    Any other method may also be defined with ``async def``.
+    """
+
+    @abstractmethod
+    async def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:  # pyre-ignore[15]
+        """Read the data source"""
+
+
+class AsyncResource(Resource, Protocol):
+    """
+    A :class:`Resource` whose CRUD methods are coroutines.
+
+    Served by ``run_provider(..., aio=True)``, many resource operations can wait on I/O at once on a single
+    event loop. `validate`, `plan`, `import_`, `upgrade`, and `read_many` may also be overridden with ``async def``.
+    """
+
+    @abstractmethod
+    async def create(self, ctx: CreateContext, planned: State) -> Optional[State]:  # pyre-ignore[15]
+        """Create the resource, returning the actual state after creation"""
+
+    @abstractmethod
+    async def read(self, ctx: ReadContext, current: State) -> Optional[State]:  # pyre-ignore[15]
+        """Read the current state of the resource"""
+
+    @abstractmethod
+    async def update(self, ctx: UpdateContext, current: State, planned: State) -> Optional[State]:  # pyre-ignore[15]
+        """Update the resource to the planned state, returning the actual state after the update"""
+
+    @abstractmethod
+    async def delete(self, ctx: DeleteContext, current: State):  # pyre-ignore[15]
+        """Delete the resource, returning None generally"""
+
+
 def is_importable(klass: Type[Resource]) -> bool:
     """Has the resource implemented the import_ method"""
     return hasattr(klass, "import_") and klass.import_ is not Resource.import_
 
 
+def shares_reads(klass: Type[DataSource]) -> bool:
+    """Do concurrent reads of the data source with the same configuration share a result"""
+    return getattr(klass, "share_reads", True) is True
+
+
+def reads_many(klass: Type[Resource]) -> bool:
+    """Has the resource implemented the read_many method"""
+    return getattr(klass, "read_many", Resource.read_many) is not Resource.read_many
+
+
+def uses_lazy_state(klass: Type[Resource]) -> bool:
+    """Has the resource opted into lazily-decoded state"""
+    return getattr(klass, "lazy_state", False) is True
+
+
+class Lifecycle(Enum):
+    """
+    How long an element instance (resource, data source, or function) lives.
+
+    * ``PerCall``: a new instance is created for every RPC. This is the default.
+    * ``PerThread``: each gRPC worker thread keeps its own instance of each element type.
+      Instances are reused across RPCs without being shared between threads.
+      The asyncio server (``run_provider(..., aio=True)``) has no such threads, so there it is the same as ``PerCall``.
+    * ``Singleton``: one instance of each element type is shared by every RPC.
+      The element must be thread-safe, as RPCs are served concurrently.
+    """
+
+    PerCall = "per_call"
+    PerThread = "per_thread"
+    Singleton = "singleton"
+
+
 class Provider(Protocol):
     @abstractmethod
     def get_model_prefix(self) -> str:
@@ -220,6 +348,24 @@ class Provider(Protocol):
         """Get all the function types that this provider supports"""
         return []
 
+    def get_schema_cache_key(self) -> Optional[str]:
+        """
+        Opt into caching the provider's serialized schema on disk, shared by every process of the provider.
+
+        Return a key that changes whenever any schema changes, typically the provider's version.
+        Return None (the default) to build the schema in every process.
+        """
+        return None
+
+    def get_lifecycle(self, klass: Type[Resource] | Type[DataSource] | Type["Function"]) -> Lifecycle:
+        """
+        Get the lifecycle of instances of the given element type.
+
+        Reuse instances when they are expensive to create (HTTP sessions, clients, parsed config).
+        The instances are created with :func:`new_resource`, :func:`new_data_source`, and :func:`new_function`.
+        """
+        return Lifecycle.PerCall
+
     def new_resource(self, klass: Type[Resource]) -> Resource:
         return klass(self)  # pyre-ignore[19]: noqa: Don't care about __init__
 
@@ -0,0 +1,210 @@
+"""
+Per-RPC metrics, recorded when ``TF_PLUGIN_METRICS`` is set (see :func:`~tf.runner.run_provider`).
+
+Each RPC is timed end to end, and the RPCs that call into a resource, data source or function are split into
+the time spent in the SDK before the first call (decoding), in the element's code (the callback),
+and in the SDK after the last call returned (encoding). The size of the request's and the response's
+``DynamicValue`` fields is recorded too. Everything is kept in histograms per method and type name.
+"""
+
+import bisect
+import json
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Optional
+
+from tf.utils import _pb
+
+# Upper bounds of the histogram buckets: 100us to ~105s, and 64B to 64MiB
+_SECONDS = tuple(0.0001 * 2**i for i in range(21))
+_BYTES = tuple(64 * 4**i for i in range(11))
+
+_METRICS = {
+    "tf_rpc_duration_seconds": ("Time spent serving the RPC", _SECONDS),
+    "tf_rpc_decode_seconds": ("Time spent in the SDK before calling into the element", _SECONDS),
+    "tf_rpc_callback_seconds": ("Time spent in the resource, data source or function", _SECONDS),
+    "tf_rpc_encode_seconds": ("Time spent in the SDK after the element returned", _SECONDS),
+    "tf_rpc_request_bytes": ("Size of the request's DynamicValues", _BYTES),
+    "tf_rpc_response_bytes": ("Size of the response's DynamicValues", _BYTES),
+}
+
+
+class Histogram:
+    """Counts of observed values per bucket, with fixed bucket bounds"""
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is everything above the last bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile. Values above the last bound are reported as it."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return self.bounds[-1]
+
+
+class RpcTimer:
+    """Where the time of one RPC went. Calls into the element are marked by the servicer."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.callback = 0.0
+        self.first_call: Optional[float] = None
+        self.last_return: Optional[float] = None
+        self._call_start = 0.0
+
+    def call_started(self, call: Any = None):
+        """The servicer is about to make the call into the element"""
+        self._call_start = time.perf_counter()
+        if self.first_call is None:
+            self.first_call = self._call_start
+
+    def call_finished(self):
+        """The call into the element returned, or raised"""
+        self.last_return = time.perf_counter()
+        self.callback += self.last_return - self._call_start
+
+
+class _IdleTimer(RpcTimer):
+    """Stands in when metrics aren't being recorded"""
+
+    def call_started(self, call: Any = None):
+        pass
+
+    def call_finished(self):
+        pass
+
+
+_current_rpc: ContextVar[RpcTimer] = ContextVar("tf_current_rpc", default=_IdleTimer())
+
+
+def current_rpc() -> RpcTimer:
+    """The timer of the RPC being served, it does nothing unless metrics are being recorded"""
+    return _current_rpc.get()
+
+
+def _dynamic_value_size(message: Any) -> Optional[int]:
+    """Total size of the message's DynamicValue fields, or None if it has none"""
+    if not hasattr(message, "ListFields"):
+        return None  # Already serialized
+
+    dynamic_value = _pb().DynamicValue.DESCRIPTOR
+
+    size = None
+    for field, value in message.ListFields():
+        if field.message_type is dynamic_value:
+            values = value if field.label == field.LABEL_REPEATED else [value]
+            size = (size or 0) + sum(v.ByteSize() for v in values)
+
+    return size
+
+
+class Metrics:
+    """
+    Histograms of every RPC served, by metric name, method and type name.
+
+    :param path: Where :meth:`close` writes the metrics to, see :meth:`write`
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, str, str], Histogram] = {}
+
+    def observe(self, name: str, method: str, type_name: str, value: float):
+        with self._lock:
+            histogram = self._histograms.get((name, method, type_name))
+            if histogram is None:
+                histogram = self._histograms[(name, method, type_name)] = Histogram(_METRICS[name][1])
+
+            histogram.observe(value)
+
+    def start(self, method: str, request: Any) -> Any:
+        """Start timing an RPC on this thread or task, returning a token to :meth:`finish` it with"""
+        return _current_rpc.set(RpcTimer())
+
+    def finish(self, token: Any, method: str, request: Any, response: Any):
+        """Record an RPC started with :meth:`start`. A failed RPC has no response."""
+        timer = _current_rpc.get()
+        _current_rpc.reset(token)
+        end = time.perf_counter()
+
+        type_name = getattr(request, "type_name", None) or getattr(request, "name", "")
+        self.observe("tf_rpc_duration_seconds", method, type_name, end - timer.start)
+
+        if timer.first_call is not None and timer.last_return is not None:
+            self.observe("tf_rpc_decode_seconds", method, type_name, timer.first_call - timer.start)
+            self.observe("tf_rpc_callback_seconds", method, type_name, timer.callback)
+            self.observe("tf_rpc_encode_seconds", method, type_name, end - timer.last_return)
+
+        for name, message in [("tf_rpc_request_bytes", request), ("tf_rpc_response_bytes", response)]:
+            size = _dynamic_value_size(message)
+            if size is not None:
+                self.observe(name, method, type_name, size)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+
+        metrics: dict[str, list] = {name: [] for name in _METRICS}
+        for (name, method, type_name), h in histograms:
+            metrics[name].append(
+                {
+                    "method": method,
+                    "type_name": type_name,
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                    "buckets": [[bound, count] for bound, count in zip([*h.bounds, "+Inf"], h.counts)],
+                }
+            )
+
+        return metrics
+
+    def to_prometheus(self) -> str:
+        """The histograms in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        for name, (description, _) in _METRICS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for (series, method, type_name), h in histograms:
+                if series != name:
+                    continue
+
+                labels = f'method="{method}",type_name="{type_name}"'
+                cumulative = 0
+                for bound, count in zip([*map(repr, h.bounds), "+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {h.sum!r}")
+                lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.path is not None:
+            self.write(self.path)
+
+    def write(self, path: Path):
+        """Write the metrics to the path, as JSON if it ends in ``.json`` and in the Prometheus text format otherwise"""
+        if path.suffix == ".json":
+            path.write_text(json.dumps(self.to_json(), indent=2))
+        else:
+            path.write_text(self.to_prometheus())
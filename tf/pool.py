@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+@dataclass(frozen=True)
+class PoolMetrics:
+    """A snapshot of a :class:`WorkerPool`"""
+
+    workers: int
+    """Threads currently alive"""
+
+    max_workers: int
+    """Threads the pool may currently start. Only changes in adaptive mode."""
+
+    queue_depth: int
+    """Tasks submitted but not yet started"""
+
+    max_queue_depth: int
+    """Deepest the queue has been"""
+
+    tasks: int
+    """Tasks started"""
+
+    mean_wait: float
+    """Mean seconds a task spent in the queue before starting"""
+
+    max_wait: float
+    """Longest a task spent in the queue before starting, in seconds"""
+
+
+class WorkerPool(ThreadPoolExecutor):
+    """
+    A thread pool for the gRPC server that keeps track of how long RPCs wait for a worker.
+
+    In adaptive mode (``max_workers_limit`` above ``max_workers``) the pool doubles its size, up to the limit,
+    whenever the recent average time spent waiting in the queue rises above ``grow_after`` seconds,
+    or a task is submitted while the oldest queued one has waited longer than that (e.g. every worker is stuck).
+    The pool never shrinks, idle threads are cheap.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_workers_limit: Optional[int] = None,
+        grow_after: float = 0.05,
+        thread_name_prefix: str = "",
+    ):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+        # Growing relies on CPython's ThreadPoolExecutor internals: submit calls _adjust_thread_count, which starts
+        # a thread if none are idle and there are fewer than _max_workers. Without them, the pool keeps its size.
+        if not (isinstance(getattr(self, "_max_workers", None), int) and hasattr(self, "_adjust_thread_count")):
+            max_workers_limit = None
+
+        self.max_workers_limit = max(max_workers, max_workers_limit or max_workers)
+        self.grow_after = grow_after
+
+        self._stats_lock = threading.Lock()
+        # When each queued task was submitted, oldest first. Workers take tasks in that order.
+        self._pending: deque[float] = deque()
+        self._max_queued = 0
+        self._tasks = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        # Exponentially weighted, so a burst of waiting grows the pool without a long history diluting it
+        self._wait_recent = 0.0
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        enqueued = time.monotonic()
+        with self._stats_lock:
+            self._pending.append(enqueued)
+            self._max_queued = max(self._max_queued, len(self._pending))
+
+            # No task starts (and reports its wait) while every worker is stuck, but the oldest queued one shows it.
+            # Threads the pool already grew by are started by submits, so wait for those before growing again.
+            if enqueued - self._pending[0] > self.grow_after and len(self._threads) >= self._max_workers:
+                self._grow()
+
+        def run():
+            self._started(time.monotonic() - enqueued)
+            return fn(*args, **kwargs)
+
+        try:
+            return super().submit(run)
+        except RuntimeError:
+            # Shut down
+            with self._stats_lock:
+                self._pending.pop()
+            raise
+
+    def _started(self, waited: float):
+        with self._stats_lock:
+            self._pending.popleft()
+            self._tasks += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._wait_recent = 0.8 * self._wait_recent + 0.2 * waited
+
+            if self._wait_recent > self.grow_after:
+                self._grow()
+
+    def _grow(self):
+        """Double the number of threads the pool may start, up to the limit. Called with the stats lock held."""
+        if self._max_workers < self.max_workers_limit:
+            # New threads are started by the following submits, which are the ones stuck waiting
+            self._max_workers = min(self.max_workers_limit, self._max_workers * 2)
+            self._wait_recent = 0.0
+
+    def metrics(self) -> PoolMetrics:
+        with self._stats_lock:
+            return PoolMetrics(
+                workers=len(self._threads),
+                max_workers=self._max_workers,
+                queue_depth=len(self._pending),
+                max_queue_depth=self._max_queued,
+                tasks=self._tasks,
+                mean_wait=self._wait_total / self._tasks if self._tasks else 0.0,
+                max_wait=self._wait_max,
+            )
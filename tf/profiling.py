@@ -0,0 +1,118 @@
+"""
+Sampling profiler, run when ``TF_PLUGIN_PROFILE`` is set (see :func:`~tf.runner.run_provider`).
+
+While the provider is served, a background thread takes the stack of every other thread ``interval`` seconds apart.
+Each sample is filed under the RPC method the thread was serving, found from the servicer's method on its stack.
+Threads that are waiting for work are left out, and threads busy outside of any RPC (e.g. sync elements run in
+worker threads by the asyncio server) are filed under ``other``.
+
+The samples are written when the provider stops, as collapsed stacks: a line per distinct stack, with its frames
+separated by ``;`` and followed by the number of samples. This is what ``flamegraph.pl``, speedscope and inferno read.
+With ``{method}`` in the path, each method's samples are written to a file of their own. Otherwise they are written
+to the one file, each stack under a root frame named after the method.
+"""
+
+import os
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Optional
+
+_OTHER = "other"
+
+# Where a thread's innermost frame is while it blocks waiting for work
+_IDLE_FILES = frozenset(["threading.py", "queue.py", "selectors.py"])
+
+# gRPC's functions that block in a completion queue's poll(), by file in the grpc package: the server's thread
+# waiting for RPCs, and channels watching their connectivity
+_IDLE_GRPC_FUNCTIONS = frozenset([("_server.py", "_serve"), ("_channel.py", "_poll_connectivity")])
+
+
+def _is_idle(code: CodeType) -> bool:
+    directory, file = os.path.split(code.co_filename)
+    if file in _IDLE_FILES:
+        return True
+
+    return os.path.basename(directory) == "grpc" and (file, code.co_name) in _IDLE_GRPC_FUNCTIONS
+
+
+def _frame_name(code: CodeType) -> str:
+    return f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """
+    Samples the stacks of every thread, and writes them to a file as collapsed stacks per RPC method.
+
+    :param path: File to write the samples to, ``{method}`` in it is replaced with each method's name
+    :param interval: Seconds between samples
+    """
+
+    def __init__(self, path: Path, interval: float = 0.005):
+        from tf import provider
+        from tf.gen import tfplugin_pb2 as pb
+
+        self.path = path
+        self.interval = interval
+        self.samples = 0
+        self._counts: Counter[tuple[str, tuple[CodeType, ...]]] = Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._servicer_file = provider.__file__
+        self._methods = frozenset(pb.DESCRIPTOR.services_by_name["Provider"].methods_by_name)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="tf-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or _is_idle(frame.f_code):
+                continue
+
+            method = _OTHER
+            stack = []
+            f: Optional[FrameType] = frame
+            while f is not None:
+                code = f.f_code
+                stack.append(code)
+                if code.co_name in self._methods and code.co_filename == self._servicer_file:
+                    method = code.co_name
+                f = f.f_back
+
+            stack.reverse()
+            self._counts[(method, tuple(stack))] += 1
+            self.samples += 1
+
+    def to_folded(self) -> dict[str, list[str]]:
+        """Collapsed stack lines by method"""
+        lines: dict[str, list[str]] = {}
+        for (method, stack), count in self._counts.items():
+            lines.setdefault(method, []).append(f"{';'.join(map(_frame_name, stack))} {count}")
+
+        return {method: sorted(method_lines) for method, method_lines in sorted(lines.items())}
+
+    def close(self):
+        """Stop sampling, and write the samples out"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        folded = self.to_folded()
+        if "{method}" in self.path.name:
+            files = {
+                self.path.with_name(self.path.name.replace("{method}", method)): lines
+                for method, lines in folded.items()
+            }
+        else:
+            files = {self.path: [f"{method};{line}" for method, lines in folded.items() for line in lines]}
+
+        for path, lines in files.items():
+            path.write_text("".join(line + "\n" for line in lines))
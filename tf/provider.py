@@ -1,12 +1,20 @@
+import asyncio
 import functools
+import hashlib
+import inspect
 import json
+import threading
 import traceback
+from concurrent.futures import Future
 from copy import deepcopy
-from typing import Any, Optional, Tuple, Type, cast
+from pathlib import Path
+from typing import Any, Callable, Generator, Mapping, Optional, Type, TypeAlias, TypeVar, cast
 
 import grpc
 
-from tf.function import CallContext, Function
+from tf.batch import Batcher, LruCache, SingleFlight
+from tf.codec import EncodeError, StateCodec  # noqa: F401 EncodeError is re-exported
+from tf.function import CallBatchContext, CallContext, CallPlan, Function
 from tf.gen import tfplugin_pb2 as pb
 from tf.gen import tfplugin_pb2_grpc as rpc
 from tf.iface import (
@@ -14,116 +22,200 @@ from tf.iface import (
     DataSource,
     DeleteContext,
     ImportContext,
+    Lifecycle,
     PlanContext,
     Provider,
     ReadContext,
     ReadDataContext,
+    ReadManyContext,
     Resource,
+    State,
     UpdateContext,
     UpgradeContext,
     is_importable,
+    reads_many,
+    shares_reads,
+    uses_lazy_state,
 )
+from tf.metrics import current_rpc
 from tf.schema import Attribute, NestedBlock
-from tf.types import Unknown
-from tf.utils import Diagnostic, Diagnostics, _to_attribute_path, read_dynamic_value, to_dynamic_value
+from tf.utils import (
+    Diagnostic,
+    Diagnostics,
+    _to_attribute_path,
+    _write_atomic,
+    read_dynamic_value,
+    to_dynamic_value,
+)
 
 
-def _decode_state(
-    diags: Diagnostics,
-    attrs: dict[str, Attribute],
-    blocks: dict[str, NestedBlock],
-    state: pb.DynamicValue | dict[str, Any],
-) -> Tuple[Optional[dict], Optional[dict]]:
-    st = read_dynamic_value(state) if isinstance(state, pb.DynamicValue) else state
+def _encode_state(
+    codec: StateCodec, state: Optional[Mapping], old: Optional[Mapping], old_keys: Optional[Mapping] = None
+) -> pb.DynamicValue:
+    """If any encoded values of state matches the old state, we will use the old state's encoded value"""
+    # This preserves byte-for-byte equality for JSON
+    return codec.encode_dynamic(state, old, old_keys)
 
-    if st is None:
-        return None, None
 
-    def try_decode(field_name: str, decode_f, v: Any) -> Any:
-        try:
-            return decode_f(v)
-        except Exception as exc:
-            diags.add_error(
-                f"Failed to decode field '{field_name}'",
-                detail=f"Error decoding field '{field_name}': {exc}",
-                path=[field_name],
-            )
+def _read_many(inst: Resource, type_name: str, items: list[tuple[ReadContext, State]]) -> Any:
+    """Run a batch of ReadResource calls with the resource's read_many"""
+    ctx = ReadManyContext(Diagnostics(), type_name, [read_ctx for read_ctx, _ in items])
 
-            return Unknown
+    def spread(states: list[Optional[State]]) -> list[Optional[State]]:
+        # Diagnostics about the whole batch are reported for each resource in it
+        for read_ctx in ctx.contexts:
+            read_ctx.diagnostics.diagnostics.extend(ctx.diagnostics.diagnostics)
+        return states
 
-    attr_state = {
-        k: try_decode(k, attrs[k].type.decode, v) if v is not Unknown else v for k, v in st.items() if k in attrs
-    }
-    block_state = {
-        k: try_decode(k, blocks[k].decode, v) if v is not Unknown else v for k, v in st.items() if k in blocks
-    }
+    states = inst.read_many(ctx, [state for _, state in items])
+    if inspect.iscoroutine(states):
 
-    return st, {**attr_state, **block_state}
+        async def spread_async():
+            return spread(await states)
 
+        return spread_async()
 
-def _encode_state_d(
-    attrs: dict[str, Attribute],
-    blocks: dict[str, NestedBlock],
-    state: Optional[dict],
-    old: Optional[dict],
-) -> dict[str, Any] | None:
-    """If any encoded values of state matches the old state, we will use the old state's encoded value"""
-    # This preserves byte-for-byte equality for JSON
+    return spread(states)
+
+
+def _call_batch(inst: Function, name: str, items: list[tuple[CallContext, list[Any]]]) -> list[Any]:
+    """Run a batch of CallFunction calls with the function's call_batch"""
+    ctx = CallBatchContext(Diagnostics(), name, [call_ctx for call_ctx, _ in items])
+    results = inst.call_batch(ctx, [args for _, args in items])
+
+    # Diagnostics about the whole batch are reported for each call in it
+    for call_ctx in ctx.contexts:
+        call_ctx.diagnostics.diagnostics.extend(ctx.diagnostics.diagnostics)
+    return results
+
+
+def _get_schema_cache_path(full_name: str, key: str) -> Path:
+    """Get the path for caching a serialized provider schema"""
+    cache_dir = Path.home() / ".cache" / "tf-python-provider" / "schemas"
+    digest = hashlib.sha256(f"{full_name}\0{key}".encode()).hexdigest()
+    return cache_dir / f"{digest}.pb"
+
+
+_T = TypeVar("_T")
 
-    if state is None:
-        return None
 
-    encoded = {}
+class _InstancePool:
+    """Hands out element instances according to the provider's :class:`~tf.iface.Lifecycle` for each type"""
 
-    for k, v in state.items():
+    def __init__(self, app: Provider, per_thread: bool = True):
+        self.app = app
+        # Without per-thread instances, PerThread elements get a new instance for every call instead
+        self._per_thread = per_thread
+        self._lifecycles: dict[type, Lifecycle] = {}
+        self._singletons: dict[type, Any] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self, klass: Type[_T], factory: Callable[[Type[_T]], _T]) -> _T:
+        lifecycle = self._lifecycles.get(klass)
+        if lifecycle is None:
+            lifecycle = self.app.get_lifecycle(klass)  # pyre-ignore[6]
+            if lifecycle is Lifecycle.PerThread and not self._per_thread:
+                lifecycle = Lifecycle.PerCall
+
+            self._lifecycles[klass] = lifecycle
+
+        if lifecycle is Lifecycle.PerThread:
+            instances = self._local.__dict__.setdefault("instances", {})
+            if klass not in instances:
+                instances[klass] = factory(klass)
+
+            return instances[klass]
+
+        if lifecycle is Lifecycle.Singleton:
+            with self._lock:
+                if klass not in self._singletons:
+                    self._singletons[klass] = factory(klass)
+
+                return self._singletons[klass]
+
+        return factory(klass)
+
+
+_Steps: TypeAlias = Generator[functools.partial | Future, Any, _T]
+"""
+The body of an RPC that calls into an element. Each call into the element is yielded rather than made,
+and the result is sent back in (or the exception it raised is thrown in). This lets the same RPC run under both
+the sync and the asyncio server. A yielded future, or one returned by a call, is waited for.
+"""
+
+
+def _run_steps(steps: _Steps[_T]) -> _T:
+    """Run an RPC's steps on this thread. Coroutines from async elements are run to completion on a new event loop."""
+    timer = current_rpc()
+    resume, value = steps.send, None
+    while True:
         try:
-            if v is Unknown:
-                encoded[k] = Unknown
-            elif k in attrs:
-                # Check if we can reuse the old encoded value
-                if old and k in old:
-                    # For simple types, compare encoded values directly
-                    if attrs[k].type.__class__.__name__ in ("Number", "String", "Bool"):
-                        new_encoded = attrs[k].type.encode(v)
-                        if old[k] == new_encoded:
-                            encoded[k] = old[k]
-                        else:
-                            encoded[k] = new_encoded
-
-                    # If the previous value was Unknown and the new one is not, we just accept the new one
-                    elif old[k] is Unknown:
-                        encoded[k] = attrs[k].type.encode(v)
-
-                    # For complex types, use semantic equality
-                    elif attrs[k].type.semantically_equal(attrs[k].type.decode(old[k]), v):
-                        encoded[k] = old[k]
-                    else:
-                        encoded[k] = attrs[k].type.encode(v)
-                else:
-                    encoded[k] = attrs[k].type.encode(v)
-            else:
-                # block
-                if old and k in old and blocks[k].semantically_equal(blocks[k].decode(old[k]), v):
-                    encoded[k] = old[k]
-                else:
-                    encoded[k] = blocks[k].encode(v)
+            step = resume(value)
+        except StopIteration as stop:
+            return stop.value
+
+        timer.call_started(step)
+        try:
+            value = step if isinstance(step, Future) else step()
+            if inspect.iscoroutine(value):
+                value = asyncio.run(value)
+            elif isinstance(value, Future):
+                # Joined a batch, or waiting on another RPC
+                value = value.result()
         except Exception as exc:
-            raise EncodeError(f"Failed to encode field '{k}': {type(exc).__name__}: {exc}") from exc
+            resume, value = steps.throw, exc
+        else:
+            resume = steps.send
+        timer.call_finished()
 
-    return encoded
 
+async def _run_steps_async(steps: _Steps[_T]) -> _T:
+    """Run an RPC's steps on the event loop. Calls into sync elements are run in a worker thread."""
+    timer = current_rpc()
+    resume, value = steps.send, None
+    while True:
+        try:
+            step = resume(value)
+        except StopIteration as stop:
+            return stop.value
 
-def _encode_state(
-    attrs: dict[str, Attribute], blocks: dict[str, NestedBlock], state: Optional[dict], old: Optional[dict]
-) -> pb.DynamicValue:
-    """If any encoded values of state matches the old state, we will use the old state's encoded value"""
-    # This preserves byte-for-byte equality for JSON
-    return to_dynamic_value(_encode_state_d(attrs, blocks, state, old))
+        timer.call_started(step)
+        try:
+            if isinstance(step, Future):
+                value = step
+            elif inspect.iscoroutinefunction(step.func):
+                value = await step()
+            elif getattr(step.func, "nonblocking", False):
+                value = step()
+            else:
+                value = await asyncio.to_thread(step)
+
+            if isinstance(value, Future):
+                # Joined a batch, or waiting on another RPC
+                value = await asyncio.wrap_future(value)
+        except Exception as exc:
+            resume, value = steps.throw, exc
+        else:
+            resume = steps.send
+        timer.call_finished()
 
 
 def _log_errors(f):
     """Decorator because there is no global try/catch mechanism in grpc??"""
 
+    if inspect.iscoroutinefunction(f):
+
+        @functools.wraps(f)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await f(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
+                raise
+
+        return async_wrapper
+
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
         try:
@@ -142,14 +234,30 @@ class ProviderServicer(rpc.ProviderServicer):
         self._res_cls_map: Optional[dict[str, Type[Resource]]] = None
         self._func_cls_map: Optional[dict[str, Type[Function]]] = None
 
-        # Getting a resource's attributes in k-v form is very common, want to cache
-        self._res_attr_map: dict[str, dict[str, Attribute]] = {}
-        # Sam for res blocks
-        self._res_block_map: dict[str, dict[str, NestedBlock]] = {}
+        # Compiled call plans per function, they are used on every CallFunction
+        self._func_plan_map: dict[str, CallPlan] = {}
+
+        # Compiled state codecs per resource type, they are used on every resource RPC
+        self._res_codec_map: dict[str, StateCodec] = {}
+
+        # Reused element instances, if the provider opts into it
+        self._instances = _InstancePool(app)
+
+        # Coalesces concurrent ReadResource calls, per resource type that implements read_many
+        self._read_batchers: dict[str, Batcher[tuple[ReadContext, State]]] = {}
+
+        # Shares ReadDataSource responses between calls with the same configuration
+        self._data_source_reads = SingleFlight()
 
-        # Cache for schemas to avoid repeated computation
-        self._ds_schema_cache: dict[str, Any] = {}
-        self._res_schema_cache: dict[str, Any] = {}
+        # Remembered CallFunction responses, per pure function
+        self._function_memos: dict[str, LruCache] = {}
+
+        # Coalesces concurrent CallFunction calls, per function that implements call_batch
+        self._call_batchers: dict[str, Batcher[tuple[CallContext, list[Any]]]] = {}
+
+        # Serialized GetProviderSchema response, it never changes for the life of the process
+        self._provider_schema: Optional[bytes] = None
+        self._provider_schema_lock = threading.Lock()
 
     def _load_ds_cls_map(self) -> dict[str, Type[DataSource]]:
         if self._ds_cls_map is None:
@@ -171,19 +279,18 @@ class ProviderServicer(rpc.ProviderServicer):
     def _get_res_cls(self, type_name: str) -> Type[Resource]:
         return self._load_res_cls_map()[type_name]
 
-    def _get_res_attrs(self, type_name: str) -> dict[str, Attribute]:
-        if type_name not in self._res_attr_map:
+    def _get_res_codec(self, type_name: str) -> StateCodec:
+        if type_name not in self._res_codec_map:
             klass = self._get_res_cls(type_name)
-            self._res_attr_map[type_name] = {a.name: a for a in klass.get_schema().attributes}
+            self._res_codec_map[type_name] = StateCodec.from_schema(klass.get_schema())
 
-        return self._res_attr_map[type_name]
+        return self._res_codec_map[type_name]
 
-    def _get_res_blocks(self, type_name: str) -> dict[str, NestedBlock]:
-        if type_name not in self._res_block_map:
-            klass = self._get_res_cls(type_name)
-            self._res_block_map[type_name] = {b.type_name: b for b in klass.get_schema().block_types}
+    def _get_res_attrs(self, type_name: str) -> Mapping[str, Attribute]:
+        return self._get_res_codec(type_name).attributes
 
-        return self._res_block_map[type_name]
+    def _get_res_blocks(self, type_name: str) -> Mapping[str, NestedBlock]:
+        return self._get_res_codec(type_name).blocks
 
     def _load_func_cls_map(self) -> dict[str, Type[Function]]:
         if self._func_cls_map is None:
@@ -194,6 +301,12 @@ class ProviderServicer(rpc.ProviderServicer):
     def _get_func_cls(self, name: str) -> Type[Function]:
         return self._load_func_cls_map()[name]
 
+    def _get_func_plan(self, name: str) -> CallPlan:
+        if name not in self._func_plan_map:
+            self._func_plan_map[name] = CallPlan(self._get_func_cls(name))
+
+        return self._func_plan_map[name]
+
     @_log_errors
     def GetMetadata(self, request: pb.GetMetadata.Request, context: grpc.ServicerContext):
         # Return empty metadata - this is called by Terraform to check capabilities
@@ -208,27 +321,12 @@ class ProviderServicer(rpc.ProviderServicer):
         )
 
     # ----------------- Provider ----------------- #
-    @_log_errors
-    def GetProviderSchema(self, request: pb.GetProviderSchema.Request, context: grpc.ServicerContext):
+    def _build_provider_schema(self) -> pb.GetProviderSchema.Response:
         diags = Diagnostics()
         schema = self.app.get_provider_schema(diags).to_pb()
-        self._load_ds_cls_map()
-        self._load_res_cls_map()
-        self._load_func_cls_map()
-
-        # Use cached schemas
-        ds_schemas = {}
-        for type_name, klass in self._load_ds_cls_map().items():
-            if type_name not in self._ds_schema_cache:
-                self._ds_schema_cache[type_name] = klass.get_schema().to_pb()
-            ds_schemas[type_name] = self._ds_schema_cache[type_name]
-
-        res_schema = {}
-        for type_name, klass in self._load_res_cls_map().items():
-            if type_name not in self._res_schema_cache:
-                self._res_schema_cache[type_name] = klass.get_schema().to_pb()
-            res_schema[type_name] = self._res_schema_cache[type_name]
 
+        ds_schemas = {type_name: klass.get_schema().to_pb() for type_name, klass in self._load_ds_cls_map().items()}
+        res_schema = {type_name: klass.get_schema().to_pb() for type_name, klass in self._load_res_cls_map().items()}
         func_schemas = {name: klass.get_signature().to_pb() for name, klass in self._load_func_cls_map().items()}
 
         # Create a proper provider_meta schema
@@ -245,7 +343,7 @@ class ProviderServicer(rpc.ProviderServicer):
             ),
         )
 
-        resp = pb.GetProviderSchema.Response(
+        return pb.GetProviderSchema.Response(
             provider=schema,
             provider_meta=provider_meta,
             diagnostics=diags.to_pb(),
@@ -253,7 +351,43 @@ class ProviderServicer(rpc.ProviderServicer):
             resource_schemas=res_schema,
             functions=func_schemas,
         )
-        return resp
+
+    def get_provider_schema_bytes(self) -> bytes:
+        """
+        The serialized GetProviderSchema response.
+
+        It's built once per process, or loaded from disk if the provider opts into
+        :func:`~tf.iface.Provider.get_schema_cache_key` and a previous process already built it.
+        """
+        with self._provider_schema_lock:
+            if self._provider_schema is None:
+                self._provider_schema = self._load_provider_schema()
+
+            return self._provider_schema
+
+    def _load_provider_schema(self) -> bytes:
+        key = self.app.get_schema_cache_key()
+        cache_path = _get_schema_cache_path(self.app.full_name(), key) if key is not None else None
+
+        if cache_path is not None:
+            try:
+                return cache_path.read_bytes()
+            except OSError:
+                pass
+
+        resp = self._build_provider_schema()
+        serialized = resp.SerializeToString()
+
+        # Never persist a schema that failed to build
+        if cache_path is not None and not any(d.severity == pb.Diagnostic.ERROR for d in resp.diagnostics):
+            _write_atomic(cache_path, serialized)
+
+        return serialized
+
+    @_log_errors
+    def GetProviderSchema(self, request: pb.GetProviderSchema.Request, context: grpc.ServicerContext):
+        # The gRPC server serves the cached bytes directly (see tf.runner), this path is for everything else
+        return pb.GetProviderSchema.Response.FromString(self.get_provider_schema_bytes())
 
     @_log_errors
     def ValidateProviderConfig(self, request: pb.ValidateProviderConfig.Request, context: grpc.ServicerContext):
@@ -265,27 +399,42 @@ class ProviderServicer(rpc.ProviderServicer):
 
     @_log_errors
     def ValidateResourceConfig(self, request: pb.ValidateResourceConfig.Request, context: grpc.ServicerContext):
+        return _run_steps(self._validate_resource_config(request))
+
+    def _validate_resource_config(
+        self, request: pb.ValidateResourceConfig.Request
+    ) -> _Steps[pb.ValidateResourceConfig.Response]:
         conf = read_dynamic_value(request.config)
         type_name = request.type_name
         klass = self._get_res_cls(type_name)
-        inst = self.app.new_resource(klass)
+        inst = self._instances.get(klass, self.app.new_resource)
         diags = Diagnostics()
 
-        inst.validate(diags, type_name, conf)
+        yield functools.partial(inst.validate, diags, type_name, conf)
         return pb.ValidateResourceConfig.Response(diagnostics=diags.to_pb())
 
     @_log_errors
     def ValidateDataResourceConfig(self, request: pb.ValidateDataResourceConfig.Request, context: grpc.ServicerContext):
+        return _run_steps(self._validate_data_resource_config(request))
+
+    def _validate_data_resource_config(
+        self, request: pb.ValidateDataResourceConfig.Request
+    ) -> _Steps[pb.ValidateDataResourceConfig.Response]:
         conf = read_dynamic_value(request.config)
         klass = self._get_ds_cls(request.type_name)
-        inst = self.app.new_data_source(klass)
+        inst = self._instances.get(klass, self.app.new_data_source)
         diags = Diagnostics()
 
-        inst.validate(diags, request.type_name, conf)
+        yield functools.partial(inst.validate, diags, request.type_name, conf)
         return pb.ValidateDataResourceConfig.Response(diagnostics=diags.to_pb())
 
     @_log_errors
     def UpgradeResourceState(self, request: pb.UpgradeResourceState.Request, context: grpc.ServicerContext):
+        return _run_steps(self._upgrade_resource_state(request))
+
+    def _upgrade_resource_state(
+        self, request: pb.UpgradeResourceState.Request
+    ) -> _Steps[pb.UpgradeResourceState.Response]:
         diags = Diagnostics()
 
         if len(request.raw_state.flatmap) != 0:
@@ -298,14 +447,16 @@ class ProviderServicer(rpc.ProviderServicer):
 
         state = json.loads(request.raw_state.json)
         klass = self._get_res_cls(request.type_name)
-        inst = self.app.new_resource(klass)
+        inst = self._instances.get(klass, self.app.new_resource)
         schema = klass.get_schema()
 
         old_version = request.version
         new_version = schema.version
 
         if new_version is None or old_version is None or old_version < new_version:
-            state = inst.upgrade(UpgradeContext(diags, request.type_name), old_version, deepcopy(state))
+            state = yield functools.partial(
+                inst.upgrade, UpgradeContext(diags, request.type_name), old_version, deepcopy(state)
+            )
 
         return pb.UpgradeResourceState.Response(
             upgraded_state=to_dynamic_value(state),
@@ -323,12 +474,19 @@ class ProviderServicer(rpc.ProviderServicer):
     # ----------------- Resource Lifecycle ----------------- #
     @_log_errors
     def ReadResource(self, request: pb.ReadResource.Request, context: grpc.ServicerContext):
+        return _run_steps(self._read_resource(request))
+
+    def _read_resource(self, request: pb.ReadResource.Request) -> _Steps[pb.ReadResource.Response]:
         diags = Diagnostics()
 
         type_name = request.type_name
-        attrs = self._get_res_attrs(type_name)
-        blocks = self._get_res_blocks(type_name)
-        current_enc, current_state = _decode_state(diags, attrs, blocks, request.current_state)
+        codec = self._get_res_codec(type_name)
+        klass = self._get_res_cls(type_name)
+
+        if uses_lazy_state(klass):
+            current_enc, current_state = codec.decode_lazy(diags, request.current_state)
+        else:
+            current_enc, current_state = codec.decode_dynamic(diags, request.current_state)
 
         if diags.has_errors():
             return pb.ReadResource.Response(diagnostics=diags.to_pb())
@@ -341,36 +499,54 @@ class ProviderServicer(rpc.ProviderServicer):
             )
             return pb.ReadResource.Response(diagnostics=diags.to_pb())
 
-        klass = self._get_res_cls(type_name)
-        inst = self.app.new_resource(klass)
-        new_state = inst.read(ReadContext(diags, type_name), current_state)
+        # Snapshot before the resource gets a chance to mutate the current state
+        current_keys = codec.fingerprint(current_state)
+
+        inst = self._instances.get(klass, self.app.new_resource)
+        ctx = ReadContext(diags, type_name)
+
+        if reads_many(klass):
+            batcher = self._read_batchers.get(type_name) or self._read_batchers.setdefault(
+                type_name, Batcher(klass.read_batch_window, klass.read_batch_size)
+            )
+            new_state = yield functools.partial(
+                batcher.join, functools.partial(_read_many, inst, type_name), (ctx, current_state)
+            )
+        else:
+            new_state = yield functools.partial(inst.read, ctx, current_state)
 
         resp = pb.ReadResource.Response(
-            new_state=_encode_state(attrs, blocks, new_state, current_enc),
+            new_state=_encode_state(codec, new_state, current_enc, current_keys),
             diagnostics=diags.to_pb(),
         )
         return resp
 
     @_log_errors
     def PlanResourceChange(self, request: pb.PlanResourceChange.Request, context: grpc.ServicerContext):
+        return _run_steps(self._plan_resource_change(request))
+
+    def _plan_resource_change(self, request: pb.PlanResourceChange.Request) -> _Steps[pb.PlanResourceChange.Response]:
         type_name = request.type_name
         diags = Diagnostics()
 
-        attrs = self._get_res_attrs(type_name)
-        blocks = self._get_res_blocks(type_name)
-        _, prior_state = _decode_state(diags, attrs, blocks, request.prior_state)
+        codec = self._get_res_codec(type_name)
+        attrs = codec.attributes
+        blocks = codec.blocks
+        _, prior_state = codec.decode_dynamic(diags, request.prior_state)
         if diags.has_errors():
             return pb.PlanResourceChange.Response(diagnostics=diags.to_pb())
 
-        proposed_enc, proposed_new_state = _decode_state(diags, attrs, blocks, request.proposed_new_state)
+        proposed_enc, proposed_new_state = codec.decode_dynamic(diags, request.proposed_new_state)
         if diags.has_errors():
             return pb.PlanResourceChange.Response(diagnostics=diags.to_pb())
 
+        proposed_keys = codec.fingerprint(proposed_new_state)
+
         # config = read_dynamic_value(request.config)
         # prior_private = request.prior_private
 
         klass = self._get_res_cls(type_name)
-        inst = self.app.new_resource(klass)
+        inst = self._instances.get(klass, self.app.new_resource)
 
         # We simplify the logic here. Instead of requiring each implementing resource to implement
         # plan_resource_change and apply_resource_change, we can figure
@@ -398,7 +574,7 @@ class ProviderServicer(rpc.ProviderServicer):
                     else:
                         new_state[k] = attrs[k].default
 
-            new_state_encoded = _encode_state(attrs, blocks, new_state, proposed_enc)
+            new_state_encoded = _encode_state(codec, new_state, proposed_enc, proposed_keys)
             return pb.PlanResourceChange.Response(planned_state=new_state_encoded, diagnostics=diags.to_pb())
 
         # Kind of interesting, TF does not send us DELETE (old_state = SOME and new_state = None)
@@ -439,53 +615,63 @@ class ProviderServicer(rpc.ProviderServicer):
         prior_copy = deepcopy(prior_state) if prior_state is not None else None
         proposed_copy = deepcopy(proposed_new_state) if proposed_new_state is not None else None
 
-        proposed_new_state = inst.plan(
+        proposed_new_state = yield functools.partial(
+            inst.plan,
             PlanContext(diags, type_name, changed_fields=changed_keys),
             prior_copy,
             proposed_copy or {},
         )
 
         return pb.PlanResourceChange.Response(
-            planned_state=_encode_state(attrs, blocks, proposed_new_state, proposed_enc),
+            planned_state=_encode_state(codec, proposed_new_state, proposed_enc, proposed_keys),
             requires_replace=requires_replace,
             diagnostics=diags.to_pb(),
         )
 
     @_log_errors
     def ApplyResourceChange(self, request: pb.ApplyResourceChange.Request, context: grpc.ServicerContext):
+        return _run_steps(self._apply_resource_change(request))
+
+    def _apply_resource_change(
+        self, request: pb.ApplyResourceChange.Request
+    ) -> _Steps[pb.ApplyResourceChange.Response]:
         diags = Diagnostics()
 
         type_name = request.type_name
-        attrs = self._get_res_attrs(type_name)
-        blocks = self._get_res_blocks(type_name)
+        codec = self._get_res_codec(type_name)
 
-        _, prior_state = _decode_state(diags, attrs, blocks, request.prior_state)
+        _, prior_state = codec.decode_dynamic(diags, request.prior_state)
         if diags.has_errors():
             return pb.ApplyResourceChange.Response(diagnostics=diags.to_pb())
 
-        planned_enc, planned_state = _decode_state(diags, attrs, blocks, request.planned_state)
+        planned_enc, planned_state = codec.decode_dynamic(diags, request.planned_state)
         if diags.has_errors():
             return pb.ApplyResourceChange.Response(diagnostics=diags.to_pb())
 
+        # Snapshot before the resource gets a chance to mutate the planned state
+        planned_keys = codec.fingerprint(planned_state)
+
         klass = self._get_res_cls(type_name)
-        inst = self.app.new_resource(klass)
+        inst = self._instances.get(klass, self.app.new_resource)
 
         if prior_state is None and planned_state is not None:
             # Create
-            new_state = inst.create(CreateContext(diags, type_name), planned_state)
+            new_state = yield functools.partial(inst.create, CreateContext(diags, type_name), planned_state)
         elif prior_state is not None and planned_state is None:
             # Delete
-            new_state = inst.delete(DeleteContext(diags, type_name), prior_state)
+            new_state = yield functools.partial(inst.delete, DeleteContext(diags, type_name), prior_state)
         else:
             prior_state = cast(dict, prior_state)
             planned_state = cast(dict, planned_state)
-            new_state = inst.update(UpdateContext(diags, type_name), prior_state, planned_state)
+            new_state = yield functools.partial(
+                inst.update, UpdateContext(diags, type_name), prior_state, planned_state
+            )
 
         # We use the planned field values if they are semantically equivalent to the new state.
         # For most fields on update and create, the TF client will have already done the hard work
         # of encoding the field values to provide the planned state.
         # We can skip re-encoding them if they semantically match what we got back from the resource.
-        encoded_state = _encode_state(attrs, blocks, new_state, old=planned_enc)
+        encoded_state = _encode_state(codec, new_state, old=planned_enc, old_keys=planned_keys)
 
         return pb.ApplyResourceChange.Response(
             new_state=encoded_state,
@@ -494,6 +680,11 @@ class ProviderServicer(rpc.ProviderServicer):
 
     @_log_errors
     def ImportResourceState(self, request: pb.ImportResourceState.Request, context: grpc.ServicerContext):
+        return _run_steps(self._import_resource_state(request))
+
+    def _import_resource_state(
+        self, request: pb.ImportResourceState.Request
+    ) -> _Steps[pb.ImportResourceState.Response]:
         type_name = request.type_name
         klass = self._get_res_cls(type_name)
 
@@ -505,17 +696,16 @@ class ProviderServicer(rpc.ProviderServicer):
             return pb.ImportResourceState.Response(diagnostics=diags.to_pb())
 
         ctx = ImportContext(Diagnostics(), type_name)
-        inst = self.app.new_resource(klass)
-        state = inst.import_(ctx, request.id)
-        attrs = self._get_res_attrs(type_name)
-        blocks = self._get_res_blocks(type_name)
+        inst = self._instances.get(klass, self.app.new_resource)
+        state = yield functools.partial(inst.import_, ctx, request.id)
+        codec = self._get_res_codec(type_name)
 
         return pb.ImportResourceState.Response(
             imported_resources=(
                 [
                     pb.ImportResourceState.ImportedResource(
                         type_name=type_name,
-                        state=_encode_state(attrs, blocks, state, old=None),
+                        state=_encode_state(codec, state, old=None),
                     ),
                 ]
                 if state is not None
@@ -531,13 +721,40 @@ class ProviderServicer(rpc.ProviderServicer):
 
     @_log_errors
     def ReadDataSource(self, request: pb.ReadDataSource.Request, context: grpc.ServicerContext):
-        config = read_dynamic_value(request.config)
+        return _run_steps(self._read_data_source(request))
 
+    def _read_data_source(self, request: pb.ReadDataSource.Request) -> _Steps[pb.ReadDataSource.Response]:
         klass = self._get_ds_cls(request.type_name)
-        inst = self.app.new_data_source(klass)
+        if not shares_reads(klass):
+            return (yield from self._read_data_source_once(request, klass))
+
+        # TF encodes the same configuration to the same bytes, object attributes are sorted
+        key = (request.type_name, request.config.msgpack, request.config.json)
+        future, leader = self._data_source_reads.claim(key)
+        if not leader:
+            return (yield future)
+
+        try:
+            resp = yield from self._read_data_source_once(request, klass)
+        except BaseException as exc:
+            # Also when the RPC is cancelled, so the reads waiting on this one don't hang
+            shared = exc if isinstance(exc, Exception) else RuntimeError(f"Read of {request.type_name} was cancelled")
+            self._data_source_reads.fail(key, shared)
+            raise
+
+        # Errors may well be transient, so they're only shared with reads that were already waiting
+        failed = any(d.severity == pb.Diagnostic.ERROR for d in resp.diagnostics)
+        self._data_source_reads.resolve(key, resp, None if failed else klass.read_cache_ttl)
+        return resp
+
+    def _read_data_source_once(
+        self, request: pb.ReadDataSource.Request, klass: Type[DataSource]
+    ) -> _Steps[pb.ReadDataSource.Response]:
+        config = read_dynamic_value(request.config)
+        inst = self._instances.get(klass, self.app.new_data_source)
         diags = Diagnostics()
 
-        state = inst.read(ReadDataContext(diags, request.type_name), config)
+        state = yield functools.partial(inst.read, ReadDataContext(diags, request.type_name), config)
 
         return pb.ReadDataSource.Response(
             diagnostics=diags.to_pb(),
@@ -554,42 +771,65 @@ class ProviderServicer(rpc.ProviderServicer):
 
     @_log_errors
     def CallFunction(self, request: pb.CallFunction.Request, context: grpc.ServicerContext):
-        diags = Diagnostics()
-
         try:
-            func_cls = self._get_func_cls(request.name)
+            plan = self._get_func_plan(request.name)
         except KeyError:
             return pb.CallFunction.Response(error=pb.FunctionError(text=f"Function '{request.name}' not found"))
 
-        func_inst = self.app.new_function(func_cls)
-        signature = func_cls.get_signature()
-
-        # Decode arguments
-        decoded_args = []
-        for i, arg in enumerate(request.arguments):
-            arg_value = read_dynamic_value(arg)
-            if i < len(signature.parameters):
-                param = signature.parameters[i]
-                decoded_args.append(param.type.decode(arg_value))
-            elif signature.variadic_parameter:
-                decoded_args.append(signature.variadic_parameter.type.decode(arg_value))
-            else:
-                return pb.CallFunction.Response(
-                    error=pb.FunctionError(
-                        text=f"Too many arguments for function '{request.name}'", function_argument=i
-                    )
+        if not plan.pure:
+            return self._call_function(request, plan)
+
+        memo = self._function_memos.get(request.name) or self._function_memos.setdefault(
+            request.name, LruCache(plan.klass.memo_size)
+        )
+        # TF encodes equal arguments to the same bytes
+        key = tuple((arg.msgpack, arg.json) for arg in request.arguments)
+        resp = memo.get(key)
+        if resp is None:
+            resp = self._call_function(request, plan)
+            # Errors are reported again, in case they came from something other than the arguments
+            if not resp.HasField("error"):
+                memo.put(key, resp)
+
+        return resp
+
+    def function_memo_stats(self) -> dict[str, tuple[int, int]]:
+        """(hits, misses) of the remembered results of each :attr:`~tf.function.Function.pure` function called so far"""
+        return {name: (memo.hits, memo.misses) for name, memo in self._function_memos.items()}
+
+    def _call_function(self, request: pb.CallFunction.Request, plan: CallPlan) -> pb.CallFunction.Response:
+        if len(request.arguments) > plan.arity and not plan.variadic:
+            return pb.CallFunction.Response(
+                error=pb.FunctionError(
+                    text=f"Too many arguments for function '{request.name}'", function_argument=plan.arity
                 )
+            )
 
-        # Check for missing required arguments
-        if len(decoded_args) < len(signature.parameters):
+        if len(request.arguments) < plan.arity:
             return pb.CallFunction.Response(
                 error=pb.FunctionError(text=f"Missing required arguments for function '{request.name}'")
             )
 
+        diags = Diagnostics()
+        func_inst = self._instances.get(plan.klass, self.app.new_function)
+        decoded_args = plan.decode_arguments(request.arguments)
+
         # Call the function
         ctx = CallContext(diags, request.name)
+        timer = current_rpc()
         try:
-            result = func_inst.call(ctx, decoded_args)
+            timer.call_started(func_inst.call_batch if plan.batched else func_inst.call)
+            try:
+                if plan.batched:
+                    batcher = self._call_batchers.get(request.name) or self._call_batchers.setdefault(
+                        request.name, Batcher(plan.klass.call_batch_window, plan.klass.call_batch_size)
+                    )
+                    run = functools.partial(_call_batch, func_inst, request.name)
+                    result = batcher.join(run, (ctx, decoded_args)).result()
+                else:
+                    result = func_inst.call(ctx, decoded_args)
+            finally:
+                timer.call_finished()
 
             # Check for diagnostics that would be errors
             if diags.has_errors():
@@ -598,9 +838,7 @@ class ProviderServicer(rpc.ProviderServicer):
                     error=pb.FunctionError(text=errors[0].summary if errors else "Function call failed")
                 )
 
-            # Encode the result
-            encoded_result = signature.return_type.type.encode(result)
-            return pb.CallFunction.Response(result=to_dynamic_value(encoded_result))
+            return pb.CallFunction.Response(result=plan.encode_result(result))
         except Exception as e:
             return pb.CallFunction.Response(error=pb.FunctionError(text=f"Function execution error: {str(e)}"))
 
@@ -612,5 +850,53 @@ class ProviderServicer(rpc.ProviderServicer):
         return pb.StopProvider.Response()
 
 
-class EncodeError(Exception):
-    pass
+class AsyncProviderServicer(ProviderServicer):
+    """
+    ProviderServicer for a ``grpc.aio`` server.
+
+    RPCs that call into resources and data sources run on the event loop. Element methods defined with
+    ``async def`` (see :class:`~tf.iface.AsyncResource`) are awaited there, so a slow cloud API call does
+    not hold a thread. Plain methods are run in a worker thread. Every other RPC is served from the
+    server's migration thread pool, exactly like :class:`ProviderServicer`.
+
+    Instances are looked up on the event loop, but plain methods run in whichever worker thread is free,
+    so there is no thread to keep an instance to: ``Lifecycle.PerThread`` elements get a new instance for every call.
+    """
+
+    def __init__(self, app: Provider):
+        super().__init__(app)
+        self._instances = _InstancePool(app, per_thread=False)
+
+    @_log_errors
+    async def ValidateResourceConfig(self, request: pb.ValidateResourceConfig.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._validate_resource_config(request))
+
+    @_log_errors
+    async def ValidateDataResourceConfig(
+        self, request: pb.ValidateDataResourceConfig.Request, context: grpc.ServicerContext
+    ):
+        return await _run_steps_async(self._validate_data_resource_config(request))
+
+    @_log_errors
+    async def UpgradeResourceState(self, request: pb.UpgradeResourceState.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._upgrade_resource_state(request))
+
+    @_log_errors
+    async def ReadResource(self, request: pb.ReadResource.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._read_resource(request))
+
+    @_log_errors
+    async def PlanResourceChange(self, request: pb.PlanResourceChange.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._plan_resource_change(request))
+
+    @_log_errors
+    async def ApplyResourceChange(self, request: pb.ApplyResourceChange.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._apply_resource_change(request))
+
+    @_log_errors
+    async def ImportResourceState(self, request: pb.ImportResourceState.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._import_resource_state(request))
+
+    @_log_errors
+    async def ReadDataSource(self, request: pb.ReadDataSource.Request, context: grpc.ServicerContext):
+        return await _run_steps_async(self._read_data_source(request))
@@ -1,19 +1,22 @@
 import base64
 import hashlib
+import inspect
 import json
 import os
 import shutil
 import sys
 import tempfile
+import threading
 import zipfile
-from concurrent import futures
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Optional, Tuple
+from typing import Any, Callable, Mapping, Optional, Sequence, Tuple
 
 # Defer expensive imports - these will be imported when needed
 # grpc: ~22.5ms, cryptography: ~20ms, protobuf: ~9-21ms
 from tf.iface import Provider
+from tf.pool import WorkerPool
 
 
 class _LoggingInterceptor:
@@ -39,29 +42,388 @@ class _ShutdownInterceptor:
     """gRPC interceptor for handling shutdown"""
 
     def __init__(self):
-        self.stopped = False
-        self.server = None  # Will be set when we create the server
+        self._stopped = threading.Event()
+        self.on_stop: Optional[Callable[[], None]] = None  # For an event loop, which can't block on wait()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def stop(self):
+        """Wake up the main thread, which stops the server"""
+        self._stopped.set()
+        if self.on_stop:
+            self.on_stop()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until TF asks the provider to stop"""
+        return self._stopped.wait(timeout)
 
     def intercept_service(self, continuation, handler_call_details):
-        # Let the call complete first
         result = continuation(handler_call_details)
 
-        # Then handle shutdown after response is sent
+        # The server is stopped with a grace period, so the response still goes out
         if handler_call_details.method in ["/tfplugin6.Provider/StopProvider", "/plugin.GRPCController/Shutdown"]:
-            self.stopped = True
-            if self.server:
-                # Stop the server immediately after sending response
-                self.server.stop(grace=0)
+            self.stop()
 
         return result
 
 
-def run_provider(provider: Provider, argv: Optional[list[str]] = None):
+class _CachedSchemaInterceptor:
+    """gRPC interceptor that serves GetProviderSchema straight from the servicer's serialized response"""
+
+    def __init__(self, servicer):
+        self.servicer = servicer
+
+    def intercept_service(self, continuation, handler_call_details):
+        if handler_call_details.method != "/tfplugin6.Provider/GetProviderSchema":
+            return continuation(handler_call_details)
+
+        import grpc
+
+        # No (de)serializers: the request is ignored and the response is already bytes
+        return grpc.unary_unary_rpc_method_handler(lambda request, context: self.servicer.get_provider_schema_bytes())
+
+
+class _ConcurrencyLimitInterceptor:
+    """gRPC interceptor that caps how many calls of a method are served at once. Calls over the limit wait their turn."""
+
+    def __init__(self, limits: Mapping[str, int]):
+        self.limits = dict(limits)
+        self._semaphores: dict[str, Any] = {}
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        limit = self.limits.get(handler_call_details.method.rsplit("/", 1)[-1])
+        if limit is None or handler is None or handler.unary_unary is None:
+            return handler
+
+        behavior = handler.unary_unary
+        semaphore = self._semaphores.get(handler_call_details.method)
+
+        if inspect.iscoroutinefunction(behavior):
+            # Served on the event loop by grpc.aio
+            import asyncio
+
+            if semaphore is None:
+                semaphore = self._semaphores.setdefault(handler_call_details.method, asyncio.Semaphore(limit))
+
+            async def limited_async(request, context):
+                async with semaphore:
+                    return await behavior(request, context)
+
+            return handler._replace(unary_unary=limited_async)
+
+        if semaphore is None:
+            semaphore = self._semaphores.setdefault(handler_call_details.method, threading.Semaphore(limit))
+
+        def limited(request, context):
+            with semaphore:
+                return behavior(request, context)
+
+        return handler._replace(unary_unary=limited)
+
+
+class _RecordingInterceptor:
+    """gRPC interceptor that records every RPC with a :class:`~tf.metrics.Metrics` or :class:`~tf.tracing.Tracer`"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+
+        behavior = handler.unary_unary
+        method = handler_call_details.method.rsplit("/", 1)[-1]
+        recorder = self.recorder
+
+        if inspect.iscoroutinefunction(behavior):
+
+            async def recorded_async(request, context):
+                token, response = recorder.start(method, request), None
+                try:
+                    response = await behavior(request, context)
+                    return response
+                finally:
+                    recorder.finish(token, method, request, response)
+
+            return handler._replace(unary_unary=recorded_async)
+
+        def recorded(request, context):
+            token, response = recorder.start(method, request), None
+            try:
+                response = behavior(request, context)
+                return response
+            finally:
+                recorder.finish(token, method, request, response)
+
+        return handler._replace(unary_unary=recorded)
+
+
+@dataclass(frozen=True)
+class _ServerLimits:
+    """How much work the gRPC server takes on at once, see :func:`run_provider`"""
+
+    max_workers: int = 10
+    max_concurrent_rpcs: Optional[int] = None
+    method_concurrency: Mapping[str, int] = field(default_factory=dict)
+    adaptive_max_workers: Optional[int] = None
+
+    @classmethod
+    def resolve(
+        cls,
+        max_workers: Optional[int] = None,
+        max_concurrent_rpcs: Optional[int] = None,
+        method_concurrency: Optional[Mapping[str, int]] = None,
+        adaptive_max_workers: Optional[int] = None,
+    ) -> "_ServerLimits":
+        """Arguments take precedence over environment variables, which take precedence over the defaults"""
+        env_method_concurrency = os.environ.get("TF_PLUGIN_METHOD_CONCURRENCY")
+
+        return cls(
+            max_workers=_first(max_workers, _env_int("TF_PLUGIN_MAX_WORKERS"), cls.max_workers),
+            max_concurrent_rpcs=_first(max_concurrent_rpcs, _env_int("TF_PLUGIN_MAX_CONCURRENT_RPCS")),
+            method_concurrency=_first(
+                method_concurrency,
+                _parse_method_concurrency(env_method_concurrency) if env_method_concurrency else None,
+                {},
+            ),
+            adaptive_max_workers=_first(adaptive_max_workers, _env_int("TF_PLUGIN_ADAPTIVE_MAX_WORKERS")),
+        )
+
+    def new_pool(self) -> WorkerPool:
+        return WorkerPool(self.max_workers, max_workers_limit=self.adaptive_max_workers)
+
+    def interceptors(self, servicer, stopper: _ShutdownInterceptor, recorders: Sequence = ()) -> list:
+        interceptors = [_LoggingInterceptor(), stopper, _CachedSchemaInterceptor(servicer)]
+        if self.method_concurrency:
+            interceptors.append(_ConcurrencyLimitInterceptor(self.method_concurrency))
+
+        # First, so their wrappers are the outermost: time spent waiting for a concurrency slot is part of the RPC
+        return [_RecordingInterceptor(recorder) for recorder in recorders] + interceptors
+
+
+def _first(*values):
+    return next((v for v in values if v is not None), None)
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    if not value:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+
+
+def _parse_method_concurrency(spec: str) -> dict[str, int]:
+    """Parse ``ReadResource=4,ApplyResourceChange=8``"""
+    limits = {}
+    for item in spec.split(","):
+        name, sep, limit = item.strip().partition("=")
+        if not sep or not name or not limit.strip().isdigit():
+            raise ValueError(f"TF_PLUGIN_METHOD_CONCURRENCY must look like 'ReadResource=4,...', got {spec!r}")
+
+        limits[name.strip()] = int(limit)
+
+    return limits
+
+
+def _report_pool(pool: WorkerPool):
+    if os.environ.get("TF_PLUGIN_DEBUG") == "1":
+        print(f"[DEBUG] Worker pool: {pool.metrics()}", file=sys.stderr)
+
+
+def _recorder_path(name: str) -> Optional[Path]:
+    """Path given in the environment variable, every child of a daemon gets its own"""
+    path = os.environ.get(name)
+    return Path(path.replace("{pid}", str(os.getpid()))) if path else None
+
+
+def _new_recorders(provider: Provider) -> list:
+    """What to record RPCs with: a :class:`~tf.metrics.Metrics` and a :class:`~tf.tracing.Tracer`, if asked for"""
+    recorders: list = []
+    if metrics_path := _recorder_path("TF_PLUGIN_METRICS"):
+        from tf.metrics import Metrics
+
+        recorders.append(Metrics(metrics_path))
+
+    # After the metrics, which hand the tracer each RPC's timer to pass calls on to
+    if trace_path := _recorder_path("TF_PLUGIN_TRACE"):
+        from tf.tracing import Tracer
+
+        recorders.append(Tracer(trace_path, provider.full_name()))
+
+    return recorders
+
+
+def _start_profiler() -> list:
+    """A started :class:`~tf.profiling.Profiler`, if asked for. It samples threads rather than recording RPCs."""
+    profile_path = _recorder_path("TF_PLUGIN_PROFILE")
+    if not profile_path:
+        return []
+
+    from tf.profiling import Profiler
+
+    profiler = Profiler(profile_path)
+    profiler.start()
+    return [profiler]
+
+
+def _report_recorders(recorders: list):
+    for recorder in recorders:
+        try:
+            recorder.close()
+        except OSError as e:
+            print(f"[ERROR] Could not write {recorder.path}: {e}", file=sys.stderr)
+
+
+def _aio_interceptors(interceptors: list) -> list:
+    """Adapt the interceptors above to grpc.aio, which only accepts grpc.aio.ServerInterceptor instances"""
+    import grpc.aio
+
+    class _AioInterceptor(grpc.aio.ServerInterceptor):
+        def __init__(self, interceptor):
+            self.interceptor = interceptor
+
+        async def intercept_service(self, continuation, handler_call_details):
+            handler = await continuation(handler_call_details)
+            return self.interceptor.intercept_service(lambda details: handler, handler_call_details)
+
+    return [_AioInterceptor(i) for i in interceptors]
+
+
+def _add_services(server, servicer, stopper: _ShutdownInterceptor):
+    """Add the Provider service and the services go-plugin expects to the server"""
+    from tf.gen import grpc_controller_pb2 as controller_pb
+    from tf.gen import grpc_controller_pb2_grpc as controller_rpc
+    from tf.gen import grpc_stdio_pb2_grpc as stdio_rpc
+    from tf.gen import tfplugin_pb2_grpc as rpc
+
+    # Add the Provider service
+    rpc.add_ProviderServicer_to_server(servicer, server)
+
+    # Add the GRPCController service required by go-plugin
+    class GRPCControllerServicer(controller_rpc.GRPCControllerServicer):
+        def Shutdown(self, request, context):
+            # The interceptor also sees this call, but there's no harm in stopping twice
+            stopper.stop()
+            return controller_pb.Empty()
+
+    controller_rpc.add_GRPCControllerServicer_to_server(GRPCControllerServicer(), server)
+
+    # Add the GRPCStdio service to eliminate "Method not found!" errors
+    class GRPCStdioServicer(stdio_rpc.GRPCStdioServicer):
+        def StreamStdio(self, request, context):
+            # Return an empty generator - we don't actually stream stdio
+            # This just satisfies the go-plugin framework's expectations
+            return iter([])
+
+    stdio_rpc.add_GRPCStdioServicer_to_server(GRPCStdioServicer(), server)
+
+
+def _add_port(server, provider: Provider, sock_file: str, argv: list[str], debug_timing: bool) -> Optional[bytes]:
+    """
+    Listen on the unix socket.
+
+    Returns the certificate chain to hand to TF, or None in dev mode, where the socket is insecure
+    and TF is told to reattach to the provider instead.
+    """
+    import time
+
+    tx = f"unix://{sock_file}"
+
+    if "--dev" in argv:
+        print("Running in dev mode\n")
+        server.add_insecure_port(tx)
+        conf = json.dumps(
+            {
+                provider.full_name(): {
+                    "Protocol": "grpc",
+                    "ProtocolVersion": 6,
+                    "Pid": os.getpid(),
+                    "Test": True,
+                    "Addr": {
+                        "Network": "unix",
+                        "String": sock_file,
+                    },
+                },
+            }
+        )
+        print(f"\texport TF_REATTACH_PROVIDERS='{conf}'")
+        return None
+
+    ssl_start = time.time() if debug_timing else 0.0
+
+    server_chain, server_ssl_config = _self_signed_cert()
+
+    if debug_timing:
+        ssl_time = time.time() - ssl_start
+        print(f"[TIMING] SSL cert time: {ssl_time*1000:.2f}ms", file=sys.stderr)
+
+    server.add_secure_port(tx, server_ssl_config)
+    return server_chain
+
+
+def _print_handshake(sock_file: str, server_chain: bytes):
+    """Tell go-plugin where to connect"""
+    print(
+        "|".join(
+            [
+                str(1),  # protocol version
+                str(6),  # tf protocol version
+                "unix",  # "tcp",
+                sock_file,  # picked_addr,
+                "grpc",
+                base64.b64encode(server_chain).decode().rstrip("="),
+            ]
+        )
+        + "\n",
+        flush=True,
+    )
+
+
+def run_provider(
+    provider: Provider,
+    argv: Optional[list[str]] = None,
+    *,
+    aio: bool = False,
+    max_workers: Optional[int] = None,
+    max_concurrent_rpcs: Optional[int] = None,
+    method_concurrency: Optional[Mapping[str, int]] = None,
+    adaptive_max_workers: Optional[int] = None,
+):
     """
     Run the given provider with the given arguments.
+    With ``--daemon``, serve TF runs started by :func:`tf.daemon.launch` instead.
+
+    The server's limits can also be set with environment variables, which the arguments take precedence over:
+    ``TF_PLUGIN_MAX_WORKERS``, ``TF_PLUGIN_MAX_CONCURRENT_RPCS``, ``TF_PLUGIN_ADAPTIVE_MAX_WORKERS``,
+    and ``TF_PLUGIN_METHOD_CONCURRENCY`` (e.g. ``ReadResource=4,ApplyResourceChange=8``).
+
+    Set ``TF_PLUGIN_METRICS`` to a path to record latency and payload size histograms of every RPC (see
+    :mod:`tf.metrics`), written there when the provider stops: as JSON if the path ends in ``.json``,
+    in the Prometheus text format otherwise. Set ``TF_PLUGIN_TRACE`` to a path to append tracing spans of every RPC
+    to it as OTLP JSON (see :mod:`tf.tracing`). Set ``TF_PLUGIN_PROFILE`` to a path to sample the stacks of every
+    thread while serving, and write them there per RPC method when the provider stops (see :mod:`tf.profiling`).
+    ``{pid}`` in any of these paths is replaced with the process ID.
 
     :param provider: Provider instance to run
     :param argv: Optional arguments to run the provider with
+    :param aio: Serve with ``grpc.aio`` on an event loop instead of a fixed pool of threads.
+        Use this with :class:`~tf.iface.AsyncResource` and :class:`~tf.iface.AsyncDataSource`
+        so that many operations (e.g. ``terraform apply -parallelism=200``) can be in flight at once.
+    :param max_workers: Number of threads serving RPCs (10 by default).
+        With ``aio``, these only serve RPCs that don't call into resources or data sources.
+    :param max_concurrent_rpcs: RPCs beyond this many in flight are rejected with ``RESOURCE_EXHAUSTED``.
+        Unlimited by default.
+    :param method_concurrency: Most calls of each method, by name (e.g. ``"ApplyResourceChange"``), to serve at once.
+        Further calls wait for one to finish. Use this to protect a rate-limited API.
+    :param adaptive_max_workers: Let the pool grow, up to this many threads, while RPCs are waiting for a thread.
     """
     import time
 
@@ -71,120 +433,149 @@ def run_provider(provider: Provider, argv: Optional[list[str]] = None):
     # Lazy load expensive imports
     import_start = time.time() if debug_timing else 0.0
 
-    import grpc
+    import grpc  # noqa: F401 Imported here to be timed
 
-    from tf.gen import grpc_controller_pb2 as controller_pb
-    from tf.gen import grpc_controller_pb2_grpc as controller_rpc
-    from tf.gen import grpc_stdio_pb2_grpc as stdio_rpc
-    from tf.gen import tfplugin_pb2_grpc as rpc
-    from tf.provider import ProviderServicer
+    from tf.provider import AsyncProviderServicer, ProviderServicer
 
     if debug_timing:
         import_time = time.time() - import_start
         print(f"[TIMING] Import time: {import_time*1000:.2f}ms", file=sys.stderr)
 
     argv = argv or sys.argv
+    limits = _ServerLimits.resolve(max_workers, max_concurrent_rpcs, method_concurrency, adaptive_max_workers)
+
+    if "--daemon" in argv:
+        from tf.daemon import serve_daemon
+
+        serve_daemon(provider, argv, limits, aio=aio)
+        return
+
+    servicer = AsyncProviderServicer(provider) if aio else ProviderServicer(provider)
+    _run_servicer(servicer, argv, limits, aio, start_time, debug_timing)
+
+
+def _run_servicer(servicer, argv: list[str], limits: _ServerLimits, aio: bool, start_time: float, debug_timing: bool):
+    """Serve the servicer's provider until TF stops it"""
+    import grpc
+
+    pool = limits.new_pool()
+    recorders = _new_recorders(servicer.app)
+    profilers = _start_profiler()
+
+    if aio:
+        import asyncio
+
+        try:
+            asyncio.run(_serve_aio(servicer, argv, limits, pool, start_time, debug_timing, recorders))
+        except KeyboardInterrupt:
+            # The server was stopped gracefully when the event loop cancelled it
+            pass
+        finally:
+            _report_pool(pool)
+            _report_recorders(recorders + profilers)
+        return
 
-    servicer = ProviderServicer(provider)
     stopper = _ShutdownInterceptor()
     server = grpc.server(
-        thread_pool=futures.ThreadPoolExecutor(max_workers=10),
-        interceptors=[_LoggingInterceptor(), stopper],
+        thread_pool=pool,
+        interceptors=limits.interceptors(servicer, stopper, recorders),
+        maximum_concurrent_rpcs=limits.max_concurrent_rpcs,
     )
 
-    # Give the interceptor a reference to the server so it can stop it
-    stopper.server = server
-
-    # Add the Provider service
-    rpc.add_ProviderServicer_to_server(servicer, server)
-
-    # Add the GRPCController service required by go-plugin
-    class GRPCControllerServicer(controller_rpc.GRPCControllerServicer):
-        def Shutdown(self, request, context):
-            # Mark as stopped - the interceptor will handle the actual shutdown
-            stopper.stopped = True
-            return controller_pb.Empty()
+    _add_services(server, servicer, stopper)
 
-    controller_rpc.add_GRPCControllerServicer_to_server(GRPCControllerServicer(), server)
+    try:
+        _serve(server, servicer.app, argv, stopper, start_time, debug_timing)
+    finally:
+        _report_pool(pool)
+        _report_recorders(recorders + profilers)
 
-    # Add the GRPCStdio service to eliminate "Method not found!" errors
-    class GRPCStdioServicer(stdio_rpc.GRPCStdioServicer):
-        def StreamStdio(self, request, context):
-            # Return an empty generator - we don't actually stream stdio
-            # This just satisfies the go-plugin framework's expectations
-            return iter([])
 
-    stdio_rpc.add_GRPCStdioServicer_to_server(GRPCStdioServicer(), server)
+def _serve(
+    server, provider: Provider, argv: list[str], stopper: _ShutdownInterceptor, start_time: float, debug_timing: bool
+):
+    """Serve with the threaded server until TF stops the provider"""
+    import time
 
     with tempfile.TemporaryDirectory() as tmp:
         sock_file = f"{tmp}/py-tf-plugin.sock" if "--stable" not in argv else "/tmp/py-tf-plugin.sock"
-        tx = f"unix://{sock_file}"
 
-        if "--dev" in argv:
-            print("Running in dev mode\n")
-            server.add_insecure_port(tx)
-            conf = json.dumps(
-                {
-                    provider.full_name(): {
-                        "Protocol": "grpc",
-                        "ProtocolVersion": 6,
-                        "Pid": os.getpid(),
-                        "Test": True,
-                        "Addr": {
-                            "Network": "unix",
-                            "String": sock_file,
-                        },
-                    },
-                }
-            )
-            print(f"\texport TF_REATTACH_PROVIDERS='{conf}'")
+        try:
+            server_chain = _add_port(server, provider, sock_file, argv, debug_timing)
 
             server.start()
-            server.wait_for_termination()
-            return
 
-        ssl_start = time.time() if debug_timing else 0.0
+            if server_chain is not None:
+                if debug_timing:
+                    total_time = time.time() - start_time
+                    print(f"[TIMING] Total startup time: {total_time*1000:.2f}ms", file=sys.stderr)
 
-        server_chain, server_ssl_config = _self_signed_cert()
+                _print_handshake(sock_file, server_chain)
 
-        if debug_timing:
-            ssl_time = time.time() - ssl_start
-            print(f"[TIMING] SSL cert time: {ssl_time*1000:.2f}ms", file=sys.stderr)
+            # Block (without waking up) until StopProvider or GRPCController.Shutdown.
+            # wait_for_termination would poll, and stopping the server from inside an RPC doesn't interrupt it anyway.
+            stopper.wait()
+        except KeyboardInterrupt:
+            # Handle graceful shutdown on Ctrl+C, which TF may send before the handshake is even out
+            pass
 
-        server.add_secure_port(tx, server_ssl_config)
+        # Lets the StopProvider response (and anything else in flight) go out
+        server.stop(grace=0.5).wait()
+
+
+async def _serve_aio(
+    servicer,
+    argv: list[str],
+    limits: _ServerLimits,
+    pool: WorkerPool,
+    start_time: float,
+    debug_timing: bool,
+    recorders: Sequence = (),
+):
+    """The asyncio flavor of :func:`_serve`"""
+    import asyncio
+    import time
 
-        server.start()
+    import grpc.aio
 
-        if debug_timing:
-            total_time = time.time() - start_time
-            print(f"[TIMING] Total startup time: {total_time*1000:.2f}ms", file=sys.stderr)
+    provider = servicer.app
+    stopper = _ShutdownInterceptor()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # GRPCController.Shutdown is served from the thread pool
+    stopper.on_stop = lambda: loop.call_soon_threadsafe(stopped.set)
+
+    server = grpc.aio.server(
+        # Only RPCs that don't call into elements (schemas, provider config, functions) run in this pool
+        migration_thread_pool=pool,
+        interceptors=_aio_interceptors(limits.interceptors(servicer, stopper, recorders)),
+        maximum_concurrent_rpcs=limits.max_concurrent_rpcs,
+    )
 
-        print(
-            "|".join(
-                [
-                    str(1),  # protocol version
-                    str(6),  # tf protocol version
-                    "unix",  # "tcp",
-                    sock_file,  # picked_addr,
-                    "grpc",
-                    base64.b64encode(server_chain).decode().rstrip("="),
-                ]
-            )
-            + "\n",
-            flush=True,
-        )
+    _add_services(server, servicer, stopper)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sock_file = f"{tmp}/py-tf-plugin.sock" if "--stable" not in argv else "/tmp/py-tf-plugin.sock"
+        server_chain = _add_port(server, provider, sock_file, argv, debug_timing)
+
+        await server.start()
+
+        if server_chain is not None:
+            if debug_timing:
+                total_time = time.time() - start_time
+                print(f"[TIMING] Total startup time: {total_time*1000:.2f}ms", file=sys.stderr)
+
+            _print_handshake(sock_file, server_chain)
 
-        # This stops an ugly 2s timeout
-        # as .stop() does not actually interrupt wait_for_termination
-        # There about quite a few termination calls, so longer timeouts
-        # quickly add up to the client
         try:
-            while server.wait_for_termination(0.05):
-                if stopper.stopped:
-                    break
-        except KeyboardInterrupt:
-            # Handle graceful shutdown on Ctrl+C
-            server.stop(grace=0.5)
+            await stopped.wait()
+        finally:
+            # Lets the StopProvider response (and anything else in flight) go out
+            await server.stop(grace=0.5)
+
+
+_CERT_LIFETIME = timedelta(days=7)
+_CERT_RENEW_BEFORE = timedelta(days=1)
 
 
 def _get_cert_cache_path() -> Path:
@@ -196,41 +587,53 @@ def _get_cert_cache_path() -> Path:
 
 def _self_signed_cert() -> Tuple[bytes, Any]:
     """Generate or load cached keypair and cert, return a server credentials object"""
-    # Lazy load expensive cryptography imports
+    import grpc
+
+    cert_chain, private_key_pem, cert_pem = _load_or_create_cert()
+
+    return cert_chain, grpc.ssl_server_credentials(
+        private_key_certificate_chain_pairs=[
+            (
+                private_key_pem,
+                cert_pem,
+            )
+        ],
+        # root_certificates=client_public_pem,
+        require_client_auth=False,
+    )
+
+
+def _load_or_create_cert() -> Tuple[bytes, bytes, bytes]:
+    """
+    Generate or load cached keypair and cert, returning the DER cert chain, and the PEM key and cert.
+    This doesn't touch grpc, so it's safe to call in a process that will fork.
+    """
     from datetime import timezone
 
-    import grpc
+    cache_path = _get_cert_cache_path()
+    now = datetime.now(timezone.utc)
+
+    # Try to load from cache first. Expiry is stored next to the cert, so this doesn't need cryptography.
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+
+        # Renew a day early, so a long TF run doesn't outlive the cert
+        if datetime.fromisoformat(cached["not_valid_after"]) > now + _CERT_RENEW_BEFORE:
+            return base64.b64decode(cached["cert_chain"]), cached["key_pem"].encode(), cached["cert_pem"].encode()
+    except (OSError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+        # Missing, corrupted, or written by an older version: regenerate
+        pass
+
+    # Lazy load expensive cryptography imports
     from cryptography import x509
     from cryptography.hazmat.primitives import hashes, serialization
-    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.asymmetric import ec
 
-    cache_path = _get_cert_cache_path()
+    from tf.utils import _write_atomic
 
-    # Try to load from cache first
-    if cache_path.exists():
-        try:
-            with open(cache_path, "r") as f:
-                cached = json.load(f)
-
-            # Check if certificate is still valid
-            cert_pem = cached["cert_pem"].encode()
-            cert = x509.load_pem_x509_certificate(cert_pem)
-
-            if cert.not_valid_after_utc > datetime.now(timezone.utc):
-                # Certificate is still valid, use cached version
-                private_key_pem = cached["key_pem"].encode()
-                cert_chain = base64.b64decode(cached["cert_chain"])
-
-                return cert_chain, grpc.ssl_server_credentials(
-                    private_key_certificate_chain_pairs=[(private_key_pem, cert_pem)],
-                    require_client_auth=False,
-                )
-        except (json.JSONDecodeError, KeyError, ValueError):
-            # Cache is corrupted, regenerate
-            pass
-
-    # Generate new certificate
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+    # P-256 keys are much faster to generate than RSA keys, and make for a smaller handshake
+    private_key = ec.generate_private_key(ec.SECP256R1())
     private_key_pem = private_key.private_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PrivateFormat.PKCS8,
@@ -238,7 +641,7 @@ def _self_signed_cert() -> Tuple[bytes, Any]:
     )
 
     name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, "localhost")])
-    now = datetime.now(timezone.utc)
+    not_valid_after = now + _CERT_LIFETIME
 
     # With subject alternative names
     certificate = (
@@ -248,7 +651,7 @@ def _self_signed_cert() -> Tuple[bytes, Any]:
         .public_key(private_key.public_key())
         .serial_number(x509.random_serial_number())
         .not_valid_before(now - timedelta(seconds=1))
-        .not_valid_after(now + timedelta(days=7))  # Valid for 7 days instead of 1
+        .not_valid_after(not_valid_after)
         .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
         .add_extension(
             x509.SubjectAlternativeName([x509.DNSName("localhost")]),
@@ -258,7 +661,7 @@ def _self_signed_cert() -> Tuple[bytes, Any]:
             x509.KeyUsage(
                 digital_signature=True,
                 content_commitment=False,
-                key_encipherment=True,
+                key_encipherment=False,
                 data_encipherment=False,
                 key_agreement=True,
                 key_cert_sign=True,
@@ -283,32 +686,23 @@ def _self_signed_cert() -> Tuple[bytes, Any]:
     cert_chain = certificate.public_bytes(serialization.Encoding.DER)
     cert_pem = certificate.public_bytes(serialization.Encoding.PEM)
 
-    # Cache the certificate
-    try:
-        with open(os.open(cache_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w") as f:
-            json.dump(
-                {
-                    "key_pem": private_key_pem.decode(),
-                    "cert_pem": cert_pem.decode(),
-                    "cert_chain": base64.b64encode(cert_chain).decode(),
-                },
-                f,
-            )
-    except IOError:
-        # Failed to cache, but continue anyway
-        pass
-
-    return cert_chain, grpc.ssl_server_credentials(
-        private_key_certificate_chain_pairs=[
-            (
-                private_key_pem,
-                cert_pem,
-            )
-        ],
-        # root_certificates=client_public_pem,
-        require_client_auth=False,
+    # Cache the certificate. Providers often start in parallel: readers only ever see a whole file,
+    # and if two processes both generate a cert, each serves its own and the last one written is kept.
+    # The temporary file is only readable by us.
+    _write_atomic(
+        cache_path,
+        json.dumps(
+            {
+                "key_pem": private_key_pem.decode(),
+                "cert_pem": cert_pem.decode(),
+                "cert_chain": base64.b64encode(cert_chain).decode(),
+                "not_valid_after": not_valid_after.isoformat(),
+            }
+        ).encode(),
     )
 
+    return cert_chain, private_key_pem, cert_pem
+
 
 def install_provider(host: str, namespace: str, project: str, version: str, plugin_dir: Path, provider_script: Path):
     """
@@ -1,9 +1,13 @@
 from abc import abstractmethod
 from enum import Enum
-from typing import Any, Optional, cast
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Hashable, Optional, cast
 
-from tf.gen import tfplugin_pb2 as pb
-from tf.types import TfType, Unknown
+from tf.types import TfType, Unknown, _freeze
+
+if TYPE_CHECKING:  # pragma: no cover
+    from tf.codec import StateCodec
+    from tf.gen import tfplugin_pb2 as pb
 
 
 class TextFormat(Enum):
@@ -11,10 +15,10 @@ class TextFormat(Enum):
     Markdown = "markdown"
 
 
-_desc_format_map = {
-    TextFormat.Plain: pb.StringKind.PLAIN,
-    TextFormat.Markdown: pb.StringKind.MARKDOWN,
-}
+def _desc_format_pb(kind: TextFormat) -> "pb.StringKind.ValueType":
+    from tf.gen import tfplugin_pb2 as pb
+
+    return pb.StringKind.MARKDOWN if kind == TextFormat.Markdown else pb.StringKind.PLAIN
 
 
 class Attribute:
@@ -65,7 +69,9 @@ class Attribute:
         self.requires_replace = requires_replace
         self.default = default
 
-    def to_pb(self) -> pb.Schema.Attribute:
+    def to_pb(self) -> "pb.Schema.Attribute":
+        from tf.gen import tfplugin_pb2 as pb
+
         can_be_null = dict(
             description=self.description,
             required=self.required or None,
@@ -78,7 +84,7 @@ class Attribute:
         return pb.Schema.Attribute(
             name=self.name,
             type=self.type.tf_type(),
-            description_kind=_desc_format_map[self.description_kind or TextFormat.Markdown],
+            description_kind=_desc_format_pb(self.description_kind or TextFormat.Markdown),
             **can_be_null,  # pyre-ignore[6]: we can actually pass in Nones here for defaults
         )
 
@@ -122,7 +128,9 @@ class Schema:
         self.description_kind = description_kind
         self.deprecated = deprecated
 
-    def to_pb(self) -> pb.Schema:
+    def to_pb(self) -> "pb.Schema":
+        from tf.gen import tfplugin_pb2 as pb
+
         more = {"version": self.version} if self.version is not None else {}
 
         return pb.Schema(
@@ -152,13 +160,15 @@ class Block:
         self.description_kind = description_kind
         self.deprecated = deprecated
 
-    def to_pb(self) -> pb.Schema.Block:
+    def to_pb(self) -> "pb.Schema.Block":
+        from tf.gen import tfplugin_pb2 as pb
+
         more = {
             "block_types": [nb.to_pb() for nb in self.block_types] or None,
             "description": self.description,
-            "description_kind": _desc_format_map[self.description_kind]
+            "description_kind": _desc_format_pb(self.description_kind)
             if self.description_kind
-            else (_desc_format_map[TextFormat.Markdown] if self.description else None),
+            else (_desc_format_pb(TextFormat.Markdown) if self.description else None),
             "deprecated": self.deprecated,
         }
 
@@ -176,11 +186,6 @@ class NestMode(Enum):
 
 
 class NestedBlock:
-    _mode_map = {
-        NestMode.Set: pb.Schema.NestedBlock.NestingMode.SET,
-        NestMode.Single: pb.Schema.NestedBlock.NestingMode.SINGLE,
-    }
-
     def __init__(
         self,
         type_name: str,
@@ -195,15 +200,29 @@ class NestedBlock:
         self.max_items = max_items
         self.nesting_mode = nesting_mode
 
-    def to_pb(self) -> pb.Schema.NestedBlock:
+    def to_pb(self) -> "pb.Schema.NestedBlock":
+        from tf.gen import tfplugin_pb2 as pb
+
+        modes = {
+            NestMode.Set: pb.Schema.NestedBlock.NestingMode.SET,
+            NestMode.Single: pb.Schema.NestedBlock.NestingMode.SINGLE,
+        }
+
         return pb.Schema.NestedBlock(
             type_name=self.type_name,
             block=self.block.to_pb(),
             min_items=self.min_items,
             max_items=self.max_items,
-            nesting=self._mode_map[self.nesting_mode],
+            nesting=modes[self.nesting_mode],
         )
 
+    @cached_property
+    def codec(self) -> "StateCodec":
+        """The compiled codec for a single element of this block, built once and shared by every element"""
+        from tf.codec import StateCodec
+
+        return StateCodec(self.block.attributes, self.block.block_types)
+
     @abstractmethod
     def encode(self, value: Any) -> Any:
         """Encode the python representation into the tf-serializable"""
@@ -219,8 +238,9 @@ class NestedBlock:
         For Integers, ints will be passed in, and so on.
         """
 
-    def _amap(self) -> dict[str, Attribute]:
-        return {a.name: a for a in self.block.attributes}
-
-    def _bmap(self) -> dict[str, "NestedBlock"]:
-        return {b.type_name: b for b in self.block.block_types}
+    def canonical(self, value: Any) -> Hashable:
+        """
+        Return a hashable key for the Python-type value of this block.
+        Semantically equal values must have equal keys.
+        """
+        return _freeze(value)
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase, mock
+
+from tf.batch import Batcher, LruCache, SingleFlight
+
+
+def double(items: list[int]) -> list[int]:
+    return [item * 2 for item in items]
+
+
+class BatcherTest(TestCase):
+    def join_concurrently(self, batcher: Batcher, run, items: list[int]) -> list:
+        """Join from a thread per item, all at once, returning each item's result or exception"""
+        barrier = threading.Barrier(len(items))
+        results: list = [None] * len(items)
+
+        def join(i: int):
+            barrier.wait()
+            try:
+                results[i] = batcher.join(run, items[i]).result(5)
+            except Exception as exc:
+                results[i] = exc
+
+        threads = [threading.Thread(target=join, args=(i,)) for i in range(len(items))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_threads(self):
+        run = mock.Mock(side_effect=double)
+        batcher = Batcher(window=0.1, max_size=100)
+
+        self.assertEqual([0, 2, 4, 6, 8, 10], self.join_concurrently(batcher, run, list(range(6))))
+        run.assert_called_once()
+        self.assertCountEqual(list(range(6)), run.call_args.args[0])
+
+    def test_max_size(self):
+        run = mock.Mock(side_effect=double)
+        # A long window, full batches don't wait for it
+        batcher = Batcher(window=5, max_size=1)
+
+        self.assertEqual([0, 2, 4], self.join_concurrently(batcher, run, [0, 1, 2]))
+        self.assertEqual([[0], [1], [2]], sorted(call.args[0] for call in run.call_args_list))
+
+    def test_window(self):
+        batcher = Batcher(window=0.01, max_size=100)
+
+        self.assertEqual(2, batcher.join(double, 1).result(0))
+        self.assertEqual(4, batcher.join(double, 2).result(0))
+
+    def test_coroutine(self):
+        async def run(items):
+            return double(items)
+
+        batcher = Batcher(window=0, max_size=100)
+        self.assertEqual(6, batcher.join(run, 3).result(0))
+
+    def test_errors(self):
+        batcher = Batcher(window=0.05, max_size=100)
+
+        def fail(items):
+            raise ValueError("boom")
+
+        results = self.join_concurrently(batcher, fail, [1, 2])
+        self.assertEqual(["boom", "boom"], [str(r) for r in results])
+
+        with self.assertRaisesRegex(ValueError, "Batch of 1 returned 0 results"):
+            batcher.join(lambda items: [], 1).result(0)
+
+        with self.assertRaisesRegex(ValueError, "Batch of 1 returned 0 results"):
+            batcher.join(lambda items: None, 1).result(0)
+
+    def test_event_loop(self):
+        loop_thread = []
+
+        async def run(items):
+            loop_thread.append(threading.current_thread())
+            return double(items)
+
+        async def join_all(batcher: Batcher, run, items: list[int]) -> list:
+            # Joining doesn't block the loop
+            futures = [batcher.join(run, item) for item in items]
+            return await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+
+        batcher = Batcher(window=0.01, max_size=3)
+
+        self.assertEqual([0, 2, 4, 6, 8], asyncio.run(join_all(batcher, run, list(range(5)))))
+        self.assertEqual([threading.current_thread()] * 2, loop_thread)
+
+        def sync_run(items):
+            loop_thread.append(threading.current_thread())
+            return double(items)
+
+        # A sync run function might block, so it runs in a worker thread
+        self.assertEqual([2, 4], asyncio.run(join_all(batcher, sync_run, [1, 2])))
+        self.assertIsNot(threading.current_thread(), loop_thread[-1])
+
+        def fail(items):
+            raise ValueError("boom")
+
+        results = asyncio.run(join_all(batcher, fail, [1, 2]))
+        self.assertEqual(["boom", "boom"], [str(r) for r in results])
+
+    def test_full_batch_on_loop(self):
+        run = mock.Mock(side_effect=double)
+
+        async def join_full():
+            batcher = Batcher(window=0.01, max_size=2)
+            futures = [batcher.join(run, 1), batcher.join(run, 2)]
+            results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+            # Outlive the window, the timer finds the batch already running
+            await asyncio.sleep(0.02)
+            return results
+
+        self.assertEqual([2, 4], asyncio.run(join_full()))
+        run.assert_called_once_with([1, 2])
+
+
+class LruCacheTest(TestCase):
+    def test_lru(self):
+        cache = LruCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+
+        self.assertEqual(1, cache.get("a"))
+        # b is now the least recently used
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual("default", cache.get("b", "default"))
+        self.assertEqual(3, cache.get("c"))
+
+        cache.put("a", 4)
+        self.assertEqual(4, cache.get("a"))
+        self.assertEqual(2, len(cache))
+        self.assertEqual((3, 2), (cache.hits, cache.misses))
+
+
+class SingleFlightTest(TestCase):
+    def test_shared(self):
+        flights = SingleFlight()
+
+        future, leader = flights.claim("key")
+        self.assertTrue(leader)
+        waiting, leader = flights.claim("key")
+        self.assertFalse(leader)
+        self.assertIs(future, waiting)
+        self.assertTrue(flights.claim("other")[1])
+
+        flights.resolve("key", "result")
+        self.assertEqual("result", waiting.result(0))
+
+        # Not kept
+        self.assertTrue(flights.claim("key")[1])
+
+    def test_ttl(self):
+        flights = SingleFlight()
+        flights.claim("key")
+        flights.resolve("key", "result", ttl=10)
+
+        future, leader = flights.claim("key")
+        self.assertFalse(leader)
+        self.assertEqual("result", future.result(0))
+
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 11):
+            self.assertTrue(flights.claim("key")[1])
+
+    def test_fail(self):
+        flights = SingleFlight()
+        flights.claim("key")
+        waiting, _ = flights.claim("key")
+
+        flights.fail("key", ValueError("boom"))
+        with self.assertRaisesRegex(ValueError, "boom"):
+            waiting.result(0)
+
+        # Tried again
+        self.assertTrue(flights.claim("key")[1])
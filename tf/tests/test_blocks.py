@@ -2,8 +2,11 @@ from unittest import TestCase
 
 from tf import types as t
 from tf.blocks import Block, SetNestedBlock
+from tf.codec import StateCodec
 from tf.gen import tfplugin_pb2 as pb
-from tf.schema import Attribute
+from tf.schema import Attribute, NestedBlock, NestMode
+from tf.types import Unknown
+from tf.utils import Diagnostics
 
 
 class SetNestedBlockTest(TestCase):
@@ -62,3 +65,103 @@ class SetNestedBlockTest(TestCase):
                 ),
             ),
         )
+
+    def test_equality_nested_blocks(self):
+        set_block = SetNestedBlock(
+            "rule",
+            Block(
+                [Attribute("name", t.String()), Attribute("meta", t.NormalizedJson())],
+                block_types=[SetNestedBlock("port", Block([Attribute("number", t.Number())]))],
+            ),
+        )
+
+        a = [
+            {"name": "a", "meta": {"x": 1, "y": 2}, "port": [{"number": 1}, {"number": 2}]},
+            {"name": "b", "meta": None, "port": []},
+        ]
+        b = [
+            {"name": "b", "meta": None, "port": []},
+            {"name": "a", "meta": {"y": 2, "x": 1}, "port": [{"number": 2}, {"number": 1}]},
+        ]
+        c = [
+            {"name": "a", "meta": {"x": 1, "y": 2}, "port": [{"number": 1}, {"number": 3}]},
+            {"name": "b", "meta": None, "port": []},
+        ]
+
+        self.assertTrue(set_block.semantically_equal(a, b))
+        self.assertEqual(set_block.canonical(a), set_block.canonical(b))
+        self.assertFalse(set_block.semantically_equal(a, c))
+        self.assertNotEqual(set_block.canonical(a), set_block.canonical(c))
+
+        self.assertIsNone(set_block.canonical(None))
+        self.assertIs(set_block.canonical(Unknown), Unknown)
+
+    def test_codec_cached(self):
+        set_block = SetNestedBlock("test", Block([Attribute("name", t.String())]))
+
+        self.assertIs(set_block.codec, set_block.codec)
+        self.assertEqual(list(set_block.codec.attributes), ["name"])
+        self.assertEqual(set_block.decode([{"name": "a"}, {"name": "b"}]), [{"name": "a"}, {"name": "b"}])
+        self.assertEqual(set_block.encode([{"name": "a"}]), [{"name": "a"}])
+
+    def test_duck_typed_attribute(self):
+        class Csv:
+            """A TfType only by its methods"""
+
+            def encode(self, value):
+                return ",".join(value)
+
+            def decode(self, value):
+                return value.split(",")
+
+            def semantically_equal(self, a_decoded, b_decoded) -> bool:
+                return sorted(a_decoded) == sorted(b_decoded)
+
+            def tf_type(self) -> bytes:
+                return b'"string"'
+
+        set_block = SetNestedBlock("rule", Block([Attribute("items", Csv())]))  # pyre-ignore[6]
+        self.assertTrue(set_block.semantically_equal([{"items": ["a", "b"]}], [{"items": ["b", "a"]}]))
+        self.assertFalse(set_block.semantically_equal([{"items": ["a", "b"]}], [{"items": ["a", "c"]}]))
+        self.assertEqual(set_block.canonical([{"items": ["a"]}]), set_block.canonical([{"items": ["a"]}]))
+
+        # Encoding a state compares the old elements with the attribute's own equality instead of failing
+        codec = StateCodec([], [set_block])
+        old = {"rule": [{"items": "a,b"}]}
+        _, decoded = codec.decode(Diagnostics(), old)
+        self.assertEqual(codec.fingerprint(decoded), {})
+        self.assertIs(codec.encode({"rule": [{"items": ["b", "a"]}]}, old)["rule"], old["rule"])
+
+    def test_attribute_overriding_only_semantic_equality(self):
+        class CaseInsensitive(t.String):
+            def semantically_equal(self, a_decoded, b_decoded) -> bool:
+                return a_decoded.lower() == b_decoded.lower()
+
+        set_block = SetNestedBlock("rule", Block([Attribute("name", CaseInsensitive()), Attribute("port", t.Number())]))
+        a = [{"name": "A", "port": 1}, {"name": "b", "port": None}]
+        self.assertTrue(set_block.semantically_equal(a, [{"name": "B", "port": None}, {"name": "a", "port": 1}]))
+        self.assertFalse(set_block.semantically_equal(a, [{"name": "a", "port": 1}, {"name": "a", "port": None}]))
+        self.assertFalse(set_block.semantically_equal(a, [{"name": "a", "port": 1}, {"name": Unknown, "port": None}]))
+        self.assertFalse(set_block.semantically_equal(a, None))
+        self.assertFalse(set_block.semantically_equal(Unknown, a))
+        self.assertTrue(set_block.semantically_equal(None, None))
+
+        codec = StateCodec([], [set_block])
+        old = {"rule": [{"name": "A", "port": 1}]}
+        _, decoded = codec.decode(Diagnostics(), old)
+        self.assertEqual(codec.fingerprint(decoded), {})
+        self.assertIs(
+            codec.encode({"rule": [{"name": "a", "port": 1}]}, old, codec.fingerprint(decoded))["rule"], old["rule"]
+        )
+
+    def test_default_canonical(self):
+        class ListBlock(NestedBlock):
+            def encode(self, value):
+                return value
+
+            def decode(self, value):
+                return value
+
+        block = ListBlock("rule", NestMode.Set, Block([Attribute("name", t.String())]))
+        self.assertNotEqual(block.canonical([{"name": "a"}]), block.canonical([{"name": "b"}]))
+        self.assertEqual(block.canonical([{"name": "a"}]), block.canonical([{"name": "a"}]))
@@ -0,0 +1,298 @@
+from unittest import TestCase, mock
+
+from tf import codec as c
+from tf import types as t
+from tf.blocks import SetNestedBlock
+from tf.codec import EncodeError, LazyState, StateCodec
+from tf.gen import tfplugin_pb2 as pb
+from tf.schema import Attribute, Block, Schema
+from tf.types import Unknown
+from tf.utils import Diagnostics, to_dynamic_value
+
+
+def _codec() -> StateCodec:
+    return StateCodec.from_schema(
+        Schema(
+            attributes=[
+                Attribute("name", t.String(), required=True),
+                Attribute("tags", t.Set(t.String()), optional=True),
+                Attribute("doc", t.NormalizedJson(), optional=True),
+            ],
+            block_types=[
+                SetNestedBlock("rule", Block([Attribute("port", t.Number(), required=True)])),
+            ],
+        )
+    )
+
+
+class StateCodecTest(TestCase):
+    def test_field_tables(self):
+        codec = _codec()
+        self.assertEqual(list(codec.attributes), ["name", "tags", "doc"])
+        self.assertEqual(list(codec.blocks), ["rule"])
+
+        with self.assertRaises(TypeError):
+            codec.attributes["other"] = Attribute("other", t.String())  # pyre-ignore[16]
+
+    def test_decode(self):
+        diags = Diagnostics()
+        raw = {"rule": [{"port": 1}], "name": "a", "doc": '{"b": 1}', "tags": Unknown, "unexpected": 1}
+        encoded, decoded = _codec().decode_dynamic(diags, to_dynamic_value(raw))
+
+        self.assertEqual(encoded, raw)
+        # Attributes come first, then blocks. Unknown fields are dropped.
+        self.assertEqual(
+            list(decoded.items()),
+            [("name", "a"), ("doc", {"b": 1}), ("tags", Unknown), ("rule", [{"port": 1}])],
+        )
+        self.assertFalse(diags.has_errors())
+
+        self.assertEqual(_codec().decode(diags, raw)[1], decoded)
+
+    def test_decode_none(self):
+        self.assertEqual(_codec().decode_dynamic(Diagnostics(), to_dynamic_value(None)), (None, None))
+        self.assertEqual(_codec().decode(Diagnostics(), None), (None, None))
+
+    def test_decode_error(self):
+        diags = Diagnostics()
+        _, decoded = _codec().decode(diags, {"doc": "{not json"})
+
+        self.assertEqual(decoded, {"doc": Unknown})
+        self.assertTrue(diags.has_errors())
+        self.assertEqual(diags.diagnostics[0].path, ["doc"])
+
+    def test_encode_reuses_old_values(self):
+        codec = _codec()
+        old = {"name": "a", "tags": ["x", "y"], "doc": '{"b":1}', "rule": [{"port": 1}, {"port": 2}]}
+        new = {"name": "a", "tags": ["y", "x"], "doc": {"b": 1}, "rule": [{"port": 2}, {"port": 1}]}
+
+        encoded = codec.encode(new, old)
+        for k in old:
+            self.assertIs(encoded[k], old[k], k)
+
+    def test_encode_changed_values(self):
+        codec = _codec()
+        old = {"name": "a", "tags": Unknown, "doc": '{"b":1}', "rule": [{"port": 1}]}
+        new = {"name": "b", "tags": ["x"], "doc": {"b": 2}, "rule": [{"port": 2}]}
+
+        self.assertEqual(
+            codec.encode(new, old),
+            {"name": "b", "tags": ["x"], "doc": '{"b": 2}', "rule": [{"port": 2}]},
+        )
+        self.assertEqual(codec.encode({"name": Unknown}, None), {"name": Unknown})
+        self.assertIsNone(codec.encode(None, old))
+
+    def test_encode_unknown_field(self):
+        with self.assertRaises(EncodeError) as raised:
+            _codec().encode({"nope": 1}, None)
+
+        self.assertEqual(str(raised.exception), "Failed to encode field 'nope': KeyError: 'nope'")
+
+    @mock.patch.object(c, "_SPLICE_MIN_FIELD_BYTES", 1)
+    def test_encode_dynamic_splices_reused_values(self):
+        codec = _codec()
+        # Not how msgpack would encode these values: 1 as a float64 and "a" as a str8
+        raw_name = b"\xd9\x01a"
+        buf = b"\x83\xa4name" + raw_name + b"\xa4tags\x92\xa1x\xa1y\xa3doc\xd9\x07" + b'{"b":1}'
+        old, decoded = codec.decode_dynamic(Diagnostics(), pb.DynamicValue(msgpack=buf))
+        self.assertEqual(decoded, {"name": "a", "tags": ["x", "y"], "doc": {"b": 1}})
+
+        keys = codec.fingerprint(decoded)
+        decoded["tags"].reverse()
+        self.assertEqual(codec.encode_dynamic(decoded, old, keys).msgpack, buf)
+
+        decoded["tags"].append("z")
+        self.assertEqual(
+            codec.encode_dynamic(decoded, old, keys).msgpack,
+            b"\x83\xa4name" + raw_name + b"\xa4tags\x93\xa1y\xa1x\xa1z\xa3doc\xd9\x07" + b'{"b":1}',
+        )
+
+    def test_encode_dynamic_without_wire(self):
+        codec = _codec()
+
+        self.assertEqual(codec.encode_dynamic(None, None), to_dynamic_value(None))
+        self.assertEqual(codec.encode_dynamic({"name": "a"}, {"name": "a"}), to_dynamic_value({"name": "a"}))
+
+    def test_small_fields_are_packed_again(self):
+        codec = _codec()
+        buf = b"\x81\xa4name\xd9\x01a"
+        old, decoded = codec.decode_dynamic(Diagnostics(), pb.DynamicValue(msgpack=buf))
+
+        # Not worth remembering where each field is, "a" is packed again as a fixstr
+        self.assertIs(type(old), dict)
+        self.assertEqual(codec.encode_dynamic(decoded, old).msgpack, b"\x81\xa4name\xa1a")
+
+    def test_canonical(self):
+        codec = _codec()
+        a = {"name": "a", "tags": ["x", "y"], "doc": {"b": 1, "c": 2}, "rule": [{"port": 1}, {"port": 2}]}
+        b = {"rule": [{"port": 2}, {"port": 1}], "doc": {"c": 2, "b": 1}, "tags": ["y", "x"], "name": "a"}
+
+        self.assertEqual(codec.canonical(a), codec.canonical(b))
+        self.assertNotEqual(codec.canonical(a), codec.canonical({**b, "name": "b"}))
+        # Missing fields are the same as null fields
+        self.assertEqual(codec.canonical({}), codec.canonical({"name": None, "tags": None}))
+
+    def test_fingerprint(self):
+        codec = _codec()
+        _, decoded = codec.decode(Diagnostics(), {"name": "a", "tags": ["x"], "doc": Unknown, "rule": []})
+
+        # Attributes are decoded again to compare them, only nested blocks are fingerprinted
+        self.assertEqual(codec.fingerprint(decoded), {"rule": frozenset()})
+        self.assertEqual(codec.fingerprint(None), {})
+
+    def test_encode_with_fingerprint_skips_decoding(self):
+        codec = _codec()
+        old = {"name": "a", "tags": ["x", "y"], "doc": '{"b":1}', "rule": [{"port": 1}, {"port": 2}]}
+        _, decoded = codec.decode(Diagnostics(), old)
+        keys = codec.fingerprint(decoded)
+
+        # Mutating the decoded state after the fingerprint was taken is still seen as a change
+        decoded["tags"].append("z")
+        decoded["rule"][0]["port"] = 3
+
+        with mock.patch.object(SetNestedBlock, "decode") as block_decode:
+            encoded = codec.encode(decoded, old, keys)
+
+        block_decode.assert_not_called()
+        self.assertIs(encoded["doc"], old["doc"])
+        self.assertEqual(encoded["tags"], ["x", "y", "z"])
+        self.assertEqual(encoded["rule"], [{"port": 3}, {"port": 2}])
+
+    def test_overridden_semantic_equality_is_respected(self):
+        class CaseInsensitiveBlock(SetNestedBlock):
+            def semantically_equal(self, a_decoded, b_decoded) -> bool:
+                return sorted(e["name"].lower() for e in a_decoded) == sorted(e["name"].lower() for e in b_decoded)
+
+        block = CaseInsensitiveBlock("rule", Block([Attribute("name", t.String())]))
+        codec = StateCodec([], [block])
+        old = {"rule": [{"name": "ABC"}]}
+        _, decoded = codec.decode(Diagnostics(), old)
+
+        # canonical() was not overridden alongside semantically_equal, so the codec can't use it
+        self.assertFalse(c._trusts_canonical(block))
+        self.assertEqual(codec.fingerprint(decoded), {})
+        self.assertIs(codec.encode({"rule": [{"name": "abc"}]}, old, codec.fingerprint(decoded))["rule"], old["rule"])
+
+    def test_inherited_semantic_equality(self):
+        # List inherits semantically_equal from the TfType protocol
+        self.assertTrue(c._trusts_canonical(t.List(t.String())))
+
+    def test_duck_typed_attribute(self):
+        class Csv:
+            """A TfType only by its methods"""
+
+            def encode(self, value):
+                return ",".join(value)
+
+            def decode(self, value):
+                return value.split(",")
+
+            def semantically_equal(self, a_decoded, b_decoded) -> bool:
+                return sorted(a_decoded) == sorted(b_decoded)
+
+            def tf_type(self) -> bytes:
+                return b'"string"'
+
+        codec = StateCodec([Attribute("items", Csv())], [])  # pyre-ignore[6]
+        _, decoded = codec.decode(Diagnostics(), {"items": "a,b"})
+
+        self.assertFalse(c._trusts_canonical(Csv()))
+        self.assertEqual(codec.encode({"items": ["b", "a"]}, {"items": "a,b"}), {"items": "a,b"})
+
+
+class LazyStateTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.raw = {"doc": '{"b":1}', "name": "a", "tags": ["x", "y"], "rule": [{"port": 1}], "unexpected": 1}
+        self.diags = Diagnostics()
+        self.wire, self.state = _codec().decode_lazy(self.diags, to_dynamic_value(self.raw))
+
+    def test_mapping(self):
+        self.assertIsInstance(self.state, LazyState)
+        self.assertEqual(list(self.state), ["doc", "name", "tags", "rule"])
+        self.assertEqual(len(self.state), 4)
+        self.assertIn("tags", self.state)
+        self.assertNotIn("unexpected", self.state)
+        self.assertNotIn("unexpected", self.wire)
+        self.assertEqual(repr(self.state), "LazyState(['doc', 'name', 'tags', 'rule'])")
+
+        self.assertEqual(dict(self.wire), {k: v for k, v in self.raw.items() if k != "unexpected"})
+        self.assertEqual(len(self.wire), 4)
+        self.assertEqual(bytes(self.wire.raw("name")), b"\xa1a")
+
+        with self.assertRaises(KeyError):
+            self.state["unexpected"]
+
+    def test_decodes_on_access(self):
+        with mock.patch.object(t.NormalizedJson, "decode", return_value={"b": 1}) as json_decode:
+            self.assertEqual(self.state["name"], "a")
+            json_decode.assert_not_called()
+
+            self.assertEqual(self.state["doc"], {"b": 1})
+            self.assertEqual(self.state.get("doc"), {"b": 1})
+            json_decode.assert_called_once_with('{"b":1}')
+
+        self.assertTrue(self.state.is_touched("doc"))
+        self.assertFalse(self.state.is_touched("tags"))
+
+    def test_assign_and_delete(self):
+        self.state["name"] = "b"
+        self.state["extra"] = 1
+        del self.state["rule"]
+
+        self.assertEqual(list(self.state), ["doc", "name", "tags", "extra"])
+        self.assertEqual(self.state["name"], "b")
+        self.assertTrue(self.state.is_touched("rule"))
+        with self.assertRaises(KeyError):
+            self.state["rule"]
+
+    def test_decode_error(self):
+        _, state = _codec().decode_lazy(self.diags, to_dynamic_value({"doc": "{not json"}))
+
+        self.assertFalse(self.diags.has_errors())
+        self.assertIs(state["doc"], Unknown)
+        self.assertTrue(self.diags.has_errors())
+
+    def test_encode_dynamic_untouched_fields(self):
+        codec = _codec()
+        keys = codec.fingerprint(self.state)
+
+        self.state["tags"].append("z")
+
+        # Untouched fields are never unpacked
+        with mock.patch("tf.codec._unpack", side_effect=AssertionError("unpacked")):
+            encoded = codec.encode_dynamic(self.state, self.wire, keys)
+
+        self.assertEqual(
+            encoded,
+            to_dynamic_value({"doc": '{"b":1}', "name": "a", "tags": ["x", "y", "z"], "rule": [{"port": 1}]}),
+        )
+
+    def test_encode_untouched_fields(self):
+        codec = _codec()
+
+        with mock.patch.object(t.NormalizedJson, "decode") as json_decode:
+            encoded = codec.encode(self.state, self.wire, codec.fingerprint(self.state))
+
+        # Untouched fields aren't compared at all
+        json_decode.assert_not_called()
+        self.assertEqual(encoded, {k: v for k, v in self.raw.items() if k != "unexpected"})
+
+    def test_encode_touched_fields(self):
+        codec = _codec()
+        keys = codec.fingerprint(self.state)
+
+        self.state["tags"].append("z")
+        self.state["rule"].reverse()
+        self.state["name"] = "b"
+
+        self.assertEqual(
+            codec.encode(self.state, self.wire, keys),
+            {"doc": '{"b":1}', "name": "b", "tags": ["x", "y", "z"], "rule": [{"port": 1}]},
+        )
+
+    def test_fallback_to_eager(self):
+        codec = _codec()
+
+        self.assertEqual(codec.decode_lazy(Diagnostics(), to_dynamic_value(None)), (None, None))
+        self.assertEqual(codec.decode_lazy(Diagnostics(), pb.DynamicValue(json=b'{"name": "a"}'))[1], {"name": "a"})
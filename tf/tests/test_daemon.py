@@ -0,0 +1,377 @@
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from unittest import TestCase, mock
+
+from tf import daemon
+from tf.runner import _ServerLimits
+from tf.tests.test_provider import ExampleProvider
+
+
+def restore_signals(test: TestCase, *signums: int):
+    for signum in signums:
+        test.addCleanup(signal.signal, signum, signal.getsignal(signum))
+
+
+class DaemonSocketPathTest(TestCase):
+    def test_default(self):
+        with mock.patch.dict(os.environ, {"TF_PLUGIN_DAEMON_SOCKET": ""}):
+            path = daemon.daemon_socket_path("tf.example.com/example/example")
+            other = daemon.daemon_socket_path("tf.example.com/example/other")
+
+        self.assertEqual(Path.home() / ".cache" / "tf-python-provider" / "daemons", path.parent)
+        self.assertEqual(".sock", path.suffix)
+        self.assertNotEqual(path, other)
+
+    def test_env(self):
+        with mock.patch.dict(os.environ, {"TF_PLUGIN_DAEMON_SOCKET": "/run/tf.sock"}):
+            self.assertEqual(Path("/run/tf.sock"), daemon.daemon_socket_path("tf.example.com/example/example"))
+
+
+class LaunchTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.sock_path = Path(tmp.name) / "daemon.sock"
+
+        env = mock.patch.dict(os.environ, {"TF_PLUGIN_DAEMON_SOCKET": str(self.sock_path)})
+        env.start()
+        self.addCleanup(env.stop)
+        restore_signals(self, signal.SIGINT, signal.SIGTERM)
+
+    def fake_daemon(self, replies: list[dict]) -> list:
+        """Accept one launcher, answer with the replies and hang up. Returns the requests it received."""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(self.sock_path))
+        listener.listen()
+        self.addCleanup(listener.close)
+        requests = []
+
+        def serve():
+            conn, _ = listener.accept()
+            with conn:
+                data, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+                for fd in fds:
+                    os.close(fd)
+
+                requests.append((len(fds), json.loads(data[daemon._HEADER.size :])))
+                for reply in replies:
+                    conn.sendall(json.dumps(reply).encode() + b"\n")
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return requests
+
+    def test_fallback(self):
+        fallback = mock.Mock()
+
+        with self.assertRaises(SystemExit) as exit:
+            daemon.launch("tf.example.com/example/example", fallback, ["cmd"])
+
+        fallback.assert_called_once_with()
+        self.assertEqual(0, exit.exception.code)
+
+    def test_daemon_flag(self):
+        # The entrypoint is also how the daemon is started
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(self.sock_path))
+        listener.listen()
+        self.addCleanup(listener.close)
+        fallback = mock.Mock()
+
+        with self.assertRaises(SystemExit):
+            daemon.launch("tf.example.com/example/example", fallback, ["cmd", "--daemon"])
+
+        fallback.assert_called_once_with()
+
+    def test_launch(self):
+        child = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(child.wait)
+        self.addCleanup(child.kill)
+        requests = self.fake_daemon([{"pid": child.pid}, {"exit": 3}])
+        fallback = mock.Mock()
+
+        with self.assertRaises(SystemExit) as exit:
+            daemon.launch("tf.example.com/example/example", fallback, ["cmd", "--stable"], version="1.0")
+
+        self.assertEqual(3, exit.exception.code)
+        fallback.assert_not_called()
+
+        fd_count, request = requests[0]
+        self.assertEqual(3, fd_count)
+        self.assertEqual(["cmd", "--stable"], request["argv"])
+        self.assertEqual(os.getcwd(), request["cwd"])
+        self.assertEqual(str(self.sock_path), request["env"]["TF_PLUGIN_DAEMON_SOCKET"])
+        self.assertEqual("1.0", request["version"])
+
+        # Signals to the launcher are forwarded to the child
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        self.assertEqual(-signal.SIGTERM, child.wait(5))
+        # Even if it already exited
+        signal.getsignal(signal.SIGINT)(signal.SIGINT, None)
+
+    def test_stale_daemon(self):
+        requests = self.fake_daemon([{"stale": "0.9"}])
+        fallback = mock.Mock()
+
+        with self.assertRaises(SystemExit) as exit, contextlib.redirect_stderr(io.StringIO()) as stderr:
+            daemon.launch("tf.example.com/example/example", fallback, ["cmd"], version="1.0")
+
+        # Served here instead
+        self.assertEqual(0, exit.exception.code)
+        fallback.assert_called_once_with()
+        self.assertEqual("1.0", requests[0][1]["version"])
+        self.assertIn("runs version '0.9' rather than '1.0'", stderr.getvalue())
+
+    def test_default_version(self):
+        executable = Path(self.sock_path.parent) / "terraform-provider-example"
+        executable.touch()
+        os.utime(executable, ns=(0, 1234))
+        versions = []
+
+        with mock.patch.dict(os.environ), self.assertRaises(SystemExit):
+            daemon.launch(
+                "tf.example.com/example/example",
+                lambda: versions.append(os.environ["TF_PLUGIN_DAEMON_VERSION"]),
+                [str(executable), "--daemon"],
+            )
+
+        # The daemon serves launchers of the executable it was started from
+        self.assertEqual(["1234"], versions)
+        self.assertEqual("", daemon._default_version("-c"))
+
+    def test_child_died(self):
+        self.fake_daemon([{"pid": 0}])
+
+        with self.assertRaises(SystemExit) as exit:
+            daemon.launch("tf.example.com/example/example", mock.Mock(), ["cmd"])
+
+        self.assertEqual(1, exit.exception.code)
+
+
+class ServeDaemonTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.sock_path = Path(tmp.name) / "daemons" / "daemon.sock"
+        restore_signals(self, signal.SIGCHLD)
+
+    def serve(self, aio: bool) -> mock.Mock:
+        conn = mock.Mock()
+        accepts = [(conn, None), KeyboardInterrupt()]
+        listening = []
+
+        def accept(listener):
+            listening.append(os.stat(self.sock_path).st_mode & 0o777)
+            result = accepts.pop(0)
+            if isinstance(result, BaseException):
+                raise result
+            return result
+
+        with (
+            mock.patch.object(socket.socket, "accept", accept),
+            mock.patch("os.fork", return_value=1234) as fork,
+            mock.patch("tf.runner._load_or_create_cert") as load_cert,
+            contextlib.redirect_stderr(io.StringIO()) as stderr,
+        ):
+            daemon.serve_daemon(
+                ExampleProvider(), ["cmd", "--daemon"], _ServerLimits(), aio=aio, socket_path=self.sock_path
+            )
+
+        self.assertIn(f"listening on {self.sock_path}", stderr.getvalue())
+        self.assertEqual([0o600, 0o600], listening)
+        load_cert.assert_called_once_with()
+        fork.assert_called_once_with()
+        conn.close.assert_called_once_with()
+        self.assertFalse(self.sock_path.exists())
+        self.assertEqual(signal.SIG_IGN, signal.getsignal(signal.SIGCHLD))
+
+    def test_serve(self):
+        self.serve(aio=False)
+
+    def test_serve_aio(self):
+        self.serve(aio=True)
+
+    def test_stale_socket(self):
+        self.sock_path.parent.mkdir(parents=True)
+        self.sock_path.touch()
+        self.serve(aio=False)
+
+
+class ServeChildTest(TestCase):
+    def setUp(self):
+        self.conn, self.launcher = socket.socketpair()
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.launcher.close)
+        restore_signals(self, signal.SIGINT, signal.SIGCHLD)
+
+        self.devnull = os.open(os.devnull, os.O_RDWR)
+        self.addCleanup(os.close, self.devnull)
+
+    def send(self, request: dict, fds: int = 3):
+        data = json.dumps(request).encode()
+        # From a thread, a long request doesn't fit in the socket's buffer
+        thread = threading.Thread(
+            target=socket.send_fds,
+            args=(self.launcher, [daemon._HEADER.pack(len(data)) + data], [self.devnull] * fds),
+            daemon=True,
+        )
+        thread.start()
+        self.addCleanup(thread.join, 5)
+
+    def serve_child(self, run_servicer=None) -> tuple[mock.Mock, list[dict], str]:
+        stack = contextlib.ExitStack()
+        with stack:
+            stack.enter_context(mock.patch("os._exit", side_effect=SystemExit))
+            stack.enter_context(mock.patch("os.setsid"))
+            stack.enter_context(mock.patch("os.chdir"))
+            stack.enter_context(mock.patch.dict(os.environ))
+            stack.enter_context(mock.patch("tf.daemon._exit_on_eof"))
+            dup2 = stack.enter_context(mock.patch("os.dup2"))
+            stack.enter_context(mock.patch("tf.runner._run_servicer", run_servicer))
+            stderr = stack.enter_context(contextlib.redirect_stderr(io.StringIO()))
+
+            with self.assertRaises(SystemExit):
+                daemon._serve_child(self.conn, "servicer", "limits", False, "1.0")
+
+            env = dict(os.environ)
+
+        # In a real child, exiting hangs up
+        self.conn.close()
+        replies = [json.loads(line) for line in self.launcher.makefile("rb")]
+        self.env = env
+        return dup2, replies, stderr.getvalue()
+
+    def test_serve(self):
+        run_servicer = mock.Mock()
+        self.send({"argv": ["cmd"], "env": {"TF_LOG": "trace"}, "cwd": "/", "version": "1.0"})
+
+        dup2, replies, _ = self.serve_child(run_servicer)
+
+        self.assertEqual([{"pid": os.getpid()}, {"exit": 0}], replies)
+        self.assertEqual({"TF_LOG": "trace"}, self.env)
+        self.assertEqual([0, 1, 2], [call.args[1] for call in dup2.call_args_list])
+        self.assertEqual((["cmd"], "limits", False), run_servicer.call_args.args[1:4])
+
+    def test_error(self):
+        self.send({"argv": ["cmd"], "env": {}, "cwd": "/", "version": "1.0"})
+
+        _, replies, stderr = self.serve_child(mock.Mock(side_effect=RuntimeError("boom")))
+
+        self.assertEqual({"exit": 1}, replies[-1])
+        self.assertIn("RuntimeError: boom", stderr)
+
+    def test_interrupted(self):
+        self.send({"argv": ["cmd"], "env": {}, "cwd": "/", "version": "1.0"})
+
+        # Wherever TF's SIGINT lands, e.g. while the handshake is printed
+        _, replies, stderr = self.serve_child(mock.Mock(side_effect=KeyboardInterrupt))
+
+        self.assertEqual({"exit": 0}, replies[-1])
+        self.assertEqual("", stderr)
+        self.assertEqual(signal.SIG_IGN, signal.getsignal(signal.SIGINT))
+
+    def test_other_version(self):
+        run_servicer = mock.Mock()
+        self.send({"argv": ["cmd"], "env": {}, "cwd": "/", "version": "0.9"})
+
+        dup2, replies, stderr = self.serve_child(run_servicer)
+
+        self.assertEqual([{"stale": "1.0"}, {"exit": 0}], replies)
+        self.assertIn("Not serving a launcher of version '0.9'", stderr)
+        dup2.assert_not_called()
+        run_servicer.assert_not_called()
+
+    def test_malformed(self):
+        self.send({"argv": ["cmd"], "env": {}, "cwd": "/", "version": "1.0"}, fds=0)
+
+        _, replies, stderr = self.serve_child()
+
+        self.assertEqual([{"exit": 1}], replies)
+        self.assertIn("Malformed launch request", stderr)
+
+    def test_long_request(self):
+        env = {f"VAR_{i}": "x" * 100 for i in range(2000)}
+        self.send({"argv": ["cmd"], "env": env, "cwd": "/", "version": "1.0"})
+
+        _, replies, _ = self.serve_child(mock.Mock())
+
+        self.assertEqual({"exit": 0}, replies[-1])
+        self.assertEqual(env, self.env)
+
+    def test_launcher_went_away(self):
+        socket.send_fds(self.launcher, [daemon._HEADER.pack(100) + b"{"], [self.devnull] * 3)
+        self.launcher.close()
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr, mock.patch("os._exit", side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                daemon._serve_child(self.conn, "servicer", "limits", False, "1.0")
+
+        self.assertIn("Launcher went away", stderr.getvalue())
+
+    def test_exit_on_eof(self):
+        self.launcher.sendall(b"stray")
+        self.launcher.close()
+
+        with mock.patch("os._exit") as exit:
+            daemon._exit_on_eof(self.conn)
+
+        exit.assert_called_once_with(1)
+
+
+class DaemonEndToEndTest(TestCase):
+    def test_launch(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        env = {
+            **os.environ,
+            "HOME": tmp.name,
+            "TF_PLUGIN_DAEMON_SOCKET": f"{tmp.name}/daemon.sock",
+            "PYTHONPATH": str(Path(__file__).parents[2]),
+        }
+
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from tf.runner import run_provider; from tf.tests.test_provider import ExampleProvider; "
+                "run_provider(ExampleProvider(), ['cmd', '--daemon'])",
+            ],
+            env=env,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(server.wait, 10)
+        self.addCleanup(server.send_signal, signal.SIGINT)
+        self.assertIn("listening on", server.stderr.readline())
+        self.addCleanup(server.stderr.close)
+
+        launcher = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from tf.daemon import launch; launch('tf.example.com/example/example', fallback=print)",
+            ],
+            env=env,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(launcher.stdout.close)
+
+        # The forked child talks to TF directly
+        handshake = launcher.stdout.readline().split("|")
+        self.assertEqual(["1", "6", "unix"], handshake[:3])
+        self.assertTrue(os.path.exists(handshake[3]))
+
+        # Interrupting the launcher stops the child, which exits cleanly
+        launcher.send_signal(signal.SIGINT)
+        self.assertEqual(0, launcher.wait(10))
@@ -1,7 +1,20 @@
 import unittest
-from unittest.mock import Mock
-
-from tf.function import CallContext, Function, FunctionSignature, Parameter, Return
+from unittest.mock import Mock, patch
+
+import msgpack
+
+from tf.function import (
+    CallBatchContext,
+    CallContext,
+    CallPlan,
+    Function,
+    FunctionSignature,
+    Parameter,
+    Return,
+    calls_batch,
+    is_pure,
+)
+from tf.gen import tfplugin_pb2 as pb
 from tf.types import Bool, Number, String
 from tf.utils import Diagnostics
 
@@ -184,6 +197,59 @@ class TestFunctionImplementation(unittest.TestCase):
         self.assertEqual(ctx.diagnostics.diagnostics[0].summary, "Function error")
 
 
+class TestPureFunction(unittest.TestCase):
+    def test_is_pure(self):
+        class PureFunction(ExampleFunction):
+            pure = True
+
+        self.assertFalse(is_pure(ExampleFunction))
+        self.assertTrue(is_pure(PureFunction))
+
+
+class TestCallBatch(unittest.TestCase):
+    def test_default(self):
+        """Without call_batch, each call is made on its own"""
+        contexts = [CallContext(Diagnostics(), "example_add") for _ in range(2)]
+        ctx = CallBatchContext(Diagnostics(), "example_add", contexts)
+
+        self.assertFalse(calls_batch(ExampleFunction))
+        self.assertEqual([3, 7], ExampleFunction(Mock()).call_batch(ctx, [[1, 2], [3, 4]]))
+
+    def test_calls_batch(self):
+        class BatchFunction(ExampleFunction):
+            def call_batch(self, ctx, arguments):
+                return []
+
+        self.assertTrue(calls_batch(BatchFunction))
+
+
+class TestCallPlan(unittest.TestCase):
+    def test_positional(self):
+        plan = CallPlan(ExampleFunction)
+
+        self.assertEqual((2, False), (plan.arity, plan.variadic))
+        self.assertFalse(plan.pure)
+        self.assertFalse(plan.batched)
+        args = plan.decode_arguments([pb.DynamicValue(msgpack=msgpack.packb(1)), pb.DynamicValue(json=b"2")])
+        self.assertEqual([1, 2], args)
+        self.assertEqual(3, msgpack.unpackb(plan.encode_result(3).msgpack))
+
+    def test_variadic(self):
+        plan = CallPlan(StringFunction)
+
+        self.assertEqual((1, True), (plan.arity, plan.variadic))
+        args = plan.decode_arguments([pb.DynamicValue(msgpack=msgpack.packb(s)) for s in ["a", "b", "c"]])
+        self.assertEqual(["a", "b", "c"], args)
+
+    def test_signature_built_once(self):
+        with patch.object(ExampleFunction, "get_signature", wraps=ExampleFunction.get_signature) as get_signature:
+            plan = CallPlan(ExampleFunction)
+            for _ in range(3):
+                plan.decode_arguments([pb.DynamicValue(msgpack=msgpack.packb(1))] * 2)
+
+        get_signature.assert_called_once_with()
+
+
 class TestFunctionIntegration(unittest.TestCase):
     def test_provider_with_functions(self):
         # Create a mock provider that includes functions
@@ -0,0 +1,59 @@
+import subprocess
+import sys
+from pathlib import Path
+from unittest import TestCase
+
+# What a provider imports to define its elements
+ELEMENT_MODULES = ["tf.iface", "tf.schema", "tf.types", "tf.utils", "tf.function", "tf.codec", "tf.blocks"]
+
+# Milliseconds our own modules may spend importing, not counting the standard library and dependencies.
+# Several times what it takes today, so only a real regression (e.g. an eager import of something heavy) trips it.
+BUDGET_MS = 100
+
+
+def import_times(modules: list[str]) -> dict[str, tuple[float, float]]:
+    """Cold import the modules in a new interpreter, returning each module's (self, cumulative) time in ms"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=Path(__file__).parents[2],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+
+    return times
+
+
+class ImportTimeTest(TestCase):
+    def test_no_protobuf(self):
+        """Defining elements doesn't load protobuf, grpc or the generated tf.gen modules"""
+        imported = import_times(ELEMENT_MODULES)
+
+        self.assertIn("tf.iface", imported)
+        heavy = [name for name in imported if name.startswith(("google.protobuf", "grpc", "tf.gen", "cryptography"))]
+        self.assertEqual([], heavy)
+
+    def test_budget(self):
+        # Best of a few runs, a busy machine only ever makes imports slower
+        own_ms = min(
+            sum(self_ms for name, (self_ms, _) in import_times(ELEMENT_MODULES).items() if name.split(".")[0] == "tf")
+            for _ in range(3)
+        )
+
+        self.assertLess(own_ms, BUDGET_MS, f"Importing tf took {own_ms:.1f}ms, over the {BUDGET_MS}ms budget")
+
+    def test_daemon_launcher(self):
+        """The launcher only needs the standard library"""
+        imported = import_times(["tf.daemon"])
+
+        self.assertEqual(["tf", "tf.daemon"], sorted(name for name in imported if name.split(".")[0] == "tf"))
+        self.assertNotIn("msgpack", imported)
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase, mock
+
+from tf import provider as p
+from tf.gen import tfplugin_pb2 as pb
+from tf.metrics import Histogram, Metrics, RpcTimer, current_rpc
+from tf.tests.test_provider import ExampleProvider
+from tf.utils import to_dynamic_value
+
+
+class HistogramTest(TestCase):
+    def test_quantile(self):
+        h = Histogram((1, 2, 4))
+        for value in [0.5, 1, 1.5, 3, 100]:
+            h.observe(value)
+
+        self.assertEqual([2, 1, 1, 1], h.counts)
+        self.assertEqual((5, 106), (h.count, h.sum))
+        self.assertEqual(2, h.quantile(0.5))
+        # Above the last bound
+        self.assertEqual(4, h.quantile(0.99))
+
+
+class RpcTimerTest(TestCase):
+    def test_calls(self):
+        timer = RpcTimer()
+        with mock.patch("time.perf_counter", side_effect=[1, 2, 4, 5]):
+            timer.call_started()
+            timer.call_finished()
+            timer.call_started()
+            timer.call_finished()
+
+        self.assertEqual((1, 5, 2), (timer.first_call, timer.last_return, timer.callback))
+
+
+class MetricsTest(TestCase):
+    def read_data_source(self, metrics: Metrics, servicer: p.ProviderServicer) -> pb.ReadDataSource.Response:
+        request = pb.ReadDataSource.Request(type_name="test_favorite_number", config=to_dynamic_value({}))
+        token = metrics.start("ReadDataSource", request)
+        resp = servicer.ReadDataSource(request, mock.Mock())
+        metrics.finish(token, "ReadDataSource", request, resp)
+        return resp
+
+    def test_stages(self):
+        metrics = Metrics()
+        servicer = p.ProviderServicer(ExampleProvider())
+
+        resp = self.read_data_source(metrics, servicer)
+        # Not shared with the RPC that's next
+        self.assertFalse(current_rpc().first_call)
+
+        request = pb.GetMetadata.Request()
+        metrics.finish(
+            metrics.start("GetMetadata", request), "GetMetadata", request, servicer.GetMetadata(request, mock.Mock())
+        )
+
+        stats = metrics.to_json()
+        read = {name: [s for s in series if s["method"] == "ReadDataSource"] for name, series in stats.items()}
+        self.assertEqual([1] * 6, [len(series) for series in read.values()])
+        self.assertEqual("test_favorite_number", read["tf_rpc_callback_seconds"][0]["type_name"])
+        self.assertEqual(resp.state.ByteSize(), read["tf_rpc_response_bytes"][0]["sum"])
+
+        # No element was called, and nothing was sent in a DynamicValue
+        metadata = {name: [s for s in series if s["method"] == "GetMetadata"] for name, series in stats.items()}
+        self.assertEqual([1, 0, 0, 0, 0, 0], [len(series) for series in metadata.values()])
+
+    def test_async(self):
+        metrics = Metrics()
+        servicer = p.AsyncProviderServicer(ExampleProvider())
+        request = pb.ReadDataSource.Request(type_name="test_favorite_number", config=to_dynamic_value({}))
+
+        async def read():
+            token = metrics.start("ReadDataSource", request)
+            resp = await servicer.ReadDataSource(request, mock.Mock())
+            metrics.finish(token, "ReadDataSource", request, resp)
+
+        asyncio.run(read())
+        self.assertEqual(1, metrics.to_json()["tf_rpc_callback_seconds"][0]["count"])
+
+    def test_function(self):
+        from tf.tests.test_provider import PureFunctionTest
+
+        metrics = Metrics()
+        provider = mock.Mock()
+        provider.get_functions.return_value = [PureFunctionTest.Double]
+        provider.new_function = lambda cls: cls(provider)
+        servicer = p.ProviderServicer(provider)
+
+        request = pb.CallFunction.Request(name="double", arguments=[to_dynamic_value(2)])
+        token = metrics.start("CallFunction", request)
+        resp = servicer.CallFunction(request, mock.Mock())
+        metrics.finish(token, "CallFunction", request, resp)
+
+        stats = metrics.to_json()
+        self.assertEqual("double", stats["tf_rpc_callback_seconds"][0]["type_name"])
+        self.assertEqual(sum(arg.ByteSize() for arg in request.arguments), stats["tf_rpc_request_bytes"][0]["sum"])
+
+    def test_write(self):
+        metrics = Metrics()
+        metrics.observe("tf_rpc_duration_seconds", "ReadResource", "test_math", 0.003)
+        metrics.observe("tf_rpc_duration_seconds", "ReadResource", "test_math", 0.5)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        metrics.write(Path(tmp.name) / "metrics.json")
+        series = json.loads((Path(tmp.name) / "metrics.json").read_text())["tf_rpc_duration_seconds"]
+        self.assertEqual(1, len(series))
+        self.assertEqual(2, series[0]["count"])
+        self.assertEqual(["+Inf", 0], series[0]["buckets"][-1])
+
+        metrics.write(Path(tmp.name) / "metrics.prom")
+        text = (Path(tmp.name) / "metrics.prom").read_text()
+        self.assertIn("# TYPE tf_rpc_duration_seconds histogram\n", text)
+        self.assertIn('tf_rpc_duration_seconds_bucket{method="ReadResource",type_name="test_math",le="+Inf"} 2\n', text)
+        self.assertIn('tf_rpc_duration_seconds_count{method="ReadResource",type_name="test_math"} 2\n', text)
+        self.assertIn("# TYPE tf_rpc_encode_seconds histogram\n", text)
+
+        # Kept in memory only
+        Metrics().close()
@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from tf.pool import PoolMetrics, WorkerPool
+
+
+class WorkerPoolTest(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+
+    def new_pool(self, *args, **kwargs) -> WorkerPool:
+        pool = WorkerPool(*args, **kwargs)
+        self.addCleanup(pool.shutdown)
+        # Runs first, so blocked tasks never hold up the shutdown
+        self.addCleanup(self.release.set)
+        return pool
+
+    def block(self, started: threading.Semaphore):
+        started.release()
+        self.release.wait(5)
+
+    def test_metrics(self):
+        pool = self.new_pool(2)
+        self.assertEqual(pool.metrics(), PoolMetrics(0, 2, 0, 0, 0, 0.0, 0.0))
+
+        started = threading.Semaphore(0)
+        futures = [pool.submit(self.block, started) for _ in range(5)]
+        started.acquire()
+        started.acquire()
+
+        metrics = pool.metrics()
+        self.assertEqual(metrics.workers, 2)
+        self.assertEqual(metrics.tasks, 2)
+        self.assertEqual(metrics.queue_depth, 3)
+        self.assertGreaterEqual(metrics.max_queue_depth, 3)
+
+        self.release.set()
+        for future in futures:
+            future.result(5)
+
+        metrics = pool.metrics()
+        self.assertEqual((metrics.queue_depth, metrics.tasks, metrics.max_workers), (0, 5, 2))
+        self.assertGreater(metrics.max_wait, 0)
+        self.assertGreater(metrics.mean_wait, 0)
+        self.assertLessEqual(metrics.mean_wait, metrics.max_wait)
+
+    def test_adaptive(self):
+        pool = self.new_pool(1, max_workers_limit=3, grow_after=0)
+
+        # A task that waited in the queue grows the pool, so later tasks don't wait behind the blocked one
+        pool.submit(lambda: None).result(5)
+        self.assertEqual(pool.metrics().max_workers, 2)
+
+        started = threading.Semaphore(0)
+        pool.submit(self.block, started)
+        pool.submit(self.block, started)
+        self.assertTrue(started.acquire(timeout=5))
+        self.assertTrue(started.acquire(timeout=5))
+
+        # Capped at the limit
+        pool.submit(lambda: None)
+        self.release.set()
+        pool.shutdown()
+        self.assertEqual(pool.metrics().max_workers, 3)
+        self.assertLessEqual(pool.metrics().workers, 3)
+
+    def test_grows_while_workers_are_stuck(self):
+        pool = self.new_pool(1, max_workers_limit=2, grow_after=0.01)
+        started = threading.Semaphore(0)
+        pool.submit(self.block, started)
+        self.assertTrue(started.acquire(timeout=5))
+
+        # Nothing starts while the only worker is stuck, so it's the next submit that sees the queued task waiting
+        queued = pool.submit(lambda: None)
+        time.sleep(0.02)
+        pool.submit(lambda: None)
+
+        # Well before the stuck task gives up
+        queued.result(1)
+        self.assertEqual(pool.metrics().max_workers, 2)
+
+    def test_fixed_size(self):
+        pool = WorkerPool(1, grow_after=0)
+        pool.submit(lambda: None).result(5)
+        pool.shutdown()
+
+        self.assertEqual(pool.metrics().max_workers, 1)
+        self.assertEqual(pool.max_workers_limit, 1)
+
+    def test_without_executor_internals(self):
+        with mock.patch.object(ThreadPoolExecutor, "__init__", return_value=None):
+            pool = WorkerPool(1, max_workers_limit=4)
+
+        # ThreadPoolExecutor never set _max_workers, growing would have no effect
+        self.assertEqual(pool.max_workers_limit, 1)
+
+    def test_submit_after_shutdown(self):
+        pool = WorkerPool(1)
+        pool.shutdown()
+
+        with self.assertRaises(RuntimeError):
+            pool.submit(lambda: None)
+
+        self.assertEqual(pool.metrics().queue_depth, 0)
@@ -0,0 +1,123 @@
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from unittest import TestCase, mock
+
+import grpc
+
+from tf import provider as p
+from tf.gen import tfplugin_pb2 as pb
+from tf.iface import Config, ReadDataContext, State
+from tf.profiling import Profiler, _is_idle
+from tf.tests.test_provider import FavoriteNumberDataSource
+from tf.utils import to_dynamic_value
+
+
+class SpinningDataSource(FavoriteNumberDataSource):
+    def __init__(self, started: threading.Event, stop: list):
+        self.started = started
+        self.stop = stop
+
+    def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:
+        self.started.set()
+        # Busy, rather than blocked in threading.py
+        while not self.stop:
+            pass
+
+        return {"number": 42}
+
+
+class ProfilerTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def spin(self, target) -> list:
+        """Run the target in a thread until the returned list is appended to"""
+        started, stop = threading.Event(), []
+        thread = threading.Thread(target=target, args=(started, stop))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.append, True)
+        started.wait()
+        return stop
+
+    def read(self, started: threading.Event, stop: list):
+        provider = mock.Mock()
+        provider.get_model_prefix.return_value = "test_"
+        provider.get_data_sources.return_value = [SpinningDataSource]
+        provider.new_data_source = lambda cls: cls(started, stop)
+        request = pb.ReadDataSource.Request(type_name="test_favorite_number", config=to_dynamic_value({}))
+        p.ProviderServicer(provider).ReadDataSource(request, mock.Mock())
+
+    def test_methods(self):
+        profiler = Profiler(self.dir / "profile-{method}.folded")
+
+        def busy(started: threading.Event, stop: list):
+            started.set()
+            while not stop:
+                pass
+
+        def idle(started: threading.Event, stop: list):
+            started.set()
+            threading.Event().wait(0.5)
+
+        for target in [self.read, busy, idle]:
+            self.spin(target)
+        for _ in range(3):
+            profiler._sample()
+
+        profiler.close()
+        self.assertEqual(
+            ["profile-ReadDataSource.folded", "profile-other.folded"], sorted(f.name for f in self.dir.iterdir())
+        )
+
+        [read] = (self.dir / "profile-ReadDataSource.folded").read_text().splitlines()
+        stack, count = read.rsplit(" ", 1)
+        self.assertEqual("3", count)
+        frames = stack.split(";")
+        self.assertTrue(frames[-1].startswith("SpinningDataSource.read ("), frames[-1])
+        self.assertIn("ProviderServicer.ReadDataSource (", stack)
+
+        # The idle thread is left out, this one isn't sampling itself here
+        other = (self.dir / "profile-other.folded").read_text().splitlines()
+        [busy_line] = [line for line in other if "ProfilerTest.test_methods.<locals>.busy (" in line]
+        self.assertTrue(busy_line.endswith(" 3"))
+        self.assertFalse([line for line in other if "<locals>.idle (" in line])
+
+    def test_idle_grpc_server(self):
+        server = grpc.server(thread_pool=mock.Mock())
+        server.add_insecure_port(f"unix:{self.dir}/grpc.sock")
+        server.start()
+        self.addCleanup(lambda: server.stop(None).wait())
+
+        # The server's thread blocks in its completion queue, from grpc/_server.py
+        grpc_frames = []
+        while not grpc_frames:
+            time.sleep(0.001)
+            grpc_frames = [f for f in sys._current_frames().values() if f.f_code.co_filename == grpc._server.__file__]
+
+        profiler = Profiler(self.dir / "profile.folded")
+        profiler._sample()
+        self.assertFalse([stack for _, stack in profiler._counts if stack[-1] is grpc_frames[0].f_code])
+
+        # Only gRPC's own, not any file named _server.py
+        self.assertFalse(_is_idle(compile("", "/src/myprovider/_server.py", "exec").replace(co_name="_serve")))
+
+    def test_one_file(self):
+        path = self.dir / "profile.folded"
+        profiler = Profiler(path, interval=0.001)
+        profiler.start()
+        while not profiler.samples:
+            time.sleep(0.001)
+        profiler.close()
+
+        # At least this thread, while it sleeps
+        lines = path.read_text().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith("other;") for line in lines))
+        self.assertEqual(profiler.samples, sum(int(line.rsplit(" ", 1)[1]) for line in lines))
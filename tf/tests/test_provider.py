@@ -1,6 +1,13 @@
+import asyncio
 import copy
+import functools
 import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+from pathlib import Path
 from typing import Optional, Type
 from unittest import TestCase, mock
 from unittest.mock import Mock, patch
@@ -10,16 +17,24 @@ import msgpack
 
 from tf import blocks, schema, types
 from tf import provider as p
+from tf.function import CallBatchContext, Function, FunctionSignature, Parameter, Return
 from tf.gen import tfplugin_pb2 as pb
 from tf.iface import (
+    AsyncDataSource,
+    AsyncResource,
     Config,
     CreateContext,
     DeleteContext,
     ImportContext,
+    Lifecycle,
+    PlanContext,
     ReadContext,
     ReadDataContext,
+    ReadManyContext,
     State,
     UpdateContext,
+    UpgradeContext,
+    reads_many,
 )
 from tf.provider import DataSource, Diagnostics, Resource
 from tf.types import Unknown
@@ -388,6 +403,110 @@ class OptionalAttributeWithoutDefaultResource(ExampleMathResource):
         )
 
 
+class LazyProvider(ExampleProvider):
+    def get_resources(self) -> list[Type[Resource]]:
+        return [LazyReadResource]
+
+
+class LazyReadResource(ExampleMathResource):
+    lazy_state = True
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "lazy"
+
+    @classmethod
+    def get_schema(cls) -> schema.Schema:
+        return schema.Schema(
+            attributes=[
+                schema.Attribute("a", types.Number(), required=True),
+                schema.Attribute("doc", types.NormalizedJson(), optional=True),
+                schema.Attribute("tags", types.Set(types.String()), optional=True),
+            ],
+        )
+
+    def read(self, ctx: ReadContext, current: State) -> Optional[State]:
+        current["a"] += 1
+        current["tags"].append("new")
+        return current
+
+
+class AsyncProvider(ExampleProvider):
+    def get_data_sources(self) -> list[Type[DataSource]]:
+        return [AsyncFavoriteNumberDataSource, FavoriteNumberDataSource]
+
+    def get_resources(self) -> list[Type[Resource]]:
+        return [AsyncMathResource, ExampleMathResource]
+
+
+class AsyncMathResource(AsyncResource):
+    # Set by tests to hold reads open until every one of them is in flight
+    gate: Optional[asyncio.Event] = None
+    in_flight = 0
+    max_in_flight = 0
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "async_math"
+
+    @classmethod
+    def get_schema(cls) -> schema.Schema:
+        return ExampleMathResource.get_schema()
+
+    def __init__(self, provider: ExampleProvider):
+        self.provider = provider
+
+    async def create(self, ctx: CreateContext, planned: State) -> Optional[State]:
+        await asyncio.sleep(0)
+        return {**planned, "sum": planned["a"] + planned["b"], "product": planned["a"] * planned["b"]}
+
+    async def read(self, ctx: ReadContext, current: State) -> Optional[State]:
+        cls = type(self)
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        if cls.gate is not None:
+            await cls.gate.wait()
+
+        cls.in_flight -= 1
+        return current
+
+    async def update(self, ctx: UpdateContext, current: State, planned: State) -> Optional[State]:
+        return await self.create(CreateContext(ctx.diagnostics, ctx.type_name), planned)
+
+    async def delete(self, ctx: DeleteContext, current: State):
+        ctx.diagnostics.add_warning("Deleted")
+
+    async def plan(self, ctx: PlanContext, current: Optional[State], planned: State) -> Optional[State]:
+        return {**planned, "sum": Unknown, "product": Unknown}
+
+    async def import_(self, ctx: ImportContext, id: str) -> Optional[State]:
+        return {"a": int(id), "b": 0, "sum": int(id), "product": 0}
+
+    async def upgrade(self, ctx: UpgradeContext, version: int, old: State) -> Optional[State]:
+        return {**old, "b": 0}
+
+    async def validate(self, diags: Diagnostics, type_name: str, config: Config):
+        if config.get("a") == 0:
+            diags.add_error("a can't be zero", path=["a"])
+
+
+class AsyncFavoriteNumberDataSource(AsyncDataSource):
+    @classmethod
+    def get_name(cls) -> str:
+        return "async_favorite_number"
+
+    @classmethod
+    def get_schema(cls) -> schema.Schema:
+        return FavoriteNumberDataSource.get_schema()
+
+    def __init__(self, *args):
+        pass
+
+    async def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:
+        await asyncio.sleep(0)
+        return {"number": 7}
+
+
 class AbortError(Exception):
     def __init__(self, code, details):
         self.code = code
@@ -449,6 +568,125 @@ class ServicerContextMock(grpc.ServicerContext):
         raise NotImplementedError()  # ???
 
 
+class BatchReadResource(ExampleMathResource):
+    read_batch_window = 0.05
+    read_batch_size = 5
+
+    # Size of each read_many call, and whether it ran on the main thread
+    batches: list[tuple[int, bool]] = []
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "batch_math"
+
+    def read(self, ctx: ReadContext, current: State) -> Optional[State]:
+        raise AssertionError("Reads should be batched")
+
+    def read_many(self, ctx: ReadManyContext, states: list[State]) -> list[Optional[State]]:
+        type(self).batches.append((len(states), threading.current_thread() is threading.main_thread()))
+        if any(state["a"] == 13 for state in states):
+            raise ValueError("Unlucky")
+
+        ctx.diagnostics.add_warning("Read in a batch")
+        read = []
+        for read_ctx, state in zip(ctx.contexts, states):
+            if state["a"] < 0:
+                read_ctx.diagnostics.add_error("Gone", path=["a"])
+                read.append(None)
+            else:
+                read.append({**state, "sum": state["a"] + state["b"]})
+
+        return read
+
+
+class AsyncBatchReadResource(BatchReadResource):
+    @classmethod
+    def get_name(cls) -> str:
+        return "async_batch_math"
+
+    async def read_many(self, ctx: ReadManyContext, states: list[State]) -> list[Optional[State]]:  # pyre-ignore[15]
+        await asyncio.sleep(0)
+        return super().read_many(ctx, states)
+
+
+class LookupDataSource(FavoriteNumberDataSource):
+    # Set by tests to hold reads open until released
+    gate: Optional[threading.Event] = None
+    reads: list[Config] = []
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "lookup"
+
+    @classmethod
+    def get_schema(cls) -> schema.Schema:
+        return schema.Schema(
+            attributes=[
+                schema.Attribute("name", types.String(), required=True),
+                schema.Attribute("id", types.String(), computed=True),
+            ],
+        )
+
+    def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:
+        type(self).reads.append(config)
+        if self.gate is not None:
+            self.gate.wait(5)
+
+        if config["name"] == "missing":
+            ctx.diagnostics.add_error("Not found")
+            return None
+        if config["name"] == "broken":
+            raise ValueError("Lookup failed")
+
+        return {**config, "id": f"id-{config['name']}"}
+
+
+class CachedLookupDataSource(LookupDataSource):
+    read_cache_ttl = 60
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "cached_lookup"
+
+
+class UnsharedLookupDataSource(LookupDataSource):
+    share_reads = False
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "unshared_lookup"
+
+
+class AsyncLookupDataSource(AsyncDataSource):
+    reads = 0
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "async_lookup"
+
+    @classmethod
+    def get_schema(cls) -> schema.Schema:
+        return LookupDataSource.get_schema()
+
+    def __init__(self, *args):
+        pass
+
+    async def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:
+        type(self).reads += 1
+        await asyncio.sleep(0.01)
+        return {**config, "id": f"id-{config['name']}"}
+
+
+class LookupProvider(ExampleProvider):
+    def get_data_sources(self) -> list[Type[DataSource]]:
+        return [LookupDataSource, CachedLookupDataSource, UnsharedLookupDataSource, AsyncLookupDataSource]
+
+
+class BatchReadProvider(ExampleProvider):
+    def get_resources(self) -> list[Type[Resource]]:
+        return [BatchReadResource, AsyncBatchReadResource, ExampleMathResource]
+
+
 class ProviderTestBase(TestCase):
     def setUp(self):
         super().setUp()
@@ -604,6 +842,73 @@ class GetProviderSchemaTest(ProviderTestBase):
         self.assertEqual(resp1.data_source_schemas, resp2.data_source_schemas)
 
 
+class SchemaCacheProvider(ExampleProvider):
+    cache_key = "1.0.0"
+
+    def get_schema_cache_key(self) -> Optional[str]:
+        return self.cache_key
+
+
+class ProviderSchemaCacheTest(ProviderTestBase):
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.home = Path(tmp.name)
+        self.patch_object(Path, "home", return_value=self.home)
+
+    def test_built_once(self):
+        provider, servicer, ctx = self.provider_servicer_context()
+
+        with mock.patch.object(servicer, "_build_provider_schema", wraps=servicer._build_provider_schema) as build:
+            first = servicer.get_provider_schema_bytes()
+            self.assertIs(servicer.get_provider_schema_bytes(), first)
+            resp = servicer.GetProviderSchema(pb.GetProviderSchema.Request(), ctx)
+
+        build.assert_called_once()
+        self.assertEqual(resp.SerializeToString(), first)
+        # Nothing was written to disk without a cache key
+        self.assertFalse((self.home / ".cache").exists())
+
+    def test_disk_cache(self):
+        provider, servicer, ctx = self.provider_servicer_context(SchemaCacheProvider)
+        schema = servicer.get_provider_schema_bytes()
+
+        path = p._get_schema_cache_path(provider.full_name(), "1.0.0")
+        self.assertTrue(str(path).startswith(str(self.home / ".cache" / "tf-python-provider" / "schemas")))
+        self.assertEqual(path.read_bytes(), schema)
+        self.assertEqual(list(path.parent.iterdir()), [path])
+
+        # A new process reads the cache without building anything
+        provider, servicer, ctx = self.provider_servicer_context(SchemaCacheProvider)
+        with mock.patch.object(servicer, "_build_provider_schema") as build:
+            self.assertEqual(servicer.get_provider_schema_bytes(), schema)
+
+        build.assert_not_called()
+
+        # A different version is a different cache entry
+        self.assertNotEqual(path, p._get_schema_cache_path(provider.full_name(), "1.0.1"))
+
+    def test_errors_not_cached(self):
+        provider, servicer, ctx = self.provider_servicer_context(SchemaCacheProvider)
+
+        with mock.patch.object(provider, "get_provider_schema") as get_provider_schema:
+            get_provider_schema.side_effect = lambda diags: diags.add_error("Broken") and schema.Schema()
+            resp = pb.GetProviderSchema.Response.FromString(servicer.get_provider_schema_bytes())
+
+        self.assertEqual(resp.diagnostics[0].summary, "Broken")
+        self.assertFalse(p._get_schema_cache_path(provider.full_name(), "1.0.0").exists())
+
+    def test_unwritable_cache(self):
+        provider, servicer, ctx = self.provider_servicer_context(SchemaCacheProvider)
+
+        with mock.patch("tempfile.mkstemp", side_effect=PermissionError()):
+            self.assertEqual(
+                servicer.get_provider_schema_bytes(),
+                servicer._build_provider_schema().SerializeToString(),
+            )
+
+
 class ValidateProviderConfigTest(ProviderTestBase):
     def test_happy(self):
         provider, servicer, ctx = self.provider_servicer_context()
@@ -1559,6 +1864,117 @@ class ReadResourceTest(ProviderTestBase):
         )
 
 
+class LazyReadResourceTest(ProviderTestBase):
+    def test_untouched_fields_keep_encoding(self):
+        provider, servicer, ctx = self.provider_servicer_context(LazyProvider)
+
+        with mock.patch.object(types.NormalizedJson, "decode") as json_decode:
+            resp = servicer.ReadResource(
+                pb.ReadResource.Request(
+                    type_name="test_lazy",
+                    current_state=to_dynamic_value({"a": 1, "doc": '{"y": 1,"x":2}', "tags": ["t"]}),
+                ),
+                ctx,
+            )
+
+        json_decode.assert_not_called()
+        self.assert_no_diagnostic_errors(resp)
+        self.assertEqual(
+            read_dynamic_value(resp.new_state),
+            {"a": 2, "doc": '{"y": 1,"x":2}', "tags": ["t", "new"]},
+        )
+
+    def test_no_state(self):
+        provider, servicer, ctx = self.provider_servicer_context(LazyProvider)
+        resp = servicer.ReadResource(
+            pb.ReadResource.Request(type_name="test_lazy", current_state=to_dynamic_value(None)), ctx
+        )
+
+        self.assertEqual(resp.diagnostics[0].summary, "ReadResource test_lazy called with no state")
+
+
+class LifecycleProvider(ExampleProvider):
+    lifecycle = Lifecycle.PerCall
+
+    def get_lifecycle(self, klass) -> Lifecycle:
+        return self.lifecycle
+
+
+class LifecycleTest(ProviderTestBase):
+    def read_data_source(self, servicer, ctx) -> list[p.DataSource]:
+        instances = []
+        new_data_source = servicer.app.new_data_source
+
+        def spy(klass):
+            instances.append(new_data_source(klass))
+            return instances[-1]
+
+        with mock.patch.object(servicer.app, "new_data_source", side_effect=spy):
+            resp = servicer.ReadDataSource(
+                pb.ReadDataSource.Request(type_name="test_favorite_number", config=to_dynamic_value({})), ctx
+            )
+
+        self.assert_no_diagnostic_errors(resp)
+        return instances
+
+    def servicer_with(self, lifecycle: Lifecycle):
+        provider, servicer, ctx = self.provider_servicer_context(LifecycleProvider)
+        provider.lifecycle = lifecycle
+        return servicer, ctx
+
+    def test_per_call(self):
+        servicer, ctx = self.servicer_with(Lifecycle.PerCall)
+        self.assertEqual(len(self.read_data_source(servicer, ctx) + self.read_data_source(servicer, ctx)), 2)
+        self.assertEqual(ExampleProvider().get_lifecycle(FavoriteNumberDataSource), Lifecycle.PerCall)
+
+    def test_singleton(self):
+        servicer, ctx = self.servicer_with(Lifecycle.Singleton)
+        created = []
+
+        def read():
+            created.extend(self.read_data_source(servicer, ctx))
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        read()
+        self.assertEqual(len(created), 1)
+
+    def test_per_thread(self):
+        servicer, ctx = self.servicer_with(Lifecycle.PerThread)
+        created = self.read_data_source(servicer, ctx) + self.read_data_source(servicer, ctx)
+        self.assertEqual(len(created), 1)
+
+        thread = threading.Thread(target=lambda: created.extend(self.read_data_source(servicer, ctx)))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(len(created), 2)
+        self.assertIsNot(created[0], created[1])
+
+    def test_per_thread_under_asyncio(self):
+        provider = LifecycleProvider()
+        provider.lifecycle = Lifecycle.PerThread
+        servicer = p.AsyncProviderServicer(provider)
+        request = pb.ReadDataSource.Request(type_name="test_favorite_number", config=to_dynamic_value({}))
+        created = []
+        new_data_source = provider.new_data_source
+
+        def spy(klass):
+            created.append(new_data_source(klass))
+            return created[-1]
+
+        # Sync reads run in any free worker thread, so they can't share an instance
+        with mock.patch.object(provider, "new_data_source", side_effect=spy):
+            for _ in range(2):
+                self.assert_no_diagnostic_errors(asyncio.run(servicer.ReadDataSource(request, ServicerContextMock())))
+
+        self.assertEqual(len(created), 2)
+
+
 class ValidateResourceConfigTest(ProviderTestBase):
     def test_happy(self):
         provider, servicer, ctx = self.provider_servicer_context()
@@ -2107,6 +2523,121 @@ class CallFunctionTest(ProviderTestBase):
         self.assertEqual(result, "Hello World")
 
 
+class PureFunctionTest(TestCase):
+    class Double(Function):
+        pure = True
+        memo_size = 2
+        calls = 0
+
+        def __init__(self, provider):
+            self.provider = provider
+
+        @classmethod
+        def get_name(cls):
+            return "double"
+
+        @classmethod
+        def get_signature(cls):
+            return FunctionSignature(
+                parameters=[Parameter(name="a", type=types.Number())],
+                return_type=Return(type=types.Number()),
+            )
+
+        def call(self, ctx, arguments):
+            type(self).calls += 1
+            if arguments[0] < 0:
+                ctx.diagnostics.add_error("Negative")
+            return arguments[0] * 2
+
+    def setUp(self):
+        self.func = type("Double", (self.Double,), {"calls": 0})
+        provider = Mock()
+        provider.get_functions.return_value = [self.func]
+        provider.new_function = lambda cls: cls(provider)
+        self.servicer = p.ProviderServicer(provider)
+
+    def call(self, value) -> pb.CallFunction.Response:
+        return self.servicer.CallFunction(
+            pb.CallFunction.Request(name="double", arguments=[pb.DynamicValue(msgpack=msgpack.packb(value))]), Mock()
+        )
+
+    def test_memo(self):
+        self.assertEqual(4, msgpack.unpackb(self.call(2).result.msgpack))
+        self.assertEqual(4, msgpack.unpackb(self.call(2).result.msgpack))
+        self.assertEqual(1, self.func.calls)
+
+        # The least recently used result is forgotten
+        self.call(3)
+        self.call(4)
+        self.call(2)
+        self.assertEqual(4, self.func.calls)
+        self.assertEqual({"double": (1, 4)}, self.servicer.function_memo_stats())
+
+    def test_errors_not_kept(self):
+        self.assertEqual("Negative", self.call(-1).error.text)
+        self.assertEqual("Negative", self.call(-1).error.text)
+        self.assertEqual(2, self.func.calls)
+
+    def test_not_pure(self):
+        self.func.pure = False
+
+        self.call(2)
+        self.call(2)
+        self.assertEqual(2, self.func.calls)
+        self.assertEqual({}, self.servicer.function_memo_stats())
+
+
+class BatchedFunctionTest(TestCase):
+    class Square(Function):
+        call_batch_window = 10
+        call_batch_size = 3
+
+        def __init__(self, provider):
+            self.batches = []
+
+        @classmethod
+        def get_name(cls):
+            return "square"
+
+        @classmethod
+        def get_signature(cls):
+            return FunctionSignature(
+                parameters=[Parameter(name="a", type=types.Number())],
+                return_type=Return(type=types.Number()),
+            )
+
+        def call(self, ctx, arguments):
+            raise AssertionError("Only called in batches")
+
+        def call_batch(self, ctx: CallBatchContext, arguments):
+            self.batches.append(sorted(args[0] for args in arguments))
+            for call_ctx, args in zip(ctx.contexts, arguments):
+                if args[0] < 0:
+                    call_ctx.diagnostics.add_error("Negative")
+            return [args[0] ** 2 for args in arguments]
+
+    def test_call_batch(self):
+        provider = Mock()
+        provider.get_functions.return_value = [self.Square]
+        provider.get_lifecycle.return_value = Lifecycle.Singleton
+        provider.new_function = lambda cls: cls(provider)
+        servicer = p.ProviderServicer(provider)
+
+        def call(value):
+            return servicer.CallFunction(
+                pb.CallFunction.Request(name="square", arguments=[pb.DynamicValue(msgpack=msgpack.packb(value))]),
+                Mock(),
+            )
+
+        # The batch is run as soon as it's full
+        with ThreadPoolExecutor(3) as pool:
+            responses = list(pool.map(call, [2, 3, -1]))
+
+        self.assertEqual([4, 9], [msgpack.unpackb(resp.result.msgpack) for resp in responses[:2]])
+        self.assertEqual("Negative", responses[2].error.text)
+        self.assertEqual([[-1, 2, 3]], servicer._instances.get(self.Square, provider.new_function).batches)
+
+
 class StopProviderTest(ProviderTestBase):
     def test_stop_provider_response(self):
         provider, servicer, ctx = self.provider_servicer_context()
@@ -2216,3 +2747,395 @@ class UpgradeResourceStateTest(ProviderTestBase):
                 ],
             ),
         )
+
+
+class AsyncProviderServicerTest(ProviderTestBase):
+    def setUp(self):
+        super().setUp()
+        self.provider = AsyncProvider()
+        self.servicer = p.AsyncProviderServicer(self.provider)
+        self.ctx = ServicerContextMock()
+
+    def call(self, method: str, request, servicer=None):
+        """Call the RPC on an event loop, the way grpc.aio does"""
+        rpc = getattr(servicer or self.servicer, method)
+        return asyncio.run(rpc(request, self.ctx))
+
+    def test_apply(self):
+        state = {"a": 1, "b": 2, "sum": None, "product": None}
+        created = {"a": 1, "b": 2, "sum": 3, "product": 2}
+
+        resp = self.call(
+            "ApplyResourceChange",
+            pb.ApplyResourceChange.Request(
+                type_name="test_async_math",
+                prior_state=to_dynamic_value(None),
+                planned_state=to_dynamic_value(state),
+            ),
+        )
+        self.assert_no_diagnostic_errors(resp)
+        self.assertEqual(read_dynamic_value(resp.new_state), created)
+
+        resp = self.call(
+            "ApplyResourceChange",
+            pb.ApplyResourceChange.Request(
+                type_name="test_async_math",
+                prior_state=to_dynamic_value(created),
+                planned_state=to_dynamic_value({**state, "a": 2}),
+            ),
+        )
+        self.assertEqual(read_dynamic_value(resp.new_state), {"a": 2, "b": 2, "sum": 4, "product": 4})
+
+        resp = self.call(
+            "ApplyResourceChange",
+            pb.ApplyResourceChange.Request(
+                type_name="test_async_math",
+                prior_state=to_dynamic_value(created),
+                planned_state=to_dynamic_value(None),
+            ),
+        )
+        self.assertEqual([d.summary for d in resp.diagnostics], ["Deleted"])
+        self.assertIsNone(read_dynamic_value(resp.new_state))
+
+    def test_plan(self):
+        resp = self.call(
+            "PlanResourceChange",
+            pb.PlanResourceChange.Request(
+                type_name="test_async_math",
+                prior_state=to_dynamic_value({"a": 1, "b": 2, "sum": 3, "product": 2}),
+                proposed_new_state=to_dynamic_value({"a": 2, "b": 2, "sum": 3, "product": 2}),
+            ),
+        )
+
+        self.assert_no_diagnostic_errors(resp)
+        self.assertEqual(read_dynamic_value(resp.planned_state), {"a": 2, "b": 2, "sum": Unknown, "product": Unknown})
+
+    def test_read_import_upgrade(self):
+        state = {"a": 1, "b": 2, "sum": 3, "product": 2}
+
+        resp = self.call(
+            "ReadResource",
+            pb.ReadResource.Request(type_name="test_async_math", current_state=to_dynamic_value(state)),
+        )
+        self.assertEqual(read_dynamic_value(resp.new_state), state)
+
+        resp = self.call("ImportResourceState", pb.ImportResourceState.Request(type_name="test_async_math", id="5"))
+        self.assertEqual(read_dynamic_value(resp.imported_resources[0].state), {"a": 5, "b": 0, "sum": 5, "product": 0})
+
+        resp = self.call(
+            "UpgradeResourceState",
+            pb.UpgradeResourceState.Request(
+                type_name="test_async_math", version=1, raw_state=pb.RawState(json=json.dumps(state).encode())
+            ),
+        )
+        self.assertEqual(read_dynamic_value(resp.upgraded_state), {**state, "b": 0})
+
+    def test_validate(self):
+        resp = self.call(
+            "ValidateResourceConfig",
+            pb.ValidateResourceConfig.Request(type_name="test_async_math", config=to_dynamic_value({"a": 0})),
+        )
+        self.assertEqual([d.summary for d in resp.diagnostics], ["a can't be zero"])
+
+        resp = self.call(
+            "ValidateDataResourceConfig",
+            pb.ValidateDataResourceConfig.Request(type_name="test_async_favorite_number", config=to_dynamic_value({})),
+        )
+        self.assert_no_diagnostic_errors(resp)
+
+    def test_read_data_source(self):
+        for type_name, number in (("test_async_favorite_number", 7), ("test_favorite_number", 42)):
+            with self.subTest(type_name):
+                resp = self.call(
+                    "ReadDataSource",
+                    pb.ReadDataSource.Request(type_name=type_name, config=to_dynamic_value({})),
+                )
+                self.assertEqual(read_dynamic_value(resp.state), {"number": number})
+
+    def test_sync_elements_run_in_threads(self):
+        loop_thread = []
+
+        def mock_read(ctx, current):
+            loop_thread.append(threading.current_thread())
+
+        self.res_read.side_effect = mock_read
+        resp = self.call(
+            "ReadResource",
+            pb.ReadResource.Request(
+                type_name="test_math", current_state=to_dynamic_value({"a": 1, "b": 2, "sum": 3, "product": 2})
+            ),
+        )
+
+        self.assert_no_diagnostic_errors(resp)
+        self.assertIsNot(loop_thread[0], threading.current_thread())
+
+    def test_concurrent_reads(self):
+        state = to_dynamic_value({"a": 1, "b": 2, "sum": 3, "product": 2})
+
+        async def read_all():
+            gate = AsyncMathResource.gate = asyncio.Event()
+            reads = [
+                asyncio.create_task(
+                    self.servicer.ReadResource(
+                        pb.ReadResource.Request(type_name="test_async_math", current_state=state), self.ctx
+                    )
+                )
+                for _ in range(200)
+            ]
+
+            # Every read is waiting on the gate at once
+            while AsyncMathResource.in_flight < 200:
+                await asyncio.sleep(0)
+
+            gate.set()
+            return await asyncio.gather(*reads)
+
+        self.addCleanup(setattr, AsyncMathResource, "gate", None)
+        resps = asyncio.run(read_all())
+
+        self.assertEqual(AsyncMathResource.max_in_flight, 200)
+        self.assertEqual({r.new_state.msgpack for r in resps}, {state.msgpack})
+
+    def test_errors_are_logged(self):
+        with (
+            mock.patch.object(AsyncMathResource, "read", side_effect=ValueError("boom")),
+            mock.patch("traceback.print_exc") as print_exc,
+            self.assertRaises(ValueError),
+        ):
+            self.call(
+                "ReadResource",
+                pb.ReadResource.Request(type_name="test_async_math", current_state=to_dynamic_value({"a": 1, "b": 2})),
+            )
+
+        print_exc.assert_called_once()
+
+    def test_sync_servicer(self):
+        """The sync server runs async elements to completion"""
+        servicer = p.ProviderServicer(self.provider)
+
+        resp = servicer.ReadDataSource(
+            pb.ReadDataSource.Request(type_name="test_async_favorite_number", config=to_dynamic_value({})), self.ctx
+        )
+        self.assertEqual(read_dynamic_value(resp.state), {"number": 7})
+
+
+class ReadManyTest(ProviderTestBase):
+    def setUp(self):
+        super().setUp()
+        BatchReadResource.batches = []
+        self.addCleanup(setattr, BatchReadResource, "batches", [])
+        self.provider, self.servicer, self.ctx = self.provider_servicer_context(BatchReadProvider)
+
+    def request(self, type_name: str, a: int) -> pb.ReadResource.Request:
+        return pb.ReadResource.Request(
+            type_name=type_name, current_state=to_dynamic_value({"a": a, "b": 1, "sum": None, "product": None})
+        )
+
+    def read_concurrently(self, type_name: str, values: list[int]) -> list:
+        """Call ReadResource from a thread per value, all at once"""
+        barrier = threading.Barrier(len(values))
+        resps: list = [None] * len(values)
+
+        def read(i: int):
+            barrier.wait()
+            try:
+                resps[i] = self.servicer.ReadResource(self.request(type_name, values[i]), self.ctx)
+            except ValueError as exc:
+                resps[i] = exc
+
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(len(values))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return resps
+
+    def assert_read(self, resp, a: int):
+        self.assertEqual({"a": a, "b": 1, "sum": a + 1, "product": None}, read_dynamic_value(resp.new_state))
+        self.assertEqual(["Read in a batch"], [d.summary for d in resp.diagnostics])
+
+    def test_reads_many(self):
+        self.assertTrue(reads_many(BatchReadResource))
+        self.assertFalse(reads_many(ExampleMathResource))
+
+    def test_batches(self):
+        values = list(range(12))
+        resps = self.read_concurrently("test_batch_math", values)
+
+        for a, resp in zip(values, resps):
+            self.assert_read(resp, a)
+
+        sizes = [size for size, _ in BatchReadResource.batches]
+        self.assertEqual(12, sum(sizes))
+        self.assertLessEqual(max(sizes), 5)
+        # Coalesced rather than one call per read
+        self.assertLess(len(sizes), 12)
+
+    def test_single(self):
+        # Nothing else to wait for, the read goes out when the window closes
+        resp = self.servicer.ReadResource(self.request("test_batch_math", 1), self.ctx)
+
+        self.assert_read(resp, 1)
+        self.assertEqual([(1, True)], BatchReadResource.batches)
+
+    def test_diagnostics_per_resource(self):
+        resps = self.read_concurrently("test_batch_math", [1, -1])
+
+        self.assert_read(resps[0], 1)
+        self.assertEqual(read_dynamic_value(resps[1].new_state), None)
+        self.assertEqual(["Gone", "Read in a batch"], [d.summary for d in resps[1].diagnostics])
+
+    def test_error(self):
+        with mock.patch("traceback.print_exc"):
+            resps = self.read_concurrently("test_batch_math", [13, 1])
+
+        # The whole batch fails
+        if len(BatchReadResource.batches) == 1:
+            self.assertIsInstance(resps[1], ValueError)
+        self.assertIsInstance(resps[0], ValueError)
+
+    def test_async_servicer(self):
+        servicer = p.AsyncProviderServicer(self.provider)
+
+        async def read_all(type_name: str):
+            return await asyncio.gather(
+                *(servicer.ReadResource(self.request(type_name, a), self.ctx) for a in range(12))
+            )
+
+        for type_name, on_loop in (("test_async_batch_math", True), ("test_batch_math", False)):
+            with self.subTest(type_name):
+                BatchReadResource.batches = []
+                resps = asyncio.run(read_all(type_name))
+
+                for a, resp in enumerate(resps):
+                    self.assert_read(resp, a)
+
+                # async read_many runs on the event loop, sync read_many in a worker thread
+                self.assertEqual([(5, on_loop), (5, on_loop), (2, on_loop)], BatchReadResource.batches)
+
+    def test_default_read_many(self):
+        resource = ExampleMathResource(self.provider)
+        diags = Diagnostics()
+        ctx = ReadManyContext(diags, "test_math", [ReadContext(diags, "test_math"), ReadContext(diags, "test_math")])
+
+        self.assertEqual([{"a": 1}, {"a": 2}], resource.read_many(ctx, [{"a": 1}, {"a": 2}]))
+        self.assertEqual(2, self.res_read.call_count)
+
+
+class SharedDataSourceReadTest(ProviderTestBase):
+    def setUp(self):
+        super().setUp()
+        LookupDataSource.reads = []
+        self.addCleanup(setattr, LookupDataSource, "reads", [])
+        self.addCleanup(setattr, LookupDataSource, "gate", None)
+        self.provider, self.servicer, self.ctx = self.provider_servicer_context(LookupProvider)
+
+    def request(self, type_name: str, name: str) -> pb.ReadDataSource.Request:
+        return pb.ReadDataSource.Request(type_name=type_name, config=to_dynamic_value({"name": name, "id": None}))
+
+    def read_concurrently(self, type_name: str, names: list[str]) -> list:
+        """Read from a thread per name, holding the reads open until all of them have been made"""
+        gate = LookupDataSource.gate = threading.Event()
+        resps: list = [None] * len(names)
+
+        def read(i: int):
+            try:
+                resps[i] = self.servicer.ReadDataSource(self.request(type_name, names[i]), self.ctx)
+            except ValueError as exc:
+                resps[i] = exc
+
+        flights = self.servicer._data_source_reads
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(len(names))]
+        with (
+            mock.patch("traceback.print_exc"),
+            mock.patch.object(flights, "claim", wraps=flights.claim) as claim,
+        ):
+            for thread in threads:
+                thread.start()
+
+            # Every read is either in read() or has joined one that is
+            shared = p.shares_reads(self.servicer._get_ds_cls(type_name))
+            while (claim.call_count if shared else len(LookupDataSource.reads)) < len(names):
+                time.sleep(0.001)
+            gate.set()
+
+            for thread in threads:
+                thread.join()
+
+        return resps
+
+    def test_shares_reads(self):
+        self.assertTrue(p.shares_reads(LookupDataSource))
+        self.assertFalse(p.shares_reads(UnsharedLookupDataSource))
+
+    def test_concurrent_reads(self):
+        resps = self.read_concurrently("test_lookup", ["a", "a", "a", "b", "a"])
+
+        self.assertEqual(sorted(["a", "b"]), sorted(config["name"] for config in LookupDataSource.reads))
+        for name, resp in zip(["a", "a", "a", "b", "a"], resps):
+            self.assertEqual({"name": name, "id": f"id-{name}"}, read_dynamic_value(resp.state))
+
+        # Nothing is kept after the reads, the next one reads again
+        self.servicer.ReadDataSource(self.request("test_lookup", "a"), self.ctx)
+        self.assertEqual(3, len(LookupDataSource.reads))
+
+    def test_unshared(self):
+        resps = self.read_concurrently("test_unshared_lookup", ["a", "a", "a"])
+
+        self.assertEqual(3, len(LookupDataSource.reads))
+        self.assertEqual(1, len({r.state.msgpack for r in resps}))
+
+    def test_shared_errors(self):
+        resps = self.read_concurrently("test_lookup", ["broken", "broken", "missing", "missing"])
+
+        self.assertEqual(2, len(LookupDataSource.reads))
+        self.assertEqual("Lookup failed", str(resps[0]))
+        self.assertEqual("Lookup failed", str(resps[1]))
+        self.assertEqual(["Not found"], [d.summary for d in resps[3].diagnostics])
+
+    def test_cache_ttl(self):
+        for _ in range(3):
+            resp = self.servicer.ReadDataSource(self.request("test_cached_lookup", "a"), self.ctx)
+            self.assertEqual({"name": "a", "id": "id-a"}, read_dynamic_value(resp.state))
+
+        self.assertEqual(1, len(LookupDataSource.reads))
+
+        # Expired
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            self.servicer.ReadDataSource(self.request("test_cached_lookup", "a"), self.ctx)
+        self.assertEqual(2, len(LookupDataSource.reads))
+
+        # Errors aren't kept
+        for _ in range(2):
+            resp = self.servicer.ReadDataSource(self.request("test_cached_lookup", "missing"), self.ctx)
+            self.assertEqual(["Not found"], [d.summary for d in resp.diagnostics])
+        self.assertEqual(4, len(LookupDataSource.reads))
+
+    def test_cancelled(self):
+        leader = self.servicer._read_data_source(self.request("test_lookup", "a"))
+        follower = self.servicer._read_data_source(self.request("test_lookup", "a"))
+
+        read = next(leader)
+        waiting = next(follower)
+        self.assertIsInstance(read, functools.partial)
+
+        # e.g. grpc.aio cancelled the leader's RPC
+        leader.close()
+        with self.assertRaisesRegex(RuntimeError, "Read of test_lookup was cancelled"):
+            waiting.result(0)
+
+    def test_async_servicer(self):
+        servicer = p.AsyncProviderServicer(self.provider)
+        AsyncLookupDataSource.reads = 0
+        self.addCleanup(setattr, AsyncLookupDataSource, "reads", 0)
+
+        async def read_all():
+            return await asyncio.gather(
+                *(servicer.ReadDataSource(self.request("test_async_lookup", "a"), self.ctx) for _ in range(50))
+            )
+
+        resps = asyncio.run(read_all())
+
+        self.assertEqual(1, AsyncLookupDataSource.reads)
+        self.assertEqual({"name": "a", "id": "id-a"}, read_dynamic_value(resps[-1].state))
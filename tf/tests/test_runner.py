@@ -1,17 +1,28 @@
+import asyncio
+import base64
 import contextlib
 import io
 import json
 import os
+import sys
 import tempfile
+import threading
+import time
 from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from textwrap import dedent
 from unittest import TestCase, mock
 
 import grpc
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
 
 from tf import runner
-from tf.tests.test_provider import ExampleProvider
+from tf.gen import tfplugin_pb2 as pb
+from tf.gen import tfplugin_pb2_grpc as rpc
+from tf.tests.test_provider import AsyncProvider, ExampleProvider
+from tf.utils import read_dynamic_value, to_dynamic_value
 
 
 def mock_grpc_services():
@@ -25,13 +36,23 @@ def mock_grpc_services():
         yield
 
 
+def stopping_server() -> mock.Mock:
+    """A mock gRPC server that TF stops as soon as it's started. Patch grpc.server to return it."""
+    server = mock.Mock()
+
+    def start():
+        interceptors = grpc.server.call_args.kwargs["interceptors"]
+        stopper = next(i for i in interceptors if isinstance(i, runner._ShutdownInterceptor))
+        stopper.intercept_service(lambda details: None, mock.Mock(method="/tfplugin6.Provider/StopProvider"))
+
+    server.start.side_effect = start
+    return server
+
+
 class RunProviderTest(TestCase):
     def test_prod(self):
         provider = ExampleProvider()
-        mock_server = mock.Mock()
-
-        # Three spins of the loop, then we stop (timeout not reached)
-        mock_server.wait_for_termination.side_effect = [True, True, False]
+        mock_server = stopping_server()
 
         with mock.patch.object(grpc, "server", return_value=mock_server) as server_call:
             stdout = io.StringIO()
@@ -48,60 +69,42 @@ class RunProviderTest(TestCase):
         self.assertEqual(fields[2], "unix")
         self.assertIn("py-tf-plugin.sock", fields[3])
         self.assertEqual(fields[4], "grpc")
-        self.assertIn("MIIC", fields[5])  # common start of base64 encoded cert
+        self.assertTrue(fields[5].startswith("MII"))  # common start of a base64 encoded DER cert
 
         server_call.assert_called_once()
         # Should be called three times now - Provider, GRPCController, and GRPCStdio
         self.assertEqual(3, mock_server.add_registered_method_handlers.call_count)
-        self.assertEqual(3, mock_server.wait_for_termination.call_count)
+        mock_server.stop.assert_called_once_with(grace=0.5)
+        mock_server.wait_for_termination.assert_not_called()
 
     def test_close_message(self):
         """Verify that we accept a poison pill to stop the server in"""
-        message = "/tfplugin6.Provider/StopProvider"
-
         provider = ExampleProvider()
         mock_server = mock.Mock()
+        stopped_early = []
 
-        def continuation(handler_call_details):
-            return None
+        def start():
+            interceptors = server_call.call_args.kwargs["interceptors"]
+            stopper = next(i for i in interceptors if isinstance(i, runner._ShutdownInterceptor))
+            stop = threading.Timer(0.01, stopper.intercept_service, (lambda d: None, mock.Mock(method=message)))
+            stop.start()
 
-        with mock.patch.object(grpc, "server", return_value=mock_server) as server_call:
-            wait_count = 0
-
-            def wait_for_termination(*args, **kwargs):
-                """When we pretend to wait for calls, we feed in a shutdown message"""
-                nonlocal wait_count
-                wait_count += 1
-                interceptors = server_call.call_args.kwargs["interceptors"]
-                shutdown_interceptor = [i for i in interceptors if isinstance(i, runner._ShutdownInterceptor)][0]
-                # Give the interceptor a reference to the mock server
-                shutdown_interceptor.server = mock_server
-
-                if wait_count == 1:
-                    # First iteration - set stopped to trigger the break
-                    shutdown_interceptor.intercept_service(continuation, mock.Mock(method=message))
-                    return True  # Return True but stopper.stopped will cause break
-                elif wait_count > 3:
-                    # Safety fallback
-                    return False
-                else:
-                    shutdown_interceptor.intercept_service(continuation, mock.Mock(method="/tfplugin6.Provider/Other"))
-                    return True
-
-            mock_server.wait_for_termination = wait_for_termination
+            stopper.intercept_service(lambda d: None, mock.Mock(method="/tfplugin6.Provider/Other"))
+            stopped_early.append(stopper.wait(0))
 
-            stdout = io.StringIO()
-            with contextlib.redirect_stdout(stdout):
-                runner.run_provider(provider, ["cmd"])
+        mock_server.start.side_effect = start
+
+        for message in ("/tfplugin6.Provider/StopProvider", "/plugin.GRPCController/Shutdown"):
+            with self.subTest(message), mock.patch.object(grpc, "server", return_value=mock_server) as server_call:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    # Blocks until the timer stops the server
+                    runner.run_provider(provider, ["cmd"])
 
-        stdout.getvalue()  # Consume output
-        # The loop should have stopped due to stopper.stopped
-        self.assertEqual(wait_count, 1)
+        self.assertEqual(stopped_early, [False, False])
 
     def test_dev(self):
         provider = ExampleProvider()
-        mock_server = mock.Mock()
-        mock_server.wait_for_termination.return_value = False
+        mock_server = stopping_server()
 
         with mock.patch.object(grpc, "server", return_value=mock_server):
             stdout = io.StringIO()
@@ -112,8 +115,33 @@ class RunProviderTest(TestCase):
         out = stdout.getvalue()
         self.assertIn("export TF_REATTACH_PROVIDERS=", out)
 
-        # Wait for connections indefinitely
-        mock_server.wait_for_termination.assert_called_once_with()
+        # Wait for connections until TF stops the provider
+        mock_server.stop.assert_called_once_with(grace=0.5)
+
+    def test_daemon(self):
+        provider = ExampleProvider()
+
+        with mock.patch("tf.daemon.serve_daemon") as serve_daemon, mock.patch.object(grpc, "server") as server:
+            runner.run_provider(provider, ["cmd", "--daemon"], aio=True, max_workers=3)
+
+        server.assert_not_called()
+        args, kwargs = serve_daemon.call_args
+        self.assertEqual((provider, ["cmd", "--daemon"]), args[:2])
+        self.assertEqual(3, args[2].max_workers)
+        self.assertEqual({"aio": True}, kwargs)
+
+    def test_cached_schema_interceptor(self):
+        servicer = mock.Mock()
+        servicer.get_provider_schema_bytes.return_value = b"schema"
+        interceptor = runner._CachedSchemaInterceptor(servicer)
+
+        continuation = mock.Mock()
+        other = interceptor.intercept_service(continuation, mock.Mock(method="/tfplugin6.Provider/StopProvider"))
+        self.assertIs(other, continuation.return_value)
+
+        handler = interceptor.intercept_service(continuation, mock.Mock(method="/tfplugin6.Provider/GetProviderSchema"))
+        self.assertIsNone(handler.response_serializer)
+        self.assertEqual(handler.unary_unary(b"", None), b"schema")
 
     def test_logger(self):
         def continuation(handler_call_details):
@@ -146,6 +174,335 @@ class RunProviderTest(TestCase):
         self.assertIn("[DEBUG] gRPC method called:", out)
 
 
+class AioServerTest(TestCase):
+    """Serve a provider with grpc.aio and talk to it over the unix socket"""
+
+    def setUp(self):
+        super().setUp()
+        home = tempfile.TemporaryDirectory()
+        self.addCleanup(home.cleanup)
+        self.enterContext(mock.patch.object(Path, "home", return_value=Path(home.name)))
+        self.stdout = self.enterContext(mock.patch("sys.stdout", new_callable=io.StringIO))
+        self.stderr = self.enterContext(mock.patch("sys.stderr", new_callable=io.StringIO))
+
+    def serve(self, argv: list[str]) -> threading.Thread:
+        thread = threading.Thread(
+            target=runner.run_provider, args=(AsyncProvider(), argv), kwargs={"aio": True}, daemon=True
+        )
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def wait_for_output(self, marker: str) -> str:
+        for _ in range(500):
+            out = self.stdout.getvalue()
+            if marker in out:
+                return out
+            time.sleep(0.01)
+
+        self.fail(f"Provider never printed {marker!r}")
+
+    def exercise(self, channel: grpc.Channel, thread: threading.Thread):
+        stub = rpc.ProviderStub(channel)
+
+        schema = stub.GetProviderSchema(pb.GetProviderSchema.Request(), timeout=5)
+        self.assertIn("test_async_favorite_number", schema.data_source_schemas)
+
+        resp = stub.ReadDataSource(
+            pb.ReadDataSource.Request(type_name="test_async_favorite_number", config=to_dynamic_value({})), timeout=5
+        )
+        self.assertEqual(read_dynamic_value(resp.state), {"number": 7})
+
+        stub.StopProvider(pb.StopProvider.Request(), timeout=5)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_dev(self):
+        thread = self.serve(["cmd", "--dev"])
+        out = self.wait_for_output("TF_REATTACH_PROVIDERS")
+
+        conf = json.loads(out.split("TF_REATTACH_PROVIDERS='")[1].split("'")[0])
+        sock_file = conf[ExampleProvider().full_name()]["Addr"]["String"]
+
+        with grpc.insecure_channel(f"unix://{sock_file}") as channel:
+            self.exercise(channel, thread)
+
+    def serve_prod(self):
+        thread = self.serve(["cmd"])
+        fields = self.wait_for_output("|grpc|").splitlines()[0].split("|")
+
+        cert = x509.load_der_x509_certificate(base64.b64decode(fields[5] + "=" * (-len(fields[5]) % 4)))
+        credentials = grpc.ssl_channel_credentials(root_certificates=cert.public_bytes(serialization.Encoding.PEM))
+
+        with grpc.secure_channel(
+            f"unix://{fields[3]}", credentials, options=[("grpc.ssl_target_name_override", "localhost")]
+        ) as channel:
+            self.exercise(channel, thread)
+
+    def test_prod(self):
+        self.serve_prod()
+        self.assertNotIn("[TIMING]", self.stderr.getvalue())
+
+    def test_prod_timing(self):
+        with mock.patch.dict(os.environ, {"TF_PLUGIN_TIMING": "1"}):
+            self.serve_prod()
+
+        self.assertIn("[TIMING] Total startup time", self.stderr.getvalue())
+
+    def test_metrics(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        with mock.patch.dict(os.environ, {"TF_PLUGIN_METRICS": f"{tmp.name}/metrics-{{pid}}.json"}):
+            self.test_dev()
+
+        metrics = json.loads((Path(tmp.name) / f"metrics-{os.getpid()}.json").read_text())
+        self.assertEqual(
+            {"GetProviderSchema", "ReadDataSource", "StopProvider"},
+            {series["method"] for series in metrics["tf_rpc_duration_seconds"]},
+        )
+        [callback] = metrics["tf_rpc_callback_seconds"]
+        self.assertEqual(("ReadDataSource", "test_async_favorite_number", 1), tuple(callback.values())[:3])
+
+    def test_trace(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        with mock.patch.dict(os.environ, {"TF_PLUGIN_TRACE": f"{tmp.name}/trace.jsonl"}):
+            self.test_dev()
+
+        spans = [
+            span
+            for line in (Path(tmp.name) / "trace.jsonl").read_text().splitlines()
+            for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        ]
+        names = [span["name"] for span in spans]
+        self.assertIn("ReadDataSource", names)
+        self.assertIn("AsyncFavoriteNumberDataSource.read", names)
+
+    def test_profile(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        with mock.patch.dict(os.environ, {"TF_PLUGIN_PROFILE": f"{tmp.name}/profile-{{pid}}.folded"}):
+            self.test_dev()
+
+        # Whatever was sampled, written when the provider stopped
+        self.assertTrue((Path(tmp.name) / f"profile-{os.getpid()}.folded").exists())
+
+    def test_keyboard_interrupt(self):
+        def interrupt(coro):
+            coro.close()
+            raise KeyboardInterrupt
+
+        with mock.patch("asyncio.run", side_effect=interrupt) as run:
+            runner.run_provider(ExampleProvider(), ["cmd"], aio=True)
+
+        run.assert_called_once()
+
+
+class ServerLimitsTest(TestCase):
+    def test_defaults(self):
+        with mock.patch.dict(os.environ, clear=True):
+            limits = runner._ServerLimits.resolve()
+
+        self.assertEqual(limits, runner._ServerLimits(10, None, {}, None))
+        self.assertEqual(len(limits.interceptors(mock.Mock(), runner._ShutdownInterceptor())), 3)
+
+    def test_env(self):
+        env = {
+            "TF_PLUGIN_MAX_WORKERS": "32",
+            "TF_PLUGIN_MAX_CONCURRENT_RPCS": "100",
+            "TF_PLUGIN_METHOD_CONCURRENCY": "ReadResource=4, ApplyResourceChange=8",
+            "TF_PLUGIN_ADAPTIVE_MAX_WORKERS": "128",
+        }
+        with mock.patch.dict(os.environ, env):
+            limits = runner._ServerLimits.resolve()
+            # Arguments win over the environment
+            overridden = runner._ServerLimits.resolve(4, 5, {"ReadResource": 1}, 6)
+
+        self.assertEqual(limits, runner._ServerLimits(32, 100, {"ReadResource": 4, "ApplyResourceChange": 8}, 128))
+        self.assertEqual(overridden, runner._ServerLimits(4, 5, {"ReadResource": 1}, 6))
+
+        pool = limits.new_pool()
+        self.addCleanup(pool.shutdown)
+        self.assertEqual((pool.metrics().max_workers, pool.max_workers_limit), (32, 128))
+        self.assertIsInstance(limits.interceptors(mock.Mock(), mock.Mock())[-1], runner._ConcurrencyLimitInterceptor)
+
+    def test_invalid_env(self):
+        for name, value in (
+            ("TF_PLUGIN_MAX_WORKERS", "many"),
+            ("TF_PLUGIN_METHOD_CONCURRENCY", "ReadResource"),
+            ("TF_PLUGIN_METHOD_CONCURRENCY", "ReadResource=x"),
+            ("TF_PLUGIN_METHOD_CONCURRENCY", "=4"),
+        ):
+            with self.subTest(value), mock.patch.dict(os.environ, {name: value}):
+                with self.assertRaises(ValueError) as raised:
+                    runner._ServerLimits.resolve()
+
+                self.assertIn(name, str(raised.exception))
+
+    def test_run_provider(self):
+        mock_server = stopping_server()
+
+        with (
+            mock.patch.object(grpc, "server", return_value=mock_server) as server_call,
+            mock.patch.dict(os.environ, {"TF_PLUGIN_DEBUG": "1"}),
+            mock.patch("sys.stderr", new_callable=io.StringIO) as stderr,
+            contextlib.redirect_stdout(io.StringIO()),
+        ):
+            runner.run_provider(ExampleProvider(), ["cmd", "--dev"], max_workers=3, max_concurrent_rpcs=50)
+
+        kwargs = server_call.call_args.kwargs
+        self.assertEqual(kwargs["maximum_concurrent_rpcs"], 50)
+        self.assertEqual(kwargs["thread_pool"].metrics().max_workers, 3)
+        self.assertIn("[DEBUG] Worker pool: PoolMetrics(", stderr.getvalue())
+
+    def test_metrics(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "metrics.prom"
+
+        with (
+            mock.patch.object(grpc, "server", return_value=stopping_server()) as server_call,
+            mock.patch.dict(os.environ, {"TF_PLUGIN_METRICS": str(path)}),
+            contextlib.redirect_stdout(io.StringIO()),
+        ):
+            runner.run_provider(ExampleProvider(), ["cmd", "--dev"])
+
+        self.assertIsInstance(server_call.call_args.kwargs["interceptors"][0], runner._RecordingInterceptor)
+        self.assertIn("# TYPE tf_rpc_duration_seconds histogram", path.read_text())
+
+    def test_metrics_unwritable(self):
+        with (
+            mock.patch.dict(os.environ, {"TF_PLUGIN_METRICS": "/nonexistent/metrics.json"}),
+            contextlib.redirect_stderr(io.StringIO()) as stderr,
+        ):
+            runner._report_recorders(runner._new_recorders(ExampleProvider()))
+
+        self.assertIn("[ERROR] Could not write /nonexistent/metrics.json", stderr.getvalue())
+
+
+class MetricsInterceptorTest(TestCase):
+    def setUp(self):
+        from tf.metrics import Metrics
+
+        self.metrics = Metrics()
+        self.interceptor = runner._RecordingInterceptor(self.metrics)
+        self.details = mock.Mock(method="/tfplugin6.Provider/ReadResource")
+        self.request = pb.ReadResource.Request(type_name="test_math", current_state=to_dynamic_value({"a": 1}))
+
+    def durations(self) -> list[tuple[str, str, int]]:
+        return [(s["method"], s["type_name"], s["count"]) for s in self.metrics.to_json()["tf_rpc_duration_seconds"]]
+
+    def test_unmeasured(self):
+        stream = grpc.unary_stream_rpc_method_handler(mock.Mock())
+
+        for handler in (None, stream):
+            self.assertIs(self.interceptor.intercept_service(lambda details: handler, self.details), handler)
+
+    def test_sync(self):
+        handler = grpc.unary_unary_rpc_method_handler(lambda request, context: pb.ReadResource.Response())
+        behavior = self.interceptor.intercept_service(lambda details: handler, self.details).unary_unary
+
+        self.assertEqual(pb.ReadResource.Response(), behavior(self.request, None))
+        self.assertEqual([("ReadResource", "test_math", 1)], self.durations())
+        self.assertEqual(
+            self.request.current_state.ByteSize(), self.metrics.to_json()["tf_rpc_request_bytes"][0]["sum"]
+        )
+
+    def test_failed(self):
+        handler = grpc.unary_unary_rpc_method_handler(mock.Mock(side_effect=RuntimeError("boom")))
+        behavior = self.interceptor.intercept_service(lambda details: handler, self.details).unary_unary
+
+        with self.assertRaises(RuntimeError):
+            behavior(self.request, None)
+
+        self.assertEqual([("ReadResource", "test_math", 1)], self.durations())
+        self.assertEqual([], self.metrics.to_json()["tf_rpc_response_bytes"])
+
+    def test_async(self):
+        async def read(request, context):
+            return pb.ReadResource.Response(new_state=to_dynamic_value({"a": 2}))
+
+        handler = grpc.unary_unary_rpc_method_handler(read)
+        behavior = self.interceptor.intercept_service(lambda details: handler, self.details).unary_unary
+
+        asyncio.run(behavior(self.request, None))
+        self.assertEqual([("ReadResource", "test_math", 1)], self.durations())
+        self.assertEqual(1, len(self.metrics.to_json()["tf_rpc_response_bytes"]))
+
+
+class ConcurrencyLimitInterceptorTest(TestCase):
+    def test_unlimited(self):
+        interceptor = runner._ConcurrencyLimitInterceptor({"ReadResource": 2})
+        handler = grpc.unary_unary_rpc_method_handler(mock.Mock())
+
+        for method, h in (
+            ("/tfplugin6.Provider/ApplyResourceChange", handler),
+            ("/tfplugin6.Provider/ReadResource", None),
+            ("/tfplugin6.Provider/ReadResource", grpc.unary_stream_rpc_method_handler(mock.Mock())),
+        ):
+            with self.subTest(method):
+                self.assertIs(interceptor.intercept_service(lambda details: h, mock.Mock(method=method)), h)
+
+    def test_sync(self):
+        running = 0
+        most = 0
+        lock = threading.Lock()
+
+        def behavior(request, context):
+            nonlocal running, most
+            with lock:
+                running += 1
+                most = max(most, running)
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+            return request
+
+        interceptor = runner._ConcurrencyLimitInterceptor({"ReadResource": 2})
+        details = mock.Mock(method="/tfplugin6.Provider/ReadResource")
+        handler = grpc.unary_unary_rpc_method_handler(behavior)
+
+        threads = [
+            threading.Thread(
+                target=lambda: interceptor.intercept_service(lambda d: handler, details).unary_unary(1, None)
+            )
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(most, 2)
+        self.assertEqual(interceptor.intercept_service(lambda d: handler, details).unary_unary(7, None), 7)
+
+    def test_async(self):
+        running = 0
+        most = 0
+
+        async def behavior(request, context):
+            nonlocal running, most
+            running += 1
+            most = max(most, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return request
+
+        interceptor = runner._ConcurrencyLimitInterceptor({"ReadResource": 2})
+        details = mock.Mock(method="/tfplugin6.Provider/ReadResource")
+        handler = grpc.unary_unary_rpc_method_handler(behavior)
+
+        async def call_all():
+            calls = [interceptor.intercept_service(lambda d: handler, details).unary_unary(i, None) for i in range(6)]
+            return await asyncio.gather(*calls)
+
+        self.assertEqual(asyncio.run(call_all()), list(range(6)))
+        self.assertEqual(most, 2)
+
+
 class InstallProviderTest(TestCase):
     def setUp(self):
         super().setUp()
@@ -216,11 +573,17 @@ class InstallProviderTest(TestCase):
 
 
 class ShutdownInterceptorThreadingTest(TestCase):
-    def test_shutdown_with_server_stop(self):
-        """Test that shutdown interceptor stops server after response"""
+    def test_shutdown_wakes_waiter(self):
+        """Test that shutdown interceptor wakes up the thread waiting to stop the server"""
         interceptor = runner._ShutdownInterceptor()
-        mock_server = mock.Mock()
-        interceptor.server = mock_server
+        woke = threading.Event()
+
+        def waiter():
+            interceptor.wait()
+            woke.set()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
 
         # Mock handler details for StopProvider
         handler_details = mock.Mock(method="/tfplugin6.Provider/StopProvider")
@@ -230,38 +593,32 @@ class ShutdownInterceptorThreadingTest(TestCase):
 
         # Call the interceptor
         result = interceptor.intercept_service(continuation, handler_details)
+        thread.join(5)
 
         # Should have returned the response
         self.assertEqual(result, "response")
 
-        # Should have set stopped flag
+        # Should have set stopped flag and woken the waiter
         self.assertTrue(interceptor.stopped)
+        self.assertTrue(woke.is_set())
 
-        # Should have stopped the server
-        mock_server.stop.assert_called_once_with(grace=0)
-
-    def test_shutdown_without_server(self):
-        """Test that shutdown interceptor works even without server reference"""
+    def test_shutdown_callback(self):
+        """Test that shutdown interceptor notifies an event loop, which can't block on wait"""
         interceptor = runner._ShutdownInterceptor()
-        # No server set
-
-        # Mock handler details for StopProvider
-        handler_details = mock.Mock(method="/tfplugin6.Provider/StopProvider")
-
-        def continuation(x):
-            return None
+        interceptor.on_stop = mock.Mock()
 
         # Call the interceptor - should not raise exception
-        interceptor.intercept_service(continuation, handler_details)
+        interceptor.intercept_service(lambda x: None, mock.Mock(method="/plugin.GRPCController/Shutdown"))
 
         # Should have set stopped flag
         self.assertTrue(interceptor.stopped)
+        self.assertTrue(interceptor.wait(0))
+        interceptor.on_stop.assert_called_once_with()
 
     def test_non_stop_provider_method(self):
         """Test that other methods don't trigger shutdown"""
         interceptor = runner._ShutdownInterceptor()
-        mock_server = mock.Mock()
-        interceptor.server = mock_server
+        interceptor.on_stop = mock.Mock()
 
         # Mock handler details for a different method
         handler_details = mock.Mock(method="/tfplugin6.Provider/GetProviderSchema")
@@ -274,10 +631,11 @@ class ShutdownInterceptorThreadingTest(TestCase):
 
         # Should NOT have set stopped flag
         self.assertFalse(interceptor.stopped)
+        self.assertFalse(interceptor.wait(0))
         # Should have called continuation
         self.assertEqual(result, "test_result")
         # Should NOT have called stop
-        mock_server.stop.assert_not_called()
+        interceptor.on_stop.assert_not_called()
 
 
 class SSLCertificateCacheTest(TestCase):
@@ -332,30 +690,7 @@ class SSLCertificateCacheTest(TestCase):
         with open(self.cache_path, "r") as f:
             cached = json.load(f)
 
-        # Create an expired certificate
-        from datetime import datetime, timedelta
-
-        from cryptography import x509
-        from cryptography.hazmat.primitives import hashes, serialization
-        from cryptography.hazmat.primitives.asymmetric import rsa
-
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
-        name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, "localhost")])
-
-        # Create certificate that expired yesterday
-        certificate = (
-            x509.CertificateBuilder()
-            .subject_name(name)
-            .issuer_name(name)
-            .public_key(private_key.public_key())
-            .serial_number(x509.random_serial_number())
-            .not_valid_before(datetime.now() - timedelta(days=2))
-            .not_valid_after(datetime.now() - timedelta(days=1))  # Expired yesterday
-            .sign(private_key, hashes.SHA256())
-        )
-
-        # Update cache with expired cert
-        cached["cert_pem"] = certificate.public_bytes(serialization.Encoding.PEM).decode()
+        cached["not_valid_after"] = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
         with open(self.cache_path, "w") as f:
             json.dump(cached, f)
 
@@ -365,6 +700,70 @@ class SSLCertificateCacheTest(TestCase):
         # Should be different from the original
         self.assertNotEqual(cert_chain1, cert_chain2)
 
+    def test_renews_cert_before_expiry(self):
+        cert_chain1, _ = runner._self_signed_cert()
+
+        cached = json.loads(self.cache_path.read_text())
+        cached["not_valid_after"] = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+        self.cache_path.write_text(json.dumps(cached))
+
+        cert_chain2, _ = runner._self_signed_cert()
+        self.assertNotEqual(cert_chain1, cert_chain2)
+
+    def test_regenerates_cert_without_expiry(self):
+        """Caches written by older versions don't have the expiry alongside the cert"""
+        cert_chain1, _ = runner._self_signed_cert()
+
+        cached = json.loads(self.cache_path.read_text())
+        del cached["not_valid_after"]
+        self.cache_path.write_text(json.dumps(cached))
+
+        cert_chain2, _ = runner._self_signed_cert()
+        self.assertNotEqual(cert_chain1, cert_chain2)
+
+    def test_cached_cert_skips_cryptography(self):
+        cert_chain1, key_pem1, cert_pem1 = runner._load_or_create_cert()
+
+        # Importing cryptography fails
+        with mock.patch.dict(sys.modules, {"cryptography": None}):
+            cert_chain2, key_pem2, cert_pem2 = runner._load_or_create_cert()
+
+        self.assertEqual((cert_chain1, key_pem1, cert_pem1), (cert_chain2, key_pem2, cert_pem2))
+
+    def test_p256_key(self):
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        cert_chain, _, _ = runner._load_or_create_cert()
+        cert = x509.load_der_x509_certificate(cert_chain)
+
+        public_key = cert.public_key()
+        self.assertIsInstance(public_key, ec.EllipticCurvePublicKey)
+        self.assertEqual("secp256r1", public_key.curve.name)
+
+        cached = json.loads(self.cache_path.read_text())
+        self.assertEqual(
+            cert.not_valid_after_utc, datetime.fromisoformat(cached["not_valid_after"]).replace(microsecond=0)
+        )
+
+    def test_parallel_starts(self):
+        """Providers starting at the same time never see a partially written cache"""
+        results = []
+
+        def start():
+            results.append(runner._load_or_create_cert())
+
+        threads = [threading.Thread(target=start) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(8, len(results))
+        cached = json.loads(self.cache_path.read_text())
+        self.assertIn(base64.b64decode(cached["cert_chain"]), [chain for chain, _, _ in results])
+        # No temporary files left behind
+        self.assertEqual([self.cache_path], list(self.cache_path.parent.iterdir()))
+
     def test_regenerates_cert_on_corrupted_cache(self):
         """Test that certificate is regenerated when cache is corrupted"""
         # Create corrupted cache
@@ -393,7 +792,7 @@ class SSLCertificateCacheTest(TestCase):
         original_open = os.open
 
         def mock_open(path, mode, *args, **kwargs):
-            if str(path) == str(self.cache_path) and mode & os.O_WRONLY:
+            if Path(path).parent == self.cache_path.parent and mode & (os.O_WRONLY | os.O_RDWR):
                 raise IOError("Permission denied")
             return original_open(path, mode, *args, **kwargs)
 
@@ -404,13 +803,22 @@ class SSLCertificateCacheTest(TestCase):
             self.assertIsInstance(cert_chain, bytes)
             self.assertIsNotNone(server_creds)
 
+        self.assertFalse(self.cache_path.exists())
+
+    def test_handles_cache_replace_failure(self):
+        with mock.patch("os.replace", side_effect=OSError("Read-only file system")):
+            cert_chain, _, _ = runner._load_or_create_cert()
+
+        self.assertIsInstance(cert_chain, bytes)
+        # The temporary file was cleaned up
+        self.assertEqual([], list(self.cache_path.parent.iterdir()))
+
 
 class TimingDiagnosticsTest(TestCase):
     def test_timing_not_enabled_by_default(self):
         """Test that timing diagnostics are not printed without TF_PLUGIN_TIMING"""
         provider = ExampleProvider()
-        mock_server = mock.Mock()
-        mock_server.wait_for_termination.return_value = False
+        mock_server = stopping_server()
 
         # Don't set TF_PLUGIN_TIMING
         with mock.patch("grpc.server", return_value=mock_server):
@@ -430,8 +838,7 @@ class TimingDiagnosticsTest(TestCase):
     def test_timing_enabled_coverage(self):
         """Test that timing code executes without error when enabled"""
         provider = ExampleProvider()
-        mock_server = mock.Mock()
-        mock_server.wait_for_termination.return_value = False
+        mock_server = stopping_server()
 
         # Test with timing enabled - just ensure it runs without error
         with mock.patch.dict(os.environ, {"TF_PLUGIN_TIMING": "1"}):
@@ -452,12 +859,8 @@ class GRPCControllerTest(TestCase):
         # Import what we need
         from tf.gen import grpc_controller_pb2 as controller_pb
 
-        # Create the GRPCController servicer directly
-        mock_server = mock.Mock()
-
         # Set up the server with interceptors
         stopper = runner._ShutdownInterceptor()
-        stopper.server = mock_server
 
         # Call run_provider in a limited scope to get the GRPCControllerServicer class
         from tf.gen import grpc_controller_pb2_grpc as controller_rpc
@@ -466,7 +869,7 @@ class GRPCControllerTest(TestCase):
         class GRPCControllerServicer(controller_rpc.GRPCControllerServicer):
             def Shutdown(self, request, context):
                 # Return empty response and trigger shutdown
-                stopper.stopped = True
+                stopper.stop()
                 return controller_pb.Empty()
 
         # Test the Shutdown method
@@ -482,7 +885,7 @@ class GRPCControllerTest(TestCase):
     def test_grpc_controller_shutdown(self):
         """Test that GRPCController.Shutdown method works"""
         provider = ExampleProvider()
-        mock_server = mock.Mock()
+        mock_server = stopping_server()
 
         # We need to capture both the stopper and the controller servicer
         captured_stopper = None
@@ -519,9 +922,6 @@ class GRPCControllerTest(TestCase):
         self.assertIsNotNone(controller_servicer)
         self.assertIsNotNone(captured_stopper)
 
-        # Set up the stopper with a mock server
-        captured_stopper.server = mock.Mock()
-
         # Import what we need
         from tf.gen import grpc_controller_pb2 as controller_pb
 
@@ -608,9 +1008,9 @@ class GRPCControllerTest(TestCase):
         self.assertEqual(result, mock_result)
 
     def test_grpc_controller_shutdown_no_server(self):
-        """Test GRPCController Shutdown when server is None - intercept and clear server"""
+        """Test GRPCController Shutdown on a fresh stopper, without going through the interceptor"""
         provider = ExampleProvider()
-        mock_server = mock.Mock()
+        mock_server = stopping_server()
 
         # We need to capture the controller servicer and stopper
         captured_stopper = None
@@ -647,8 +1047,9 @@ class GRPCControllerTest(TestCase):
         self.assertIsNotNone(controller_servicer)
         self.assertIsNotNone(captured_stopper)
 
-        # IMPORTANT: Clear the server reference to test the no-server branch
-        captured_stopper.server = None
+        # IMPORTANT: Reset the stopper so only the Shutdown handler can stop it
+        captured_stopper._stopped.clear()
+        self.assertFalse(captured_stopper.stopped)
 
         # Import what we need
         from tf.gen import grpc_controller_pb2 as controller_pb
@@ -669,7 +1070,7 @@ class GRPCStdioTest(TestCase):
     def test_grpc_stdio_stream(self):
         """Test that GRPCStdio.StreamStdio returns empty iterator"""
         provider = ExampleProvider()
-        mock_server = mock.Mock()
+        mock_server = stopping_server()
 
         # Capture the GRPCStdio servicer
         stdio_servicer = None
@@ -707,15 +1108,11 @@ class KeyboardInterruptTest(TestCase):
         provider = ExampleProvider()
         mock_server = mock.Mock()
 
-        # Make wait_for_termination raise KeyboardInterrupt
-        def wait_side_effect(timeout=None):
-            if timeout == 0.05:  # This is the call in the while loop
-                raise KeyboardInterrupt()
-            return None  # For the prod mode call
-
-        mock_server.wait_for_termination.side_effect = wait_side_effect
-
-        with mock.patch("grpc.server", return_value=mock_server):
+        # Ctrl+C while waiting to be stopped
+        with (
+            mock.patch.object(runner._ShutdownInterceptor, "wait", side_effect=KeyboardInterrupt),
+            mock.patch("grpc.server", return_value=mock_server),
+        ):
             with mock.patch("tf.gen.tfplugin_pb2_grpc.add_ProviderServicer_to_server"):
                 with mock.patch("tf.gen.grpc_controller_pb2_grpc.add_GRPCControllerServicer_to_server"):
                     with mock.patch("tf.gen.grpc_stdio_pb2_grpc.add_GRPCStdioServicer_to_server"):
@@ -728,6 +1125,17 @@ class KeyboardInterruptTest(TestCase):
         # Server.stop should have been called from the KeyboardInterrupt handler
         mock_server.stop.assert_called_once_with(grace=0.5)
 
+    def test_keyboard_interrupt_during_handshake(self):
+        mock_server = mock.Mock()
+
+        with (
+            mock.patch("tf.runner._print_handshake", side_effect=KeyboardInterrupt),
+            mock.patch("tf.runner._add_port", return_value=b"cert"),
+        ):
+            runner._serve(mock_server, ExampleProvider(), ["cmd"], runner._ShutdownInterceptor(), 0.0, False)
+
+        mock_server.stop.assert_called_once_with(grace=0.5)
+
 
 class InstallProviderUpdateTest(InstallProviderTest):
     def test_updates_existing_manifest(self):
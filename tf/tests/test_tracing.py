@@ -0,0 +1,165 @@
+import json
+import tempfile
+from pathlib import Path
+from typing import Optional
+from unittest import TestCase, mock
+
+from tf import provider as p
+from tf.function import CallContext
+from tf.gen import tfplugin_pb2 as pb
+from tf.iface import Config, ReadDataContext, State
+from tf.metrics import Metrics
+from tf.tests.test_provider import FavoriteNumberDataSource
+from tf.tracing import Tracer, _otlp_value, current_span
+from tf.utils import Diagnostics, to_dynamic_value
+
+
+class TracedDataSource(FavoriteNumberDataSource):
+    def read(self, ctx: ReadDataContext, config: Config) -> Optional[State]:
+        with ctx.span.child("lookup", number=42) as span:
+            span.set_attribute("cached", False)
+            if config.get("number") == 0:
+                ctx.diagnostics.add_error("Zero")
+
+        return {"number": 42}
+
+
+class TracerTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "trace.jsonl"
+        self.tracer = Tracer(self.path, "tf.example.com/example/example")
+
+        provider = mock.Mock()
+        provider.get_model_prefix.return_value = "test_"
+        provider.get_data_sources.return_value = [TracedDataSource]
+        provider.new_data_source = lambda cls: cls()
+        self.servicer = p.ProviderServicer(provider)
+
+    def read(self, number: Optional[int] = None, recorders: list = []) -> pb.ReadDataSource.Response:
+        request = pb.ReadDataSource.Request(
+            type_name="test_favorite_number", config=to_dynamic_value({"number": number})
+        )
+        recorders = recorders or [self.tracer]
+        tokens = [recorder.start("ReadDataSource", request) for recorder in recorders]
+        resp = self.servicer.ReadDataSource(request, mock.Mock())
+        for recorder, token in reversed(list(zip(recorders, tokens))):
+            recorder.finish(token, "ReadDataSource", request, resp)
+        return resp
+
+    def spans(self) -> list[dict]:
+        self.tracer.close()
+        spans = []
+        for line in self.path.read_text().splitlines():
+            [resource_spans] = json.loads(line)["resourceSpans"]
+            self.assertEqual(
+                [{"key": "service.name", "value": {"stringValue": "tf.example.com/example/example"}}],
+                resource_spans["resource"]["attributes"],
+            )
+            spans += resource_spans["scopeSpans"][0]["spans"]
+
+        return spans
+
+    def tree(self, spans: list[dict]) -> dict:
+        """Span names by their parent's name"""
+        names = {span["spanId"]: span["name"] for span in spans}
+        tree: dict[str, list[str]] = {}
+        for span in spans:
+            tree.setdefault(names.get(span["parentSpanId"], ""), []).append(span["name"])
+        return tree
+
+    def test_stages(self):
+        self.read()
+
+        spans = self.spans()
+        self.assertEqual(
+            {
+                "": ["tf.example.com/example/example"],
+                "tf.example.com/example/example": ["ReadDataSource"],
+                "ReadDataSource": ["decode", "TracedDataSource.read", "encode"],
+                "TracedDataSource.read": ["lookup"],
+                "encode": ["diagnostics"],
+            },
+            {
+                parent: sorted(children, key=[s["name"] for s in spans].index)
+                for parent, children in self.tree(spans).items()
+            },
+        )
+        self.assertEqual({spans[0]["traceId"]}, {span["traceId"] for span in spans})
+        self.assertTrue(all(int(span["startTimeUnixNano"]) <= int(span["endTimeUnixNano"]) for span in spans))
+
+        [rpc] = [span for span in spans if span["name"] == "ReadDataSource"]
+        self.assertEqual(2, rpc["kind"])
+        self.assertIn({"key": "tf.type_name", "value": {"stringValue": "test_favorite_number"}}, rpc["attributes"])
+        self.assertNotIn("status", rpc)
+
+        [lookup] = [span for span in spans if span["name"] == "lookup"]
+        self.assertEqual(
+            [{"key": "number", "value": {"intValue": "42"}}, {"key": "cached", "value": {"boolValue": False}}],
+            lookup["attributes"],
+        )
+
+        # Nothing leaks into whatever runs next on this thread
+        self.assertFalse(current_span().is_recording())
+
+    def test_errors(self):
+        self.read(0)
+
+        request = pb.GetMetadata.Request()
+        self.tracer.finish(self.tracer.start("GetMetadata", request), "GetMetadata", request, None)
+        request = pb.CallFunction.Request(name="double")
+        response = pb.CallFunction.Response(error=pb.FunctionError(text="Negative"))
+        self.tracer.finish(self.tracer.start("CallFunction", request), "CallFunction", request, response)
+
+        spans = self.spans()
+        by_name = {span["name"]: span for span in spans}
+        self.assertEqual({"code": 2, "message": "1 error diagnostic(s)"}, by_name["ReadDataSource"]["status"])
+        self.assertEqual({"code": 2, "message": "RPC failed"}, by_name["GetMetadata"]["status"])
+        self.assertEqual({"code": 2, "message": "Negative"}, by_name["CallFunction"]["status"])
+        # Never called into an element
+        self.assertEqual(["handle"], self.tree(spans)["GetMetadata"])
+
+    def test_span_error(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.root.child("failing"):
+                raise ValueError("boom")
+
+        span = self.tracer.root.child("ended")
+        self.assertTrue(span.is_recording())
+        span.end()
+        span.end()
+
+        spans = self.spans()
+        self.assertEqual(1, [span["name"] for span in spans].count("ended"))
+        self.assertEqual({"code": 2, "message": "ValueError: boom"}, spans[0]["status"])
+
+    def test_with_metrics(self):
+        metrics = Metrics()
+        self.read(recorders=[metrics, self.tracer])
+
+        self.assertEqual(1, metrics.to_json()["tf_rpc_callback_seconds"][0]["count"])
+        self.assertIn("TracedDataSource.read", [span["name"] for span in self.spans()])
+
+    def test_flush(self):
+        self.tracer.flush_every = 2
+        self.read()
+
+        # Written while running, the rest when closed
+        self.assertTrue(self.path.exists())
+        self.assertEqual(7, len(self.spans()))
+
+    def test_untraced(self):
+        ctx = CallContext(Diagnostics(), "double")
+
+        with ctx.span.child("anything", key="value") as span:
+            span.set_attribute("more", 1)
+            span.record_error("ignored")
+        span.end()
+
+        self.assertFalse(span.is_recording())
+        self.assertFalse(self.path.exists())
+
+    def test_otlp_value(self):
+        self.assertEqual({"doubleValue": 1.5}, _otlp_value(1.5))
+        self.assertEqual({"stringValue": "None"}, _otlp_value(None))
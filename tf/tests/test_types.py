@@ -112,7 +112,7 @@ class TypesTest(TestCase):
         self.assertTrue(set_type.semantically_equal(Unknown, Unknown))
 
     def test_set_semantic_equality_with_dicts(self):
-        # Test with dict elements to ensure string conversion works
+        # Test with dict elements to ensure they are hashed structurally
         set_type = types.Set(types.NormalizedJson())
 
         # Same dicts in same order
@@ -125,3 +125,108 @@ class TypesTest(TestCase):
         self.assertFalse(set_type.semantically_equal([{"a": 1}], [{"a": 1}, {"b": 2}]))
         # Empty lists
         self.assertTrue(set_type.semantically_equal([], []))
+
+    def test_default_canonical(self):
+        class Custom(types.TfType):
+            def encode(self, value):
+                return value
+
+            def decode(self, value):
+                return value
+
+            def tf_type(self) -> bytes:
+                return b'"dynamic"'
+
+        self.assertEqual(Custom().canonical({"a": [1]}), frozenset({("a", (1,))}))
+
+    def test_primitive_canonical(self):
+        for tf_type, value in ((types.Number(), 1.5), (types.String(), "a"), (types.Bool(), True)):
+            with self.subTest(type(tf_type).__name__):
+                self.assertIs(tf_type.canonical(value), value)
+
+    def test_json_canonical(self):
+        json = types.NormalizedJson()
+
+        self.assertEqual(json.canonical([1, {"a": [2]}]), (1, frozenset({("a", (2,))})))
+        self.assertEqual(hash(json.canonical({"a": 1, "b": 2})), hash(json.canonical({"b": 2, "a": 1})))
+        self.assertIsNone(json.canonical(None))
+
+    def test_list_canonical(self):
+        list_type = types.List(types.Set(types.Number()))
+
+        self.assertEqual(list_type.canonical([[1, 2], [3]]), list_type.canonical([[2, 1], [3]]))
+        self.assertNotEqual(list_type.canonical([[1, 2], [3]]), list_type.canonical([[3], [2, 1]]))
+        self.assertIsNone(list_type.canonical(None))
+        self.assertIs(list_type.canonical(Unknown), Unknown)
+
+    def test_set_canonical(self):
+        set_type = types.Set(types.String())
+
+        self.assertEqual(set_type.canonical(["a", "b"]), set_type.canonical(["b", "a"]))
+        self.assertNotEqual(set_type.canonical(["a", "a", "b"]), set_type.canonical(["a", "b", "b"]))
+        self.assertEqual(set_type.canonical(None), set_type.canonical([]))
+        self.assertIs(set_type.canonical(Unknown), Unknown)
+
+    def test_set_semantic_equality_multiset(self):
+        set_type = types.Set(types.Number())
+
+        self.assertFalse(set_type.semantically_equal([1, 1, 2], [1, 2, 2]))
+        self.assertTrue(set_type.semantically_equal(None, []))
+        self.assertTrue(set_type.semantically_equal([], None))
+
+        # Nested sets compare without regard to order at every level
+        nested = types.Set(types.Set(types.String()))
+        self.assertTrue(nested.semantically_equal([["a", "b"], ["c"]], [["c"], ["b", "a"]]))
+
+    def test_set_of_string_subclass(self):
+        class CaseInsensitive(types.String):
+            def canonical(self, value):
+                return value.lower()
+
+        # Only exact primitive element types skip the element keys
+        set_type = types.Set(CaseInsensitive())
+        self.assertTrue(set_type.semantically_equal(["A", "b"], ["B", "a"]))
+        self.assertEqual(set_type.canonical(["A"]), set_type.canonical(["a"]))
+
+    def test_set_semantic_equality_dict_key_order(self):
+        set_type = types.Set(types.NormalizedJson())
+
+        self.assertTrue(set_type.semantically_equal([{"a": 1, "b": 2}], [{"b": 2, "a": 1}]))
+
+    def test_set_of_duck_typed_element(self):
+        class Csv:
+            """A TfType only by its methods"""
+
+            def encode(self, value):
+                return ",".join(value)
+
+            def decode(self, value):
+                return value.split(",")
+
+            def semantically_equal(self, a_decoded, b_decoded) -> bool:
+                return sorted(a_decoded) == sorted(b_decoded)
+
+            def tf_type(self) -> bytes:
+                return b'"string"'
+
+        set_type = types.Set(Csv())  # pyre-ignore[6]
+        self.assertFalse(types._trusts_canonical(set_type))
+        self.assertTrue(set_type.semantically_equal([["a", "b"], ["c"]], [["c"], ["b", "a"]]))
+        self.assertFalse(set_type.semantically_equal([["a"], ["a"]], [["a"], ["b"]]))
+        self.assertEqual(set_type.canonical([["a"], ["b"]]), set_type.canonical([["b"], ["a"]]))
+        self.assertEqual(types.List(Csv()).canonical([["a"]]), (("a",),))  # pyre-ignore[6]
+
+    def test_set_of_type_overriding_only_semantic_equality(self):
+        class CaseInsensitive(types.String):
+            def semantically_equal(self, a_decoded, b_decoded) -> bool:
+                return a_decoded.lower() == b_decoded.lower()
+
+        # String.canonical would tell "A" and "a" apart, so the element's own equality is used
+        set_type = types.Set(CaseInsensitive())
+        self.assertFalse(types._trusts_canonical(CaseInsensitive()))
+        self.assertTrue(set_type.semantically_equal(["A", "b"], ["B", "a"]))
+        self.assertFalse(set_type.semantically_equal(["A", "a"], ["a", "b"]))
+
+        # And it carries through sets of sets
+        nested = types.Set(set_type)
+        self.assertTrue(nested.semantically_equal([["A"], ["b", "c"]], [["C", "B"], ["a"]]))
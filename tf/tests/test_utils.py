@@ -105,3 +105,21 @@ class DiagnosticsTest(TestCase):
             str(diag),
             "error (a -> [1] -> ['stringy']): err summary",
         )
+
+
+class IndexMsgpackMapTest(TestCase):
+    def test_spans(self):
+        buf = utils.to_dynamic_value({"a": 1, "b": [1, {"c": Unknown}], "d": "x"}).msgpack
+        spans = utils._index_msgpack_map(buf)
+
+        self.assertEqual(list(spans), ["a", "b", "d"])
+        self.assertEqual(utils._unpack(memoryview(buf)[slice(*spans["b"])]), [1, {"c": Unknown}])
+        self.assertEqual(utils._unpack(buf[slice(*spans["d"])]), "x")
+
+    def test_not_a_map(self):
+        self.assertIsNone(utils._index_msgpack_map(utils.to_dynamic_value([1, 2]).msgpack))
+
+    def test_pack_map(self):
+        value = {"a": 1, "b": [1, 2], "c": Unknown}
+        self.assertEqual(utils._pack_map(value, {}), utils.to_dynamic_value(value).msgpack)
+        self.assertEqual(utils._pack_map(value, {"b": b"\xc0"}), utils.to_dynamic_value({**value, "b": None}).msgpack)
@@ -0,0 +1,272 @@
+"""
+Tracing spans, recorded when ``TF_PLUGIN_TRACE`` is set (see :func:`~tf.runner.run_provider`).
+
+Every RPC gets a span, with a child span for each stage: decoding the request, each call into the resource,
+data source or function (named after the method called), and encoding the response. Converting diagnostics
+gets a span of its own within the stage it happens in. Element code can add its own spans under the
+current one through its context's ``span``:
+
+.. code-block:: python
+
+    def read(self, ctx: ReadContext, current_state: State) -> Optional[State]:
+        with ctx.span.child("describe_instance", instance_id=current_state["id"]):
+            ...
+
+All the spans of a provider process belong to one trace. They are appended to the file as lines of
+OTLP JSON (an ``ExportTraceServiceRequest`` per line), the format the OpenTelemetry Collector's file exporter
+writes and its ``otlpjsonfile`` receiver reads, so no collector needs to run alongside TF.
+"""
+
+import json
+import random
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Optional
+
+from tf.metrics import RpcTimer, _current_rpc
+
+# OTLP span kinds and status codes
+_KIND_INTERNAL = 1
+_KIND_SERVER = 2
+_STATUS_ERROR = 2
+
+
+class Span:
+    """
+    A timed operation, a subset of OpenTelemetry's ``Span``.
+
+    Use :meth:`child` to start a span within this one. Used as a context manager, a span is the current span
+    (what contexts' ``span`` returns) until the block exits, and is ended then.
+    """
+
+    def __init__(
+        self,
+        tracer: Optional["Tracer"],
+        name: str,
+        trace_id: str,
+        parent_id: str = "",
+        kind: int = _KIND_INTERNAL,
+        attributes: Optional[dict[str, Any]] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._token: Any = None
+
+    def child(self, name: str, **attributes) -> "Span":
+        """Start a span within this one"""
+        return Span(self.tracer, name, self.trace_id, self.span_id, attributes=attributes)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, message: str):
+        """Mark the span as failed"""
+        self.error = message
+
+    def is_recording(self) -> bool:
+        return True
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.export(self)  # pyre-ignore[16]
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.record_error(f"{exc_type.__name__}: {exc}")
+        self.end()
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.error is not None:
+            span["status"] = {"code": _STATUS_ERROR, "message": self.error}
+
+        return span
+
+
+class _NoSpan(Span):
+    """Stands in when nothing is being traced, so element code can use spans unconditionally"""
+
+    def __init__(self):
+        super().__init__(None, "", "")
+
+    def child(self, name: str, **attributes) -> Span:
+        return self
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_error(self, message: str):
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> Span:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_current_span: ContextVar[Span] = ContextVar("tf_current_span", default=_NoSpan())
+
+
+def current_span() -> Span:
+    """The innermost span of the RPC being served, a span that records nothing unless tracing is enabled"""
+    return _current_span.get()
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _call_name(call: Any) -> str:
+    """Name of the element method a step calls, e.g. ``ExampleResource.read``"""
+    func = getattr(call, "func", call)
+    return getattr(func, "__qualname__", None) or type(call).__name__
+
+
+class _TracedRpc(RpcTimer):
+    """Splits an RPC's span into stages as the servicer calls into the element"""
+
+    def __init__(self, span: Span, outer: RpcTimer):
+        super().__init__()
+        self.span = span
+        self.outer = outer  # E.g. the metrics' timer, which still needs to hear about calls
+        self.calls = 0
+        self.stage = self._start_stage("decode")
+
+    def _start_stage(self, name: str) -> Span:
+        stage = self.span.child(name)
+        _current_span.set(stage)
+        return stage
+
+    def call_started(self, call: Any = None):
+        self.outer.call_started(call)
+        self.calls += 1
+        self.stage.end()
+        self.stage = self._start_stage(_call_name(call))
+
+    def call_finished(self):
+        self.stage.end()
+        self.stage = self._start_stage("encode")
+        self.outer.call_finished()
+
+    def finish(self):
+        if not self.calls:
+            # Never called into an element, so there's nothing to tell decoding and encoding apart
+            self.stage.name = "handle"
+        self.stage.end()
+        self.span.end()
+
+
+class Tracer:
+    """
+    Records the spans of every RPC served, and appends them to a file as OTLP JSON.
+
+    :param path: File to append the spans to
+    :param service_name: Reported as the ``service.name`` of the spans, e.g. the provider's full name
+    :param flush_every: Write the spans out once this many have ended
+    """
+
+    def __init__(self, path: Path, service_name: str, flush_every: int = 512):
+        self.path = path
+        self.service_name = service_name
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._ended: list[Span] = []
+
+        # Every RPC of the process is part of one trace
+        self.root = Span(self, service_name, f"{random.getrandbits(128):032x}")
+
+    def export(self, span: Span):
+        with self._lock:
+            self._ended.append(span)
+            if len(self._ended) < self.flush_every:
+                return
+            spans, self._ended = self._ended, []
+
+        self._write(spans)
+
+    def start(self, method: str, request: Any) -> Any:
+        """Start the span of an RPC on this thread or task, returning a token to :meth:`finish` it with"""
+        type_name = getattr(request, "type_name", None) or getattr(request, "name", "")
+        attributes = {"rpc.method": method, "tf.type_name": type_name}
+        span = Span(self, method, self.root.trace_id, self.root.span_id, _KIND_SERVER, attributes)
+        outer_span = _current_span.get()
+        return _current_rpc.set(_TracedRpc(span, _current_rpc.get())), outer_span
+
+    def finish(self, token: Any, method: str, request: Any, response: Any):
+        """End the span of an RPC started with :meth:`start`. A failed RPC has no response."""
+        rpc_token, outer_span = token
+        rpc = _current_rpc.get()
+        _current_rpc.reset(rpc_token)
+        _current_span.set(outer_span)
+
+        span = rpc.span  # pyre-ignore[16]
+        if response is None:
+            span.record_error("RPC failed")
+        elif hasattr(response, "error") and response.HasField("error"):
+            # CallFunction
+            span.record_error(response.error.text)
+        else:
+            errors = sum(d.severity == d.ERROR for d in getattr(response, "diagnostics", []))
+            if errors:
+                span.set_attribute("tf.diagnostics.errors", errors)
+                span.record_error(f"{errors} error diagnostic(s)")
+
+        rpc.finish()  # pyre-ignore[16]
+
+    def close(self):
+        """End the process' span and write out everything that hasn't been yet"""
+        self.root.end()
+        with self._lock:
+            spans, self._ended = self._ended, []
+
+        self._write(spans)
+
+    def _write(self, spans: list[Span]):
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": _otlp_value(self.service_name)}]},
+                    "scopeSpans": [{"scope": {"name": "tf"}, "spans": [span.to_otlp() for span in spans]}],
+                }
+            ]
+        }
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(request) + "\n")
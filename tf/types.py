@@ -1,6 +1,9 @@
 import json
+import operator
 from abc import abstractmethod
-from typing import Any, Protocol
+from collections import Counter
+from functools import cached_property
+from typing import Any, Callable, Hashable, Protocol, Sequence
 
 # https://github.com/zclconf/go-cty/blob/0b7ccb8423606ba894cc0e3b71375386e4d564de/cty/json.go#L104
 # https://github.com/opentofu/opentofu/blob/0d1e6cd5f0a23e9abdff8a583dce25c54c3701b3/docs/plugin-protocol/object-wire-format.md
@@ -27,11 +30,65 @@ class TfType(Protocol):
         """
         return a_decoded == b_decoded
 
+    def canonical(self, value: Any) -> Hashable:
+        """
+        Return a hashable key for a Python-type value (represented by the implementing type).
+        Semantically equal values must have equal keys, which lets collections of values be compared by hashing.
+        """
+        return _freeze(value)
+
     @abstractmethod
     def tf_type(self) -> bytes:
         """Return the TF type pattern"""
 
 
+def _freeze(value: Any) -> Hashable:
+    """Structurally convert a decoded value into a hashable equivalent"""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+
+    return value
+
+
+def _trusts_canonical(obj: Any) -> bool:
+    """Canonical keys can only replace semantically_equal if they were defined alongside (or after) it"""
+    mro = type(obj).__mro__
+    # Types only have to satisfy TfType structurally, and may not define canonical at all
+    key_owner = next((k for k in mro if "canonical" in k.__dict__), None)
+    if key_owner is None:
+        return False
+
+    eq_owner = next((k for k in mro if "semantically_equal" in k.__dict__), None)
+    # Not issubclass: the owner may be the TfType protocol, which doesn't support it
+    if eq_owner is not None and mro.index(key_owner) > mro.index(eq_owner):
+        return False
+
+    # Collections key their values by their elements' keys, so those must be trusted too
+    return getattr(obj, "_keys_trusted", True)
+
+
+def _canonical_of(t: Any) -> Callable[[Any], Hashable]:
+    """The key function of a type, or a structural one if it doesn't define canonical"""
+    return getattr(t, "canonical", _freeze)
+
+
+def _pair_up(a: Sequence, b: Sequence, equal: Callable[[Any, Any], bool]) -> bool:
+    """Match every element in a with a distinct equal element in b, for values without trustworthy keys"""
+    unmatched = list(b)
+    for x in a:
+        for i, y in enumerate(unmatched):
+            if equal(x, y):
+                del unmatched[i]
+                break
+        else:
+            return False
+
+    return not unmatched
+
+
 class Number(TfType):
     """
     Numbers are numeric values. They can be integers or floats.
@@ -47,6 +104,9 @@ class Number(TfType):
     def decode(self, value: Any) -> Any:
         return value  # native
 
+    def canonical(self, value: Any) -> Hashable:
+        return value  # native values are already hashable
+
     def tf_type(self) -> bytes:
         return _T_INT
 
@@ -60,6 +120,9 @@ class String(TfType):
     def decode(self, value: Any) -> Any:
         return value  # native
 
+    def canonical(self, value: Any) -> Hashable:
+        return value  # native values are already hashable
+
     def tf_type(self) -> bytes:
         return _T_STR
 
@@ -73,6 +136,9 @@ class Bool(TfType):
     def decode(self, value: Any) -> Any:
         return value  # native
 
+    def canonical(self, value: Any) -> Hashable:
+        return value  # native values are already hashable
+
     def tf_type(self) -> bytes:
         return _T_BOOL
 
@@ -101,6 +167,10 @@ class NormalizedJson(String):
         # since json.loads/dumps with sort_keys normalizes the data
         return a_decoded == b_decoded
 
+    def canonical(self, value: Any) -> Hashable:
+        # Objects are key-order independent, just like the normalized encoding
+        return _freeze(value)
+
 
 class List(TfType):
     """
@@ -124,6 +194,16 @@ class List(TfType):
 
         return [self.element_type.decode(v) for v in value]
 
+    def canonical(self, value: Any) -> Hashable:
+        if value is None or value is Unknown:
+            return value
+
+        return tuple(map(_canonical_of(self.element_type), value))
+
+    @cached_property
+    def _keys_trusted(self) -> bool:
+        return _trusts_canonical(self.element_type)
+
     def tf_type(self) -> bytes:
         t = self.element_type.tf_type().decode()
         return f'["list",{t}]'.encode()
@@ -146,13 +226,24 @@ class Set(List):
         t = self.element_type.tf_type().decode()
         return f'["set",{t}]'.encode()
 
+    def canonical(self, value: Any) -> Hashable:
+        if value is Unknown:
+            return value
+
+        # Order doesn't matter, but duplicates do, so the key is a multiset of element keys.
+        # None is the same as an empty set.
+        if type(self.element_type) in _NATIVE_TYPES:
+            return frozenset(Counter(value or ()).items())
+
+        return frozenset(Counter(map(_canonical_of(self.element_type), value or ())).items())
+
     def semantically_equal(self, a_decoded, b_decoded) -> bool:
         if a_decoded is b_decoded:  # None or Unknown or literally the same
             return True
 
-        # Convert to lists to handle both set and list inputs
-        a = list(a_decoded) if a_decoded is not None else []
-        b = list(b_decoded) if b_decoded is not None else []
+        # None is the same as an empty set
+        a = a_decoded if a_decoded is not None else ()
+        b = b_decoded if b_decoded is not None else ()
 
         if len(a) != len(b):
             return False
@@ -161,10 +252,21 @@ class Set(List):
             return True
 
         # For sets, order doesn't matter, so we need to check that
-        # every element in a has a matching element in b
-        # Convert to string for comparison since all TF values can be stringified
-        return sorted(map(str, a)) == sorted(map(str, b))
+        # every element in a has a matching element in b (as many times)
+        if type(self.element_type) in _NATIVE_TYPES:
+            return Counter(a) == Counter(b)
+
+        if self._keys_trusted:
+            key = self.element_type.canonical
+            return Counter(map(key, a)) == Counter(map(key, b))
+
+        # Keys could be missing or disagree with the element type's own equality, so compare each pair
+        equal = getattr(self.element_type, "semantically_equal", operator.eq)
+        return _pair_up(a, b, equal)
+
 
+# Exact classes whose values are their own canonical keys, subclasses (eg NormalizedJson) may transform values
+_NATIVE_TYPES = (Number, String, Bool)
 
 # Map
 # Object
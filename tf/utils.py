@@ -1,12 +1,20 @@
 import json
-from typing import Any, Optional, Tuple, cast
+import os
+from functools import cache
+from typing import TYPE_CHECKING, Any, Mapping, Optional, Tuple, cast
 
 import msgpack
 from msgpack.ext import ExtType
 
-from tf.gen import tfplugin_pb2 as pb
 from tf.types import Unknown
 
+# tf.gen loads the whole protobuf runtime, so it's only imported when talking to TF.
+# Providers (and their tests) that only define elements never load it.
+if TYPE_CHECKING:  # pragma: no cover
+    from pathlib import Path
+
+    from tf.gen import tfplugin_pb2 as pb
+
 
 def _msgpack_default(obj: Any) -> Any:
     if obj is Unknown:
@@ -22,18 +30,97 @@ def _msgpack_ext_hook(code, data) -> Any:
     return ExtType(code, data)
 
 
-def read_dynamic_value(value: pb.DynamicValue) -> Any:
+def read_dynamic_value(value: "pb.DynamicValue") -> Any:
     if value.json:
         return json.loads(value.json)
 
     if value.msgpack:
-        return msgpack.unpackb(value.msgpack, ext_hook=_msgpack_ext_hook)
+        return _unpack(value.msgpack)
 
     return None
 
 
-def to_dynamic_value(value: Any) -> pb.DynamicValue:
-    return pb.DynamicValue(msgpack=msgpack.packb(value, default=_msgpack_default) if value is not None else None)
+def _index_msgpack_map(buf: bytes) -> Optional[dict[str, Tuple[int, int]]]:
+    """
+    Find the byte span of each value in a msgpack-encoded map without decoding the values.
+    Returns None if the buffer is not a map.
+    """
+    unpacker = msgpack.Unpacker(ext_hook=_msgpack_ext_hook)
+    unpacker.feed(buf)
+
+    try:
+        n = unpacker.read_map_header()
+    except ValueError:
+        return None
+
+    spans = {}
+    for _ in range(n):
+        key = unpacker.unpack()
+        start = unpacker.tell()
+        unpacker.skip()
+        spans[key] = (start, unpacker.tell())
+
+    return spans
+
+
+def _unpack(buf: bytes | memoryview) -> Any:
+    return msgpack.unpackb(buf, ext_hook=_msgpack_ext_hook)
+
+
+def _pack_map(value: dict[str, Any], spliced: Mapping[str, bytes | memoryview]) -> bytes:
+    """Pack a map, using the already-packed bytes in `spliced` as the values of those keys"""
+    if not spliced:
+        return msgpack.packb(value, default=_msgpack_default)
+
+    packer = msgpack.Packer(default=_msgpack_default)
+    out = bytearray(packer.pack_map_header(len(value)))
+
+    for k, v in value.items():
+        out += packer.pack(k)
+        raw = spliced.get(k)
+        out += packer.pack(v) if raw is None else raw
+
+    return bytes(out)
+
+
+@cache
+def _pb():
+    """The generated protocol module, imported on first use rather than when tf is imported"""
+    from tf.gen import tfplugin_pb2
+
+    return tfplugin_pb2
+
+
+@cache
+def _severities_pb() -> Mapping[str, "pb.Diagnostic.Severity.ValueType"]:
+    pb = _pb()
+    return {
+        Diagnostic.ERROR: pb.Diagnostic.ERROR,
+        Diagnostic.WARNING: pb.Diagnostic.WARNING,
+        Diagnostic.INVALID: pb.Diagnostic.INVALID,
+    }
+
+
+def to_dynamic_value(value: Any) -> "pb.DynamicValue":
+    return _pb().DynamicValue(msgpack=msgpack.packb(value, default=_msgpack_default) if value is not None else None)
+
+
+def _write_atomic(path: "Path", data: bytes):
+    """Write a file so concurrent readers only ever see a complete file. Failing to write is not an error."""
+    import tempfile
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        path.with_name(os.path.basename(tmp)).unlink(missing_ok=True)
 
 
 AttributePath = list[str | Tuple[str | int]]
@@ -44,12 +131,6 @@ class Diagnostic:
     WARNING = "warning"
     INVALID = "invalid"  # is this used?
 
-    _map = {
-        "error": pb.Diagnostic.ERROR,
-        "warning": pb.Diagnostic.WARNING,
-        "invalid": pb.Diagnostic.INVALID,
-    }
-
     def __init__(self, severity: str, summary: str, detail: Optional[str] = None, path: Optional[AttributePath] = None):
         self.severity = severity
         self.summary = summary
@@ -64,9 +145,9 @@ class Diagnostic:
     def warning(cls, summary: str, detail: str = "", path: Optional[AttributePath] = None):
         return cls(cls.WARNING, summary, detail, path)
 
-    def to_pb(self) -> pb.Diagnostic:
+    def to_pb(self) -> "pb.Diagnostic":
         fields = {
-            "severity": self._map[self.severity],
+            "severity": _severities_pb()[self.severity],
             "summary": self.summary,
             "detail": self.detail,
         }
@@ -74,7 +155,7 @@ class Diagnostic:
         if self.path:
             fields["attribute"] = _to_attribute_path(self.path)
 
-        return pb.Diagnostic(**fields)
+        return _pb().Diagnostic(**fields)
 
     def __str__(self):
         path = (
@@ -86,14 +167,15 @@ class Diagnostic:
         return f"{self.severity}{path}: {self.summary}{detail}"
 
 
-def _to_attribute_path(path: AttributePath) -> pb.AttributePath:
+def _to_attribute_path(path: AttributePath) -> "pb.AttributePath":
     # TODO: Support str-index, int-index
     # If an element is "stringy" then we assume its an attribute name
     # If it's (123,) or ("elstring",) then we assume it's an int/str index
-    return pb.AttributePath(steps=[_path_step(step) for step in path])
+    return _pb().AttributePath(steps=[_path_step(step) for step in path])
 
 
-def _path_step(step_value: str | Tuple[str | int]) -> pb.AttributePath.Step:
+def _path_step(step_value: str | Tuple[str | int]) -> "pb.AttributePath.Step":
+    pb = _pb()
     if isinstance(step_value, tuple):
         return (
             pb.AttributePath.Step(element_key_string=cast(str, step_value[0]))
@@ -116,8 +198,11 @@ class Diagnostics:
         self.diagnostics.append(Diagnostic.warning(*args, **kwargs))
         return self
 
-    def to_pb(self) -> list[pb.Diagnostic]:
-        return [d.to_pb() for d in self.diagnostics]
+    def to_pb(self) -> list["pb.Diagnostic"]:
+        from tf.tracing import current_span
+
+        with current_span().child("diagnostics"):
+            return [d.to_pb() for d in self.diagnostics]
 
     def has_errors(self) -> bool:
         return any(d.severity == Diagnostic.ERROR for d in self.diagnostics)